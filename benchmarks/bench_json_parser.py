@@ -0,0 +1,135 @@
+"""
+Compares the current response parsing (json.loads, raw_decode from the first
+brace, then a single StreamingJSONParser pass) against the previous
+json.loads + regex fallback chain on large and malformed optimizer responses,
+both on whole responses and when fed chunk by chunk while streaming.
+
+Usage:
+    python benchmarks/bench_json_parser.py [--repeat N] [--size-kb KB]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.optimizer import ELEMENT_KEYS, PromptOptimizer
+from src.utils.stream_parser import StreamingJSONParser
+
+# Parsing doesn't touch the provider; skip its construction
+_OPTIMIZER = PromptOptimizer.__new__(PromptOptimizer)
+
+
+def legacy_parse(content):
+    """The fallback chain formerly used by PromptOptimizer._parse_json_response."""
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        match = re.search(r'```json\s*(\{.*?\})\s*```', content, re.DOTALL)
+        if match:
+            try:
+                return json.loads(match.group(1))
+            except json.JSONDecodeError:
+                pass
+        match = re.search(r'(\{.*\})', content, re.DOTALL)
+        if match:
+            try:
+                return json.loads(match.group(1))
+            except json.JSONDecodeError:
+                pass
+        return None
+
+
+_STRING_FIELD_RE = re.compile(r'"(\w+)"\s*:\s*"((?:[^"\\]|\\.)*)"', re.DOTALL)
+
+
+def legacy_stream(chunks):
+    """Regex rescan of the growing buffer after every chunk (previous streaming path)."""
+    buffer = ""
+    scan_pos = 0
+    fields = 0
+    for chunk in chunks:
+        buffer += chunk
+        for match in _STRING_FIELD_RE.finditer(buffer, scan_pos):
+            scan_pos = match.end()
+            fields += 1
+    return legacy_parse(buffer), fields
+
+
+def new_parse(content):
+    """Current PromptOptimizer parsing chain, minus the error fallback."""
+    return _OPTIMIZER._try_parse_json(content)
+
+
+def new_stream(chunks):
+    parser = StreamingJSONParser()
+    fields = 0
+    for chunk in chunks:
+        fields += len(parser.feed(chunk))
+    return parser.close(), fields
+
+
+def make_document(size_kb):
+    # Spread the payload over the elements and the final prompt
+    per_field = max(1, size_kb * 1024 // (len(ELEMENT_KEYS) + 4))
+    filler = ("Lorem ipsum \"dolor\" sit amet, {consectetur} adipiscing elit.\n" * (per_field // 60 + 1))[:per_field]
+    return {
+        "elements": {key: f"{key}: {filler}" for key in ELEMENT_KEYS},
+        "final_prompt": filler * 4,
+    }
+
+
+def make_cases(size_kb):
+    doc = make_document(size_kb)
+    body = json.dumps(doc, indent=2)
+    return doc, {
+        "valid": body,
+        "markdown fence": f"Here is the optimized prompt:\n```json\n{body}\n```\n",
+        "fence + trailing chatter with braces": f"```json\n{body}\n```\nLet me know if you want changes to {{tone}}!",
+        "preamble with braces": f"Sure {{as requested}}, the JSON follows.\n{body}",
+        "raw newlines in strings": body.replace("\\n", "\n"),
+        "truncated": body[: len(body) * 2 // 3],
+    }
+
+
+def time_it(fn, arg, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(arg)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--size-kb", type=int, default=64, help="Approximate response size")
+    parser.add_argument("--chunk", type=int, default=16, help="Chunk size (chars) for the streaming comparison")
+    args = parser.parse_args()
+
+    doc, cases = make_cases(args.size_kb)
+
+    print(f"Whole-response parsing ({args.size_kb} KB, best of {args.repeat})")
+    print(f"{'case':<40}{'legacy ms':>12}{'ok':>5}{'current ms':>17}{'ok':>5}")
+    for name, content in cases.items():
+        legacy_t, legacy_r = time_it(legacy_parse, content, args.repeat)
+        new_t, new_r = time_it(new_parse, content, args.repeat)
+        print(f"{name:<40}{legacy_t * 1000:>12.2f}{'yes' if legacy_r == doc else 'no':>5}"
+              f"{new_t * 1000:>17.2f}{'yes' if new_r == doc else 'no':>5}")
+
+    print(f"\nStreaming ({args.chunk}-char chunks, best of {args.repeat})")
+    print(f"{'case':<40}{'regex rescan ms':>16}{'fields':>8}{'incremental ms':>16}{'fields':>8}")
+    for name, content in cases.items():
+        chunks = [content[i:i + args.chunk] for i in range(0, len(content), args.chunk)]
+        legacy_t, (_, legacy_fields) = time_it(legacy_stream, chunks, args.repeat)
+        new_t, (_, new_fields) = time_it(new_stream, chunks, args.repeat)
+        print(f"{name:<40}{legacy_t * 1000:>16.2f}{legacy_fields:>8}{new_t * 1000:>16.2f}{new_fields:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Runs a fixed prompt corpus through PromptOptimizer for one or more providers
+and reports throughput, p50/p95/p99 latency, time to first token (--stream),
+completion tokens/s, JSON parse-success rate and peak process memory.
+
+By default the OpenAI and Ollama providers are benchmarked against an
+in-process stub server (benchmarks/stub_server.py) with a fixed latency and
+token rate, so results are reproducible offline. Use --no-stub with
+--base-url / --host (or a cloud provider and --api-key) to measure a real
+backend instead.
+
+For CI, save a run with --json and compare later runs against it:
+    python benchmarks/bench_providers.py --json baseline.json
+    python benchmarks/bench_providers.py --baseline baseline.json --max-regression 0.2
+The second command exits with status 1 if a provider got slower or parsed
+fewer responses by more than the allowed fraction.
+
+Usage:
+    python benchmarks/bench_providers.py [--provider openai --provider ollama] [--requests N]
+        [--concurrency N] [--stream] [--latency S] [--tokens-per-second R] [--broken-rate F]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+import psutil
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.backends.registry import ProviderRegistry
+from src.batch import read_prompts, _provider_kwargs
+from src.optimizer import PromptOptimizer
+from stub_server import StubServer, add_stub_arguments, config_from_args
+
+# Fixed corpus: short and long, plain and already-structured prompts
+CORPUS = [
+    "Write a haiku about autumn leaves.",
+    "Explain quantum entanglement to a ten year old.",
+    "Summarize the attached quarterly sales report and highlight the three biggest risks.",
+    "Generate a Python function that validates email addresses, with unit tests.",
+    "Act as a senior recruiter and review my resume for a backend engineering role.",
+    "Draft a polite email declining a meeting invitation because of a scheduling conflict.",
+    "Create a weekly meal plan for a vegetarian athlete training for a marathon, "
+    "including macros per meal and a shopping list grouped by store section.",
+    "Translate the following customer complaint into French and suggest a response: "
+    "'My order arrived two weeks late and the box was damaged.'",
+    "Compare PostgreSQL and SQLite for a desktop application that stores a few million rows.",
+    "You are a dungeon master. Describe the entrance to an abandoned dwarven mine.",
+    "List ten interview questions for a product manager, ordered from easiest to hardest.",
+    "Rewrite this paragraph to be more concise: Our company, which was founded many years ago "
+    "in a small garage, has grown over the decades into a business that now serves customers "
+    "all around the world with a wide variety of products and services.",
+]
+
+STUB_PROVIDERS = ("openai", "ollama")
+
+# Fallback persona set by PromptOptimizer when a response isn't valid JSON
+_FALLBACK_PERSONA = "Error parsing JSON"
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile, None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+class MemorySampler:
+    """Tracks the peak resident set size of this process on a background thread."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = self.process.memory_info().rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def __enter__(self) -> "MemorySampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def run_one(optimizer: PromptOptimizer, raw_prompt: str, model: str, stream: bool) -> Dict[str, Any]:
+    start = time.perf_counter()
+    if stream:
+        result = {"error": "Stream ended without a result"}
+        for event in optimizer.optimize_prompt_stream(raw_prompt, model, use_cache=False, use_similar=False):
+            if event["type"] == "result":
+                result = event["result"]
+            elif event["type"] == "error":
+                result = {"error": event["error"]}
+    else:
+        result = optimizer.optimize_prompt(raw_prompt, model, use_cache=False, use_similar=False)
+    latency = time.perf_counter() - start
+    metrics = result.get("metrics") or {}
+    return {
+        "latency": latency,
+        "ttft": metrics["ttft_ms"] / 1000 if metrics.get("ttft_ms") is not None else None,
+        "completion_tokens": metrics.get("completion_tokens"),
+        "ok": "error" not in result,
+        "parsed": "error" not in result and result.get("elements", {}).get("persona") != _FALLBACK_PERSONA,
+    }
+
+
+def benchmark(provider: str, provider_kwargs: Dict[str, Any], model: str, prompts: List[str],
+              concurrency: int, stream: bool, warmup: int) -> Dict[str, Any]:
+    # A private registry keeps providers from earlier runs out of the memory figures
+    optimizer = PromptOptimizer(provider_type=provider, registry=ProviderRegistry(resilient=False), **provider_kwargs)
+    for raw_prompt in prompts[:warmup]:
+        run_one(optimizer, raw_prompt, model, stream)
+
+    with MemorySampler() as memory:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(lambda p: run_one(optimizer, p, model, stream), prompts))
+        wall = time.perf_counter() - start
+    optimizer.registry.close_all()
+
+    latencies = [s["latency"] for s in samples if s["ok"]]
+    ttfts = [s["ttft"] for s in samples if s["ttft"] is not None]
+    counted = [s for s in samples if s["ok"] and s["completion_tokens"] is not None]
+    token_time = sum(s["latency"] for s in counted)
+    report = {
+        "provider": provider,
+        "model": model,
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if not s["ok"]),
+        "throughput_rps": len(samples) / wall if wall else None,
+        "tokens_per_second": sum(s["completion_tokens"] for s in counted) / token_time if token_time else None,
+        "parse_success": sum(1 for s in samples if s["parsed"]) / len(samples) if samples else None,
+        "peak_rss_mb": memory.peak / 1024 ** 2,
+    }
+    for p in (50, 95, 99):
+        value = percentile(latencies, p)
+        report[f"latency_p{p}_ms"] = value * 1000 if value is not None else None
+    for p in (50, 95):
+        value = percentile(ttfts, p)
+        report[f"ttft_p{p}_ms"] = value * 1000 if value is not None else None
+    return report
+
+
+# Report fields checked against a baseline, and whether higher is better
+REGRESSION_FIELDS = {
+    "throughput_rps": True,
+    "latency_p50_ms": False,
+    "latency_p95_ms": False,
+    "parse_success": True,
+}
+
+
+def find_regressions(reports: List[Dict[str, Any]], baseline: List[Dict[str, Any]],
+                     max_regression: float) -> List[str]:
+    previous = {(r["provider"], r["model"]): r for r in baseline}
+    problems = []
+    for report in reports:
+        old = previous.get((report["provider"], report["model"]))
+        if old is None:
+            continue
+        for field, higher_is_better in REGRESSION_FIELDS.items():
+            new_value, old_value = report.get(field), old.get(field)
+            if not new_value or not old_value:
+                continue
+            change = (old_value - new_value) / old_value if higher_is_better else (new_value - old_value) / old_value
+            if change > max_regression:
+                problems.append(f"{report['provider']}/{report['model']} {field}: "
+                                f"{old_value:.2f} -> {new_value:.2f} ({change:+.0%} worse)")
+    return problems
+
+
+def _fmt(value: Optional[float], digits: int = 1) -> str:
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def print_table(reports: List[Dict[str, Any]]):
+    print(f"{'provider':<12}{'req':>6}{'err':>5}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'ttft50':>8}{'tok/s':>8}{'parsed':>8}{'rss MB':>8}")
+    for r in reports:
+        print(f"{r['provider']:<12}{r['requests']:>6}{r['errors']:>5}{_fmt(r['throughput_rps'], 2):>8}"
+              f"{_fmt(r['latency_p50_ms']):>9}{_fmt(r['latency_p95_ms']):>9}{_fmt(r['latency_p99_ms']):>9}"
+              f"{_fmt(r['ttft_p50_ms']):>8}{_fmt(r['tokens_per_second']):>8}"
+              f"{_fmt(r['parse_success'] * 100 if r['parse_success'] is not None else None):>7}%"
+              f"{_fmt(r['peak_rss_mb']):>8}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--provider", action="append", dest="providers",
+                        help="Provider to benchmark (repeatable, default: openai and ollama)")
+    parser.add_argument("--model", default="stub-model", help="Model name passed to the provider")
+    parser.add_argument("--corpus", help="JSONL file of prompts (default: the built-in corpus)")
+    parser.add_argument("--requests", type=int, default=48, help="Measured requests per provider")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests per provider")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--stream", action="store_true", help="Use streaming generation (reports TTFT)")
+    parser.add_argument("--no-stub", action="store_true", help="Benchmark real backends instead of the stub")
+    parser.add_argument("--port", type=int, default=0, help="Stub server port (default: any free port)")
+    # Real backend options, as in batch mode
+    parser.add_argument("--base-url", help="Base URL for OpenAI-compatible servers")
+    parser.add_argument("--host", help="Ollama host")
+    parser.add_argument("--model-path", help="GGUF model path for llama.cpp")
+    parser.add_argument("--n-gpu-layers", type=int, default=-1)
+    parser.add_argument("--pool-workers", type=int, default=None)
+    parser.add_argument("--api-key", help="API key for cloud providers (defaults to the OS keychain)")
+    parser.add_argument("--json", help="Write the reports to this file")
+    parser.add_argument("--baseline", help="Reports from an earlier --json run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed fractional regression against the baseline")
+    # Shape of the in-process stub's responses
+    add_stub_arguments(parser)
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    providers = args.providers or list(STUB_PROVIDERS)
+    if args.corpus:
+        with open(args.corpus, "r", encoding="utf-8") as f:
+            corpus = [item["raw_prompt"] for item in read_prompts(f) if "raw_prompt" in item]
+    else:
+        corpus = CORPUS
+    prompts = [corpus[i % len(corpus)] for i in range(args.requests)]
+
+    server = None
+    if not args.no_stub:
+        unsupported = [p for p in providers if p not in STUB_PROVIDERS]
+        if unsupported:
+            print(f"The stub server only speaks {', '.join(STUB_PROVIDERS)}; "
+                  f"use --no-stub for {', '.join(unsupported)}", file=sys.stderr)
+            return 2
+        server = StubServer(config_from_args(args), port=args.port).start()
+        args.base_url = server.url + "/v1"
+        args.host = server.url
+        print(f"Stub server on {server.url}: {args.latency}s latency, {args.tokens_per_second} tokens/s, "
+              f"{args.broken_rate:.0%} broken responses", file=sys.stderr)
+
+    reports = []
+    try:
+        for provider in providers:
+            print(f"Benchmarking {provider} ({len(prompts)} requests, concurrency {args.concurrency}"
+                  f"{', streaming' if args.stream else ''})...", file=sys.stderr)
+            reports.append(benchmark(provider, _provider_kwargs(provider, args), args.model, prompts,
+                                     args.concurrency, args.stream, args.warmup))
+    finally:
+        if server is not None:
+            server.stop()
+
+    print_table(reports)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            problems = find_regressions(reports, json.load(f), args.max_regression)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        if problems:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
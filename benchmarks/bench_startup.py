@@ -0,0 +1,127 @@
+"""
+Measures cold start in fresh interpreter processes:
+  - import time of the GUI module (src.gui) and of the headless entry points
+  - launch-to-window time: process start until the App window has been drawn
+    (skipped when no display is available)
+  - the one-off cost of each backend's first selection (importing its SDK),
+    now paid when a backend is first used instead of at startup
+
+--eager imports every provider module up front, as the app did before
+provider imports were made lazy, for a before/after comparison.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs N] [--eager]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+from src.backends.factory import ProviderFactory
+
+# Imports every provider module, i.e. every backend SDK
+_EAGER = (
+    "from src.backends.factory import ProviderFactory\n"
+    "for _name in ProviderFactory.get_available_providers():\n"
+    "    ProviderFactory.get_provider_class(_name)\n"
+)
+
+_IMPORT_SCRIPT = """
+import time, json, warnings
+warnings.simplefilter("ignore")
+start = time.perf_counter()
+{eager}import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start}}))
+"""
+
+_WINDOW_SCRIPT = """
+import time, json, warnings
+warnings.simplefilter("ignore")
+start = time.perf_counter()
+{eager}from src.gui import App
+imported = time.perf_counter()
+app = App()
+app.update()
+shown = time.perf_counter()
+print(json.dumps({{"import": imported - start, "seconds": shown - start}}))
+app.on_closing()
+"""
+
+_PROVIDER_SCRIPT = """
+import time, json, warnings
+warnings.simplefilter("ignore")
+from src.backends.factory import ProviderFactory
+start = time.perf_counter()
+try:
+    ProviderFactory.get_provider_class({provider!r})
+    print(json.dumps({{"seconds": time.perf_counter() - start}}))
+except ImportError as e:
+    print(json.dumps({{"error": str(e)}}))
+"""
+
+
+def run_child(script: str) -> dict:
+    """
+    Runs `script` in a new interpreter and returns its JSON report, plus the
+    wall time from spawning the process (interpreter startup included).
+    """
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        return {"error": (completed.stderr.strip().splitlines() or ["no output"])[-1]}
+    report = json.loads(lines[-1])
+    report["wall"] = wall
+    return report
+
+
+def measure(script: str, runs: int) -> dict:
+    reports = [run_child(script) for _ in range(runs)]
+    errors = [r["error"] for r in reports if "error" in r]
+    if errors:
+        return {"error": errors[0]}
+    return {
+        "median": statistics.median(r["seconds"] for r in reports),
+        "min": min(r["seconds"] for r in reports),
+        "wall": statistics.median(r["wall"] for r in reports),
+    }
+
+
+def print_row(label: str, result: dict):
+    if "error" in result:
+        print(f"{label:<36}{'skipped: ' + result['error']}")
+    else:
+        print(f"{label:<36}{result['median'] * 1000:>10.0f}{result['min'] * 1000:>10.0f}{result['wall'] * 1000:>12.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per measurement")
+    parser.add_argument("--eager", action="store_true", help="Import all provider SDKs first (old behavior)")
+    args = parser.parse_args()
+    eager = _EAGER if args.eager else ""
+
+    print(f"Cold start, {args.runs} fresh processes each{' (eager provider imports)' if args.eager else ''}")
+    print(f"{'':<36}{'median ms':>10}{'min ms':>10}{'process ms':>12}")
+    for module in ("src.gui", "src.optimizer", "src.batch"):
+        print_row(f"import {module}", measure(_IMPORT_SCRIPT.format(eager=eager, module=module), args.runs))
+
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"):
+        print_row("launch to window", measure(_WINDOW_SCRIPT.format(eager=eager), args.runs))
+    else:
+        print_row("launch to window", {"error": "no display"})
+
+    print("\nFirst selection of each backend (SDK import)")
+    for provider in ProviderFactory.get_available_providers():
+        print_row(provider, measure(_PROVIDER_SCRIPT.format(provider=provider), args.runs))
+
+
+if __name__ == "__main__":
+    main()
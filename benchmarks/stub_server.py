@@ -0,0 +1,300 @@
+"""
+Local stand-in for an OpenAI-compatible server (LM Studio, vLLM, ...) and for
+Ollama, so provider benchmarks run offline and reproducibly.
+
+Each request sleeps `--latency` seconds before the first token, then emits the
+response at `--tokens-per-second` (whitespace-separated words count as
+tokens). The response is a valid optimizer JSON document derived from the
+prompt. A deterministic fraction (`--broken-rate`) of prompts gets a truncated
+document instead, to exercise the parse-failure path. Token usage is reported
+the way each API does.
+
+With `--slots N` the stub behaves like a server decoding N sequences at once
+(continuous batching): up to N requests run side by side at full speed, more
+wait for a free slot. N is reported at /props, as llama.cpp's server does.
+
+Routes:
+    GET  /v1/models, POST /v1/chat/completions   (OpenAI, SSE when "stream" is set)
+    GET  /api/tags,  POST /api/chat              (Ollama, NDJSON unless "stream" is false)
+    GET  /props                                  (llama.cpp server, with --slots)
+
+Usage:
+    python benchmarks/stub_server.py [--port 8000] [--latency 0.2] [--tokens-per-second 200]
+Then point the app at http://127.0.0.1:8000/v1 (OpenAI) or http://127.0.0.1:8000 (Ollama).
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.optimizer import ELEMENT_KEYS
+
+
+def _fraction(text: str) -> float:
+    # Stable across runs and processes, unlike hash()
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+
+
+class StubConfig:
+    def __init__(self, latency: float = 0.2, tokens_per_second: float = 200.0, response_tokens: int = 120,
+                 broken_rate: float = 0.0, models: Optional[List[str]] = None, slots: int = 0):
+        self.latency = latency
+        # Parallel sequences (0 = unlimited)
+        self.slots = slots
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.broken_rate = broken_rate
+        self.models = models or ["stub-model"]
+
+    def build_tokens(self, prompt: str) -> List[str]:
+        """
+        The response for `prompt`, split into the tokens it is streamed as.
+        """
+        words = prompt.split() or ["prompt"]
+        per_field = max(1, self.response_tokens // (len(ELEMENT_KEYS) + 1))
+
+        def text(offset: int) -> str:
+            return " ".join(words[(offset + i) % len(words)] for i in range(per_field))
+
+        document = {
+            "elements": {key: text(i) for i, key in enumerate(ELEMENT_KEYS)},
+            "final_prompt": text(len(ELEMENT_KEYS)),
+        }
+        body = json.dumps(document, indent=1)
+        if _fraction(prompt) < self.broken_rate:
+            body = body[: len(body) // 2]
+        # Keep the separators attached so the chunks join back into the body
+        tokens, start = [], 0
+        for i, char in enumerate(body):
+            if char == " " and i > start:
+                tokens.append(body[start:i])
+                start = i
+        tokens.append(body[start:])
+        return tokens
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "StubServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload: Dict[str, Any], status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        config = self.server.config
+        if self.path.rstrip("/") == "/v1/models":
+            self._send_json({"object": "list", "data": [
+                {"id": name, "object": "model", "created": 0, "owned_by": "stub"} for name in config.models
+            ]})
+        elif self.path.rstrip("/") == "/props" and config.slots:
+            self._send_json({"total_slots": config.slots})
+        elif self.path.rstrip("/") == "/api/tags":
+            self._send_json({"models": [
+                {"name": name, "model": name, "modified_at": "2024-01-01T00:00:00Z", "size": 0, "digest": ""}
+                for name in config.models
+            ]})
+        else:
+            self._send_json({"error": f"Unknown route {self.path}"}, 404)
+
+    def do_POST(self):
+        request = self._read_json()
+        messages = request.get("messages") or []
+        prompt = messages[-1].get("content", "") if messages else ""
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+        model = request.get("model") or self.server.config.models[0]
+        tokens = self.server.config.build_tokens(prompt)
+        self.server.count_request()
+        with self.server.slot():
+            self._respond(request, model, tokens, prompt_tokens)
+
+    def _respond(self, request: Dict[str, Any], model: str, tokens: List[str], prompt_tokens: int):
+        if self.path.rstrip("/") == "/v1/chat/completions":
+            if request.get("stream"):
+                include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+                self._openai_stream(model, tokens, prompt_tokens if include_usage else None)
+            else:
+                self._pace(len(tokens))
+                self._send_json({
+                    "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(tokens)}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                              "total_tokens": prompt_tokens + len(tokens)},
+                })
+        elif self.path.rstrip("/") == "/api/chat":
+            if request.get("stream", True):
+                self._ollama_stream(model, tokens, prompt_tokens)
+            else:
+                self._pace(len(tokens))
+                self._send_json(self._ollama_part(model, "".join(tokens), True, prompt_tokens, len(tokens)))
+        else:
+            self._send_json({"error": f"Unknown route {self.path}"}, 404)
+
+    def _pace(self, n_tokens: int):
+        config = self.server.config
+        time.sleep(config.latency + (n_tokens / config.tokens_per_second if config.tokens_per_second else 0))
+
+    def _stream(self, content_type: str, events):
+        # No Content-Length for streams: the end of the body is the end of the connection
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        config = self.server.config
+        time.sleep(config.latency)
+        interval = 1.0 / config.tokens_per_second if config.tokens_per_second else 0
+        next_at = time.perf_counter()
+        for event in events:
+            self.wfile.write(event.encode("utf-8"))
+            self.wfile.flush()
+            # Scheduled against the start so per-write overhead doesn't slow the rate down
+            next_at += interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _openai_stream(self, model: str, tokens: List[str], prompt_tokens: Optional[int] = None):
+        def events():
+            for token in tokens:
+                chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": model, "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            if prompt_tokens is not None:
+                # Requested with stream_options.include_usage: one last chunk with usage and no choices
+                chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": model, "choices": [],
+                         "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                                   "total_tokens": prompt_tokens + len(tokens)}}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+        self._stream("text/event-stream", events())
+
+    @staticmethod
+    def _ollama_part(model: str, content: str, done: bool, prompt_tokens: int = 0, eval_count: int = 0):
+        part = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(),
+                "message": {"role": "assistant", "content": content}, "done": done}
+        if done:
+            part.update(done_reason="stop", prompt_eval_count=prompt_tokens, eval_count=eval_count)
+        return part
+
+    def _ollama_stream(self, model: str, tokens: List[str], prompt_tokens: int):
+        def events():
+            for token in tokens:
+                yield json.dumps(self._ollama_part(model, token, False)) + "\n"
+            yield json.dumps(self._ollama_part(model, "", True, prompt_tokens, len(tokens))) + "\n"
+        self._stream("application/x-ndjson", events())
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    The stub as an in-process server, for benchmarks that start their own:
+
+        with StubServer(StubConfig(latency=0.1)) as server:
+            base_url = server.url + "/v1"
+    """
+    daemon_threads = True
+
+    def __init__(self, config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.config = config or StubConfig()
+        self.requests = 0
+        self._count_lock = threading.Lock()
+        self._slots = threading.Semaphore(self.config.slots) if self.config.slots else None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_request(self):
+        with self._count_lock:
+            self.requests += 1
+
+    def handle_error(self, request, client_address):
+        # Cancelled requests (hedging, abandoned comparisons) hang up mid-response
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+    def slot(self):
+        return self._slots if self._slots is not None else nullcontext()
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    """Response shaping options, shared with the benchmarks that start their own stub."""
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Generation rate (0 = instant)")
+    parser.add_argument("--response-tokens", type=int, default=120, help="Approximate response length")
+    parser.add_argument("--broken-rate", type=float, default=0.0,
+                        help="Fraction of prompts answered with truncated (unparseable) JSON")
+    parser.add_argument("--slots", type=int, default=0,
+                        help="Requests decoded in parallel, reported at /props (0 = unlimited)")
+
+
+def config_from_args(args: argparse.Namespace) -> StubConfig:
+    return StubConfig(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                      response_tokens=args.response_tokens, broken_rate=args.broken_rate,
+                      models=getattr(args, "models", None), slots=args.slots)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model", action="append", dest="models", help="Model name to advertise (repeatable)")
+    add_stub_arguments(parser)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    server = StubServer(config_from_args(args), args.host, args.port)
+    print(f"Stub server on {server.url} (OpenAI: {server.url}/v1, Ollama: {server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
-from src.gui import App
+import sys
 
 def main():
+    # Headless batch mode: python main.py batch prompts.jsonl --model <name>
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        from src.batch import main as batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+
+    from src.gui import App
     app = App()
     app.protocol("WM_DELETE_WINDOW", app.on_closing)
     app.mainloop()
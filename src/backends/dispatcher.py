@@ -0,0 +1,145 @@
+import asyncio
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from src.utils.async_runner import shared_runner
+
+# Parallel sequences assumed when the server doesn't say (LM Studio's and
+# Ollama's default on machines with enough memory)
+DEFAULT_PARALLEL_SLOTS = 4
+
+
+async def detect_parallel_slots(base_url: str, timeout: float = 0.5) -> Optional[int]:
+    """
+    Number of sequences an OpenAI-compatible server decodes in parallel, if it
+    reports it (llama.cpp's server does, at /props).
+    """
+    try:
+        import httpx
+        root = base_url.rstrip("/")
+        if root.endswith("/v1"):
+            root = root[:-3]
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            response = await client.get(root + "/props")
+        if response.status_code == 200:
+            slots = response.json().get("total_slots")
+            if isinstance(slots, int) and slots > 0:
+                return slots
+    except Exception:
+        # Not a llama.cpp server, or not reachable yet
+        pass
+    return None
+
+
+class MicroBatchDispatcher:
+    """
+    Sends requests to a local server from all calling threads as parallel
+    in-flight requests over one async HTTP client, on the shared event loop,
+    so the server's continuous batching can decode them together.
+
+    When the server is idle, the first request waits up to `window` seconds
+    for others so they are prefilled in the same batch. While requests are in
+    flight, a queued request starts as soon as one finishes. At most `slots`
+    requests are in flight; more would only queue on the server.
+
+    `send` is a coroutine function doing one request. Calls are made with
+    run() from worker threads or acall() from coroutines.
+    """
+
+    def __init__(self, send: Callable[..., Awaitable[Any]], slots: int = DEFAULT_PARALLEL_SLOTS,
+                 window: float = 0.005):
+        self.send = send
+        self.slots = max(1, slots)
+        self.window = window
+        self._runner = shared_runner()
+        # Only touched on the runner's loop
+        self._pending: Deque[Tuple[tuple, Dict[str, Any], asyncio.Future]] = deque()
+        self._in_flight = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.stats = {"requests": 0, "batches": 0, "largest_batch": 0}
+
+    def set_slots(self, slots: int):
+        """
+        Changes the number of parallel slots, e.g. once the server has reported it.
+        Must be called on the runner's loop.
+        """
+        self.slots = max(1, slots)
+        if self._pending and self._in_flight:
+            self._flush()
+
+    def submit(self, *args, **kwargs) -> Future:
+        """
+        Queues a request from any thread; returns a concurrent.futures.Future.
+        """
+        return self._runner.submit(self._call(*args, **kwargs))
+
+    def run(self, *args, **kwargs) -> Any:
+        """
+        Blocking call for worker threads. Must not be used on the runner's loop.
+        """
+        return self.submit(*args, **kwargs).result()
+
+    async def acall(self, *args, **kwargs) -> Any:
+        if asyncio.get_running_loop() is self._runner.loop:
+            return await self._call(*args, **kwargs)
+        # The HTTP client belongs to the shared loop; hop over from any other loop
+        return await asyncio.wrap_future(self.submit(*args, **kwargs))
+
+    async def _call(self, *args, **kwargs) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((args, kwargs, future))
+        self.stats["requests"] += 1
+        if self._in_flight:
+            self._flush()
+        elif len(self._pending) >= self.slots:
+            # Enough to fill every slot, no point waiting
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        started = 0
+        while self._pending and self._in_flight < self.slots:
+            args, kwargs, future = self._pending.popleft()
+            if future.done():
+                # The caller was cancelled while queued
+                continue
+            self._in_flight += 1
+            started += 1
+            task = asyncio.ensure_future(self.send(*args, **kwargs))
+            # Cancelling the caller cancels its request too
+            future.add_done_callback(lambda f, task=task: task.cancel() if f.cancelled() else None)
+            task.add_done_callback(lambda t, future=future: self._finished(t, future))
+        if started:
+            self.stats["batches"] += 1
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], started)
+
+    async def aclose(self):
+        """
+        Cancels queued requests; requests in flight finish or fail with the client.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._pending:
+            _, _, future = self._pending.popleft()
+            future.cancel()
+
+    def _finished(self, task: asyncio.Task, future: asyncio.Future):
+        self._in_flight -= 1
+        if task.cancelled():
+            if not future.done():
+                future.cancel()
+        elif task.exception() is not None:
+            if not future.done():
+                future.set_exception(task.exception())
+        elif not future.done():
+            future.set_result(task.result())
+        # Continuous batching: the freed slot goes to the next queued request right away
+        if self._pending:
+            self._flush()
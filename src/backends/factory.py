@@ -1,27 +1,32 @@
-from typing import Dict, Type
+import importlib
+from typing import Dict, Tuple, Type
 from .provider_interface import LLMProvider
-from .openai_provider import OpenAIProvider
-from .ollama_provider import OllamaProvider
-from .anthropic_provider import AnthropicProvider
-from .gemini_provider import GeminiProvider
-from .groq_provider import GroqProvider
-from .llamacpp_provider import LlamaCppProvider
 
 class ProviderFactory:
-    _providers: Dict[str, Type[LLMProvider]] = {
-        "openai": OpenAIProvider,
-        "ollama": OllamaProvider,
-        "anthropic": AnthropicProvider,
-        "gemini": GeminiProvider,
-        "groq": GroqProvider,
-        "llamacpp": LlamaCppProvider
+    # Provider modules (and the SDKs they import) are loaded the first time
+    # their backend is used, not when the app starts
+    _providers: Dict[str, Tuple[str, str]] = {
+        "openai": (".openai_provider", "OpenAIProvider"),
+        "ollama": (".ollama_provider", "OllamaProvider"),
+        "anthropic": (".anthropic_provider", "AnthropicProvider"),
+        "gemini": (".gemini_provider", "GeminiProvider"),
+        "groq": (".groq_provider", "GroqProvider"),
+        "llamacpp": (".llamacpp_provider", "LlamaCppProvider"),
+        "llamacpp_pool": (".llamacpp_pool_provider", "LlamaCppPoolProvider")
     }
 
     @staticmethod
-    def create_provider(provider_type: str, **kwargs) -> LLMProvider:
-        provider_class = ProviderFactory._providers.get(provider_type)
-        if not provider_class:
+    def get_provider_class(provider_type: str) -> Type[LLMProvider]:
+        spec = ProviderFactory._providers.get(provider_type)
+        if not spec:
             raise ValueError(f"Unknown provider type: {provider_type}")
+        module_name, class_name = spec
+        # import_module caches in sys.modules and is safe to call from several threads
+        return getattr(importlib.import_module(module_name, __package__), class_name)
+
+    @staticmethod
+    def create_provider(provider_type: str, **kwargs) -> LLMProvider:
+        provider_class = ProviderFactory.get_provider_class(provider_type)
         return provider_class(**kwargs)
 
     @staticmethod
@@ -1,4 +1,4 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List
 import google.generativeai as genai
 from .provider_interface import LLMProvider
 
@@ -24,6 +24,20 @@ class GeminiProvider(LLMProvider):
         except Exception as e:
             raise e
 
+    def stream_generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Iterator[str]:
+        model_instance = genai.GenerativeModel(
+            model_name=model,
+            system_instruction=system_prompt
+        )
+        for chunk in model_instance.generate_content(user_prompt, stream=True):
+            if chunk.text:
+                yield chunk.text
+            metadata = getattr(chunk, "usage_metadata", None)
+            if metadata and kwargs.get("usage") is not None:
+                # Cumulative; the last chunk carries the totals
+                kwargs["usage"].update(prompt_token_count=metadata.prompt_token_count,
+                                       candidates_token_count=metadata.candidates_token_count)
+
     def list_models(self) -> List[str]:
         try:
             # List models checking for generateContent support
@@ -36,7 +50,11 @@ class GeminiProvider(LLMProvider):
             return ["gemini-1.5-pro-latest", "gemini-1.5-flash-latest"]
 
     def check_health(self) -> bool:
-        return True
+        try:
+            next(iter(genai.list_models(page_size=1)), None)
+            return True
+        except Exception:
+            return False
 
     def get_name(self) -> str:
         return self.name
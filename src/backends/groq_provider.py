@@ -1,11 +1,13 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List
 import os
-from groq import Groq
+from groq import Groq, AsyncGroq
 from .provider_interface import LLMProvider
+from ..utils.async_runner import shared_runner
 
 class GroqProvider(LLMProvider):
     def __init__(self, api_key: str):
         self.client = Groq(api_key=api_key)
+        self.async_client = AsyncGroq(api_key=api_key)
         self.name = "Groq"
 
     def generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
@@ -25,6 +27,38 @@ class GroqProvider(LLMProvider):
         except Exception as e:
             raise e
 
+    async def agenerate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
+        chat_completion = await self.async_client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            model=model,
+            temperature=kwargs.get("temperature", 0.7),
+        )
+        return {
+            "content": chat_completion.choices[0].message.content,
+            "raw": chat_completion.to_dict()
+        }
+
+    def stream_generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Iterator[str]:
+        stream = self.client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            model=model,
+            temperature=kwargs.get("temperature", 0.7),
+            stream=True,
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            # Groq reports usage on the final chunk
+            usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+            if usage is not None and kwargs.get("usage") is not None:
+                kwargs["usage"].update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
     def list_models(self) -> List[str]:
         try:
             models = self.client.models.list()
@@ -32,8 +66,23 @@ class GroqProvider(LLMProvider):
         except:
             return ["llama3-8b-8192", "llama3-70b-8192", "mixtral-8x7b-32768"]
 
+    async def alist_models(self) -> List[str]:
+        try:
+            models = await self.async_client.models.list()
+            return [m.id for m in models.data]
+        except Exception:
+            return ["llama3-8b-8192", "llama3-70b-8192", "mixtral-8x7b-32768"]
+
     def check_health(self) -> bool:
-        return True
+        try:
+            self.client.models.list()
+            return True
+        except Exception:
+            return False
 
     def get_name(self) -> str:
         return self.name
+
+    def close(self):
+        self.client.close()
+        shared_runner().finish(self.async_client.close())
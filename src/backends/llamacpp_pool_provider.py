@@ -0,0 +1,273 @@
+from typing import Dict, Any, Iterator, List, Optional
+import asyncio
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeoutError
+
+from .provider_interface import LLMProvider
+
+# How often the router checks that the workers are still alive (seconds)
+_HEALTH_POLL_INTERVAL = 1.0
+
+# Longest wait for a result (or the next chunk of a stream) before giving up on it
+_REQUEST_TIMEOUT = 600.0
+
+# Most recently abandoned request ids the workers are told about
+_CANCEL_SLOTS = 64
+
+
+def _worker_main(worker_id: int, model_path: str, llama_kwargs: Dict[str, Any],
+                 requests: "mp.Queue", results: "mp.Queue", cancelled: "mp.Array"):
+    """
+    Entry point of a worker process: loads the model and serves requests until it gets None.
+    Messages sent back are (request_id, kind, payload), kind in ready/load_error/chunk/done/error.
+    Requests listed in `cancelled` are skipped, and streams stop at the next token.
+    """
+    # Imported here so the parent process never needs llama_cpp itself
+    from .llamacpp_provider import LlamaCppProvider
+
+    try:
+        provider = LlamaCppProvider(model_path, **llama_kwargs)
+    except Exception as e:
+        results.put((None, "load_error", f"worker {worker_id}: {e}"))
+        return
+    results.put((None, "ready", worker_id))
+
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        request_id, stream, system_prompt, user_prompt, gen_kwargs = message
+        if request_id in cancelled[:]:
+            # Abandoned while queued; nobody waits for the result
+            continue
+        try:
+            if stream:
+                usage: Dict[str, Any] = {}
+                chunks = provider.stream_generate(system_prompt, user_prompt, "", usage=usage, **gen_kwargs)
+                try:
+                    for text in chunks:
+                        if request_id in cancelled[:]:
+                            break
+                        results.put((request_id, "chunk", text))
+                    else:
+                        results.put((request_id, "done", usage))
+                finally:
+                    # Stops decoding and releases the model
+                    chunks.close()
+            else:
+                results.put((request_id, "done", provider.generate(system_prompt, user_prompt, "", **gen_kwargs)))
+        except Exception as e:
+            results.put((request_id, "error", str(e)))
+    provider.close()
+
+
+class LlamaCppPoolProvider(LLMProvider):
+    """
+    Serves one GGUF model from N worker processes, each with its own llama.cpp
+    context and a share of the CPU threads. The weights are mmap'd, so the
+    workers share the same physical pages and peak RSS grows by roughly one
+    context per worker rather than one model per worker.
+
+    Requests go through a shared queue (whichever worker is free takes the next one),
+    and a router thread hands results back to the waiting callers.
+    """
+
+    def __init__(self, model_path: str, workers: Optional[int] = None, **kwargs):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model file not found at: {model_path}")
+
+        cpu_count = os.cpu_count() or 1
+        self.workers = max(1, workers or cpu_count // 4 or 1)
+        # Callers (e.g. the batch engine) use this as the useful concurrency level
+        self.max_concurrency = self.workers
+        # Each worker has its own context of this size (LlamaCppProvider's default)
+        self.context_tokens = kwargs.get("n_ctx", 4096)
+        self.name = f"Llama.cpp Pool ({self.workers} workers)"
+        self.model_path = model_path
+
+        llama_kwargs = dict(kwargs)
+        llama_kwargs.setdefault("n_threads", max(1, cpu_count // self.workers))
+        llama_kwargs.setdefault("n_gpu_layers", 0)
+
+        ctx = mp.get_context("spawn")
+        self._requests = ctx.Queue()
+        self._results = ctx.Queue()
+        # Ring of abandoned request ids, read by the workers
+        self._cancelled = ctx.Array("q", [-1] * _CANCEL_SLOTS)
+        self._cancel_next = 0
+        self._processes = [
+            ctx.Process(
+                target=_worker_main,
+                args=(i, model_path, llama_kwargs, self._requests, self._results, self._cancelled),
+                name=f"llamacpp-worker-{i}",
+                daemon=True
+            )
+            for i in range(self.workers)
+        ]
+        for process in self._processes:
+            process.start()
+
+        self._ids = itertools.count()
+        self._pending: Dict[int, Any] = {}  # request id -> Future or queue.Queue (streams)
+        self._pending_lock = threading.Lock()
+        self._closed = False
+        # Why the pool stopped serving, once it has
+        self._failure: Optional[str] = None
+
+        # Wait until every worker has loaded the model
+        ready = 0
+        while ready < self.workers:
+            try:
+                _, kind, payload = self._results.get(timeout=_HEALTH_POLL_INTERVAL)
+            except queue.Empty:
+                if not all(p.is_alive() for p in self._processes):
+                    self.close()
+                    raise RuntimeError("A llama.cpp worker process exited while loading the model")
+                continue
+            if kind == "load_error":
+                self.close()
+                raise RuntimeError(f"Llama.cpp worker failed to load model: {payload}")
+            ready += 1
+
+        self._router = threading.Thread(target=self._route_results, name="llamacpp-pool-router", daemon=True)
+        self._router.start()
+
+    def _route_results(self):
+        while not self._closed:
+            try:
+                request_id, kind, payload = self._results.get(timeout=_HEALTH_POLL_INTERVAL)
+            except queue.Empty:
+                if not all(p.is_alive() for p in self._processes):
+                    # Requests the dead worker took are lost; stop the pool rather than
+                    # leave callers waiting on them. The registry replaces a closed pool.
+                    self._failure = "A llama.cpp worker process exited unexpectedly"
+                    self.close()
+                    return
+                continue
+            except (EOFError, OSError):
+                return
+
+            with self._pending_lock:
+                target = self._pending.get(request_id)
+                if kind in ("done", "error"):
+                    self._pending.pop(request_id, None)
+            if target is None:
+                continue
+
+            if isinstance(target, Future):
+                try:
+                    if kind == "done":
+                        target.set_result(payload)
+                    else:
+                        target.set_exception(RuntimeError(payload))
+                except InvalidStateError:
+                    # Cancelled by an async caller meanwhile
+                    pass
+            else:
+                target.put((kind, payload))
+
+    def _fail_pending(self, reason: str):
+        with self._pending_lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for target in pending:
+            if isinstance(target, Future):
+                if not target.done():
+                    target.set_exception(RuntimeError(reason))
+            else:
+                target.put(("error", reason))
+
+    def _submit(self, target: Any, stream: bool, system_prompt: str, user_prompt: str, kwargs: Dict[str, Any]) -> int:
+        request_id = next(self._ids)
+        # Checked under the lock close() takes, so no request is registered after pending ones were failed
+        with self._pending_lock:
+            if self._closed:
+                raise RuntimeError(self._failure or "Llama.cpp pool has been closed")
+            self._pending[request_id] = target
+        self._requests.put((request_id, stream, system_prompt, user_prompt, kwargs))
+        return request_id
+
+    def _abandon(self, request_id: int):
+        # A late result for it is dropped by the router, and the worker skips or stops it
+        with self._pending_lock:
+            if self._pending.pop(request_id, None) is None:
+                # Already finished
+                return
+            self._cancelled[self._cancel_next] = request_id
+            self._cancel_next = (self._cancel_next + 1) % _CANCEL_SLOTS
+
+    def generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
+        future: Future = Future()
+        request_id = self._submit(future, False, system_prompt, user_prompt, kwargs)
+        try:
+            return future.result(timeout=_REQUEST_TIMEOUT)
+        except FutureTimeoutError:
+            self._abandon(request_id)
+            raise RuntimeError(f"Llama.cpp pool gave no result within {_REQUEST_TIMEOUT:.0f}s")
+
+    async def agenerate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
+        # Waits on the loop rather than in a thread, so a cancelled caller (e.g. a losing
+        # hedged attempt) gives the request up instead of holding a worker for it
+        future: Future = Future()
+        request_id = self._submit(future, False, system_prompt, user_prompt, kwargs)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), _REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._abandon(request_id)
+            raise RuntimeError(f"Llama.cpp pool gave no result within {_REQUEST_TIMEOUT:.0f}s")
+        except asyncio.CancelledError:
+            self._abandon(request_id)
+            raise
+
+    def stream_generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Iterator[str]:
+        # The caller's usage dict can't cross the process boundary; the worker sends its counts back
+        usage = kwargs.pop("usage", None)
+        chunks: "queue.Queue" = queue.Queue()
+        request_id = self._submit(chunks, True, system_prompt, user_prompt, kwargs)
+        try:
+            while True:
+                try:
+                    kind, payload = chunks.get(timeout=_REQUEST_TIMEOUT)
+                except queue.Empty:
+                    raise RuntimeError(f"Llama.cpp pool stream stalled for {_REQUEST_TIMEOUT:.0f}s")
+                if kind == "chunk":
+                    yield payload
+                elif kind == "done":
+                    if usage is not None and payload:
+                        usage.update(payload)
+                    return
+                else:
+                    raise RuntimeError(payload)
+        finally:
+            # Also when the consumer stops early; a no-op once the stream has finished
+            self._abandon(request_id)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def list_models(self) -> List[str]:
+        return [os.path.basename(self.model_path)]
+
+    def check_health(self) -> bool:
+        return not self._closed and all(p.is_alive() for p in self._processes)
+
+    def get_name(self) -> str:
+        return self.name
+
+    def close(self):
+        with self._pending_lock:
+            if self._closed:
+                return
+            self._closed = True
+        for _ in self._processes:
+            self._requests.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._fail_pending(self._failure or "Llama.cpp pool has been closed")
@@ -1,5 +1,7 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List, Optional, Sequence
 import os
+import threading
+from collections import OrderedDict
 try:
     from llama_cpp import Llama
 except ImportError:
@@ -7,6 +9,14 @@ except ImportError:
 
 from .provider_interface import LLMProvider
 
+def _common_prefix_len(a: Sequence[int], b: Sequence[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
 class LlamaCppProvider(LLMProvider):
     def __init__(self, model_path: str, **kwargs):
         if not Llama:
@@ -21,10 +31,23 @@ class LlamaCppProvider(LLMProvider):
             model_path=model_path,
             n_ctx=kwargs.get("n_ctx", 4096),
             n_gpu_layers=n_gpu_layers,
+            use_mlock=kwargs.get("use_mlock", False),
+            n_threads=kwargs.get("n_threads"),
             verbose=False
         )
         self.name = "Llama.cpp"
         self.model_path = model_path
+        # Prompt and completion together must fit; the scheduler rejects larger requests up front
+        self.context_tokens = self.llm.n_ctx()
+        # A Llama instance is not thread-safe; agenerate offloads to worker threads
+        self._lock = threading.Lock()
+
+        # KV-cache snapshots taken right after the system prompt, keyed by system prompt.
+        # Restoring one means only the user turn has to be prefilled.
+        self.cache_system_prompt = kwargs.get("cache_system_prompt", True)
+        self.max_prefix_states = kwargs.get("max_prefix_states", 2)
+        self._prefix_states: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.prefix_stats = {"captures": 0, "restores": 0, "reused_tokens": 0}
 
     def generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
         try:
@@ -34,12 +57,15 @@ class LlamaCppProvider(LLMProvider):
                 {"role": "user", "content": user_prompt}
             ]
             
-            response = self.llm.create_chat_completion(
-                messages=messages,
-                temperature=kwargs.get("temperature", 0.7),
-                max_tokens=kwargs.get("max_tokens", 4096),
-                response_format={"type": "json_object"}
-            )
+            with self._lock:
+                reused = self._prepare_prefix(system_prompt)
+                response = self.llm.create_chat_completion(
+                    messages=messages,
+                    temperature=kwargs.get("temperature", 0.7),
+                    max_tokens=kwargs.get("max_tokens", 4096),
+                    response_format={"type": "json_object"}
+                )
+            response["prefix_tokens_reused"] = reused
             
             return {
                 "content": response["choices"][0]["message"]["content"],
@@ -48,6 +74,98 @@ class LlamaCppProvider(LLMProvider):
         except Exception as e:
             raise e
 
+    def stream_generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Iterator[str]:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        # Hold the lock for the whole stream: tokens are produced lazily by the model
+        with self._lock:
+            reused = self._prepare_prefix(system_prompt)
+            stream = self.llm.create_chat_completion(
+                messages=messages,
+                temperature=kwargs.get("temperature", 0.7),
+                max_tokens=kwargs.get("max_tokens", 4096),
+                response_format={"type": "json_object"},
+                stream=True
+            )
+            completion_tokens = 0
+            for chunk in stream:
+                text = chunk["choices"][0]["delta"].get("content")
+                if text:
+                    # llama.cpp streams one token per chunk
+                    completion_tokens += 1
+                    yield text
+            if kwargs.get("usage") is not None:
+                # The context now holds exactly the prompt followed by the completion
+                kwargs["usage"].update(prompt_tokens=max(0, self.llm.n_tokens - completion_tokens),
+                                       completion_tokens=completion_tokens, prefix_tokens_reused=reused)
+
+    def _prepare_prefix(self, system_prompt: str) -> int:
+        """
+        Makes sure the KV cache starts with the evaluated system prompt, restoring
+        the saved snapshot if the live context has diverged from it.
+        Returns the number of prefix tokens that won't be re-evaluated.
+        Must be called with the lock held.
+        """
+        if not self.cache_system_prompt:
+            return 0
+        try:
+            entry = self._prefix_states.get(system_prompt)
+            if entry is None:
+                entry = self._capture_prefix(system_prompt)
+            self._prefix_states.move_to_end(system_prompt)
+
+            prefix = entry["tokens"]
+            if _common_prefix_len(self._evaluated_tokens(), prefix) < len(prefix):
+                self.llm.load_state(entry["state"])
+                self.prefix_stats["restores"] += 1
+            self.prefix_stats["reused_tokens"] += len(prefix)
+            return len(prefix)
+        except Exception as e:
+            # Snapshots are an optimization only; fall back to plain prefill
+            print(f"Llama.cpp prefix cache disabled: {e}")
+            self.cache_system_prompt = False
+            self._prefix_states.clear()
+            return 0
+
+    def _evaluated_tokens(self) -> List[int]:
+        # input_ids spans the whole context; entries past n_tokens are stale leftovers
+        return self.llm.input_ids[:self.llm.n_tokens].tolist()
+
+    def _capture_prefix(self, system_prompt: str) -> Dict[str, Any]:
+        # Evaluate the system prompt with two different one-token user turns. The
+        # tokens both prompts share are exactly the system prompt plus the chat
+        # template around it, whatever template the model uses.
+        token_runs = []
+        for probe in ("a", "b"):
+            self.llm.create_chat_completion(
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": probe}
+                ],
+                temperature=0,
+                max_tokens=1
+            )
+            token_runs.append(self._evaluated_tokens())
+        prefix_len = _common_prefix_len(*token_runs)
+
+        # The snapshot also holds the probe's tail; llama.cpp discards whatever
+        # doesn't match the next prompt, so only the shared prefix is reused.
+        entry = {"tokens": token_runs[1][:prefix_len], "state": self.llm.save_state()}
+        self._prefix_states[system_prompt] = entry
+        self.prefix_stats["captures"] += 1
+        while len(self._prefix_states) > self.max_prefix_states:
+            self._prefix_states.popitem(last=False)
+        return entry
+
+    def count_tokens(self, text: str) -> Optional[int]:
+        # The vocabulary is read-only, so this doesn't wait for a running generation
+        llm = self.llm
+        if llm is None:
+            return None
+        return len(llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
     def list_models(self) -> List[str]:
         # For Llama.cpp, the "model" is the loaded file.
         return [os.path.basename(self.model_path)]
@@ -57,3 +175,10 @@ class LlamaCppProvider(LLMProvider):
 
     def get_name(self) -> str:
         return self.name
+
+    def close(self):
+        with self._lock:
+            self._prefix_states.clear()
+            if self.llm is not None and hasattr(self.llm, "close"):
+                self.llm.close()
+            self.llm = None
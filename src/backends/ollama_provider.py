@@ -1,38 +1,79 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List, Optional
+import os
+import httpx
 import ollama
+from .dispatcher import DEFAULT_PARALLEL_SLOTS, MicroBatchDispatcher
 from .provider_interface import LLMProvider
+from ..utils.async_runner import shared_runner
+
+def _num_parallel() -> Optional[int]:
+    # The server's setting, visible here when it runs on this machine
+    value = os.environ.get("OLLAMA_NUM_PARALLEL", "")
+    return int(value) if value.isdigit() and int(value) > 0 else None
 
 class OllamaProvider(LLMProvider):
-    def __init__(self, host: str = "http://localhost:11434"):
+    def __init__(self, host: str = "http://localhost:11434", parallel_slots: Optional[int] = None):
         # Ollama library uses env var OLLAMA_HOST, or defaults to localhost:11434
         # We can set the client explicitly if needed, but the python lib is a bit static.
         # However, we can use the Client object in newer versions.
         self.client = ollama.Client(host=host)
+        # Sequences the server decodes at once; callers (batch engine, scheduler) use it as concurrency
+        self.max_concurrency = parallel_slots or _num_parallel() or DEFAULT_PARALLEL_SLOTS
+        # One connection per slot, kept alive between requests
+        self.async_client = ollama.AsyncClient(host=host, limits=httpx.Limits(
+            max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency
+        ))
+        # Blocking and async calls from every thread go out together through the async client
+        self.dispatcher = MicroBatchDispatcher(self._send, self.max_concurrency)
         self.name = "Ollama"
 
     def generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
-        try:
-            response = self.client.chat(model=model, messages=[
-                {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': user_prompt},
-            ])
-            return {
-                "content": response['message']['content'],
-                "raw": response
-            }
-        except Exception as e:
-            raise e
+        return self.dispatcher.run(system_prompt, user_prompt, model, **kwargs)
+
+    async def agenerate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
+        return await self.dispatcher.acall(system_prompt, user_prompt, model, **kwargs)
+
+    async def _send(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
+        response = await self.async_client.chat(model=model, messages=[
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': user_prompt},
+        ])
+        return {
+            "content": response['message']['content'],
+            "raw": response
+        }
+
+    def stream_generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Iterator[str]:
+        stream = self.client.chat(model=model, messages=[
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': user_prompt},
+        ], stream=True)
+        for part in stream:
+            if part['message']['content']:
+                yield part['message']['content']
+            if part.get('done') and kwargs.get("usage") is not None:
+                # Token counts arrive on the final part
+                kwargs["usage"].update(prompt_eval_count=part.get('prompt_eval_count'), eval_count=part.get('eval_count'))
 
     def list_models(self) -> List[str]:
         try:
-            models = self.client.list()
-            # Handle different return formats of ollama lib versions
-            if 'models' in models:
-                return [m['name'] for m in models['models']]
+            return self._model_names(self.client.list())
+        except Exception:
             return []
+
+    async def alist_models(self) -> List[str]:
+        try:
+            return self._model_names(await self.async_client.list())
         except Exception:
             return []
 
+    @staticmethod
+    def _model_names(models) -> List[str]:
+        # Handle different return formats of ollama lib versions
+        if 'models' in models:
+            return [m['name'] for m in models['models']]
+        return []
+
     def check_health(self) -> bool:
         try:
             self.client.list()
@@ -42,3 +83,14 @@ class OllamaProvider(LLMProvider):
 
     def get_name(self) -> str:
         return self.name
+
+    def close(self):
+        # ollama.Client has no close() of its own; its httpx client holds the connections
+        client = getattr(self.client, "_client", None)
+        if client is not None:
+            client.close()
+        shared_runner().finish(self._aclose())
+
+    async def _aclose(self):
+        await self.dispatcher.aclose()
+        await self.async_client.close()
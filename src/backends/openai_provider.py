@@ -1,28 +1,86 @@
-from typing import Dict, Any, List
-from openai import OpenAI, APIError
+import asyncio
+from typing import Dict, Any, Iterator, List, Optional
+from concurrent.futures import Future, wait
+import httpx
+from openai import OpenAI, AsyncOpenAI, APIError, DefaultAsyncHttpxClient
+from .dispatcher import DEFAULT_PARALLEL_SLOTS, MicroBatchDispatcher, detect_parallel_slots
 from .provider_interface import LLMProvider
+from ..utils.async_runner import shared_runner
+
+# Longest a caller sizing its concurrency waits for the server to report its slots
+_DETECT_WAIT = 1.0
 
 class OpenAIProvider(LLMProvider):
-    def __init__(self, base_url: str, api_key: str = "lm-studio"):
+    def __init__(self, base_url: str, api_key: str = "lm-studio", parallel_slots: Optional[int] = None):
         self.client = OpenAI(base_url=base_url, api_key=api_key)
+        # Connections are kept alive between requests; the dispatcher caps how many are in flight
+        self.async_client = AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=parallel_slots,
+                                max_keepalive_connections=parallel_slots or 4 * DEFAULT_PARALLEL_SLOTS)
+        ))
+        # Blocking and async calls from every thread go out together through the async client
+        self.dispatcher = MicroBatchDispatcher(self._send, parallel_slots or DEFAULT_PARALLEL_SLOTS)
+        # Without an explicit slot count, ask the server in the background (llama.cpp reports it)
+        self._detecting: Optional[Future] = None
+        if not parallel_slots:
+            self._detecting = shared_runner().submit(self._detect_slots(base_url))
         self.name = "OpenAI / LM Studio"
 
+    async def _detect_slots(self, base_url: str):
+        slots = await detect_parallel_slots(base_url)
+        if slots:
+            self.dispatcher.set_slots(slots)
+
+    @property
+    def max_concurrency(self) -> int:
+        # Sequences the server decodes at once; callers (batch engine, scheduler) use it as concurrency.
+        # Callers off the event loop wait briefly for detection; on the loop the current value is used.
+        detecting = self._detecting
+        if detecting is not None and not detecting.done():
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                wait([detecting], timeout=_DETECT_WAIT)
+        return self.dispatcher.slots
+
     def generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
-        try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=kwargs.get("temperature", 0.7),
-            )
-            return {
-                "content": response.choices[0].message.content,
-                "raw": response.dict()
-            }
-        except Exception as e:
-            raise e
+        return self.dispatcher.run(system_prompt, user_prompt, model, **kwargs)
+
+    async def agenerate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
+        return await self.dispatcher.acall(system_prompt, user_prompt, model, **kwargs)
+
+    async def _send(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
+        response = await self.async_client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=kwargs.get("temperature", 0.7),
+        )
+        return {
+            "content": response.choices[0].message.content,
+            "raw": response.dict()
+        }
+
+    def stream_generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Iterator[str]:
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=kwargs.get("temperature", 0.7),
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            # Usage arrives on a final chunk without choices
+            if chunk.usage is not None and kwargs.get("usage") is not None:
+                kwargs["usage"].update(prompt_tokens=chunk.usage.prompt_tokens,
+                                       completion_tokens=chunk.usage.completion_tokens)
 
     def list_models(self) -> List[str]:
         try:
@@ -31,6 +89,13 @@ class OpenAIProvider(LLMProvider):
         except Exception:
             return []
 
+    async def alist_models(self) -> List[str]:
+        try:
+            models = await self.async_client.models.list()
+            return [model.id for model in models.data]
+        except Exception:
+            return []
+
     def check_health(self) -> bool:
         try:
             # Simple check by listing models
@@ -41,3 +106,13 @@ class OpenAIProvider(LLMProvider):
 
     def get_name(self) -> str:
         return self.name
+
+    def close(self):
+        if self._detecting is not None:
+            self._detecting.cancel()
+        self.client.close()
+        shared_runner().finish(self._aclose())
+
+    async def _aclose(self):
+        await self.dispatcher.aclose()
+        await self.async_client.close()
@@ -1,5 +1,8 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterator, List, Optional
+
+from src.utils.metrics import extract_usage
 
 class LLMProvider(ABC):
     @abstractmethod
@@ -10,6 +13,29 @@ class LLMProvider(ABC):
         """
         pass
 
+    async def agenerate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
+        """
+        Async variant of generate, same return format.
+        The default offloads the blocking call to a worker thread; providers
+        with a native async client override it.
+        """
+        return await asyncio.to_thread(self.generate, system_prompt, user_prompt, model, **kwargs)
+
+    def stream_generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Iterator[str]:
+        """
+        Yields the response text incrementally as it is generated.
+        The default yields the full completion once; providers that support
+        streaming override it to yield tokens as they arrive.
+        If kwargs contains a `usage` dict, the provider fills it with the token
+        counts the backend reports (in the backend's own key names) once the
+        stream ends; see src.utils.metrics.extract_usage.
+        """
+        usage = kwargs.pop("usage", None)
+        result = self.generate(system_prompt, user_prompt, model, **kwargs)
+        if usage is not None:
+            usage.update(extract_usage(result.get("raw")))
+        yield result["content"]
+
     @abstractmethod
     def list_models(self) -> List[str]:
         """
@@ -17,6 +43,19 @@ class LLMProvider(ABC):
         """
         pass
 
+    async def alist_models(self) -> List[str]:
+        """
+        Async variant of list_models.
+        """
+        return await asyncio.to_thread(self.list_models)
+
+    def count_tokens(self, text: str) -> Optional[int]:
+        """
+        Number of tokens `text` encodes to with the model's own tokenizer, or None
+        if the provider has no local tokenizer (callers then estimate).
+        """
+        return None
+
     @abstractmethod
     def check_health(self) -> bool:
         """
@@ -30,3 +69,9 @@ class LLMProvider(ABC):
         Returns the friendly name of the provider.
         """
         pass
+
+    def close(self):
+        """
+        Releases resources held by the provider (HTTP clients, loaded models).
+        """
+        pass
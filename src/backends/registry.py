@@ -0,0 +1,176 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional, Tuple
+
+from .factory import ProviderFactory
+from .provider_interface import LLMProvider
+from .resilience import ResilientProvider, RESILIENCE_DEFAULTS
+
+# Rough resident cost of a provider that only holds HTTP clients
+_CLIENT_PROVIDER_BYTES = 1024 * 1024
+
+
+class ProviderRegistry:
+    """
+    Keeps live provider instances keyed on (provider_type, config) so that
+    selecting a backend again reuses its HTTP connection pools or, for llama.cpp,
+    the already loaded model instead of constructing a new one.
+
+    Instances unused for `idle_ttl` seconds are dropped, and least recently used
+    ones are dropped while the estimated footprint exceeds `memory_budget_bytes`.
+    A dropped instance is closed (freeing its model, worker processes and
+    connections) on a later get() once no call is running on it; wrapped
+    instances count their running calls, others get `retire_grace` seconds.
+
+    With `resilient` set, new instances are wrapped in a ResilientProvider
+    (rate limiting, retries with backoff, circuit breaker).
+    """
+
+    def __init__(self, memory_budget_bytes: int = 8 * 1024 ** 3, idle_ttl: Optional[float] = 30 * 60,
+                 resilient: bool = True, retire_grace: float = 5.0):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_ttl = idle_ttl
+        self.resilient = resilient
+        self.retire_grace = retire_grace
+        self._lock = threading.Lock()
+        # key -> {"provider", "size", "last_used"}
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # key -> Future of an instance being constructed (outside the lock)
+        self._building: Dict[str, Future] = {}
+        # (provider, dropped at) waiting to be closed
+        self._retired: List[Tuple[LLMProvider, float]] = []
+
+    @staticmethod
+    def make_key(provider_type: str, **kwargs) -> str:
+        return json.dumps([provider_type, kwargs], sort_keys=True, default=str)
+
+    @staticmethod
+    def estimate_size(provider_type: str, **kwargs) -> int:
+        model_path = kwargs.get("model_path")
+        if model_path and os.path.exists(model_path):
+            # Weights dominate for local models
+            return os.path.getsize(model_path)
+        return _CLIENT_PROVIDER_BYTES
+
+    def get(self, provider_type: str, **kwargs) -> LLMProvider:
+        """
+        Returns the live provider for this config, creating it on first use.
+        Construction (e.g. loading a model) doesn't block lookups of other
+        configs; concurrent callers for the same config wait for one instance.
+        """
+        key = self.make_key(provider_type, **kwargs)
+        with self._lock:
+            now = time.monotonic()
+            self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is not None and getattr(entry["provider"], "closed", False):
+                # Stopped serving (e.g. a pool whose worker died); build a new one
+                del self._entries[key]
+                entry = None
+            building = owner = None
+            if entry is None:
+                building = self._building.get(key)
+                if building is None:
+                    building = owner = self._building[key] = Future()
+            else:
+                entry["last_used"] = now
+                self._entries.move_to_end(key)
+            closable = self._closable(now)
+        self._close(closable)
+        if entry is not None:
+            return entry["provider"]
+        if owner is None:
+            return building.result()
+
+        try:
+            provider = ProviderFactory.create_provider(provider_type, **kwargs)
+            if self.resilient:
+                provider = ResilientProvider(provider, **RESILIENCE_DEFAULTS.get(provider_type, {}))
+        except BaseException as e:
+            with self._lock:
+                del self._building[key]
+            owner.set_exception(e)
+            raise
+        with self._lock:
+            del self._building[key]
+            self._entries[key] = {
+                "provider": provider,
+                "size": self.estimate_size(provider_type, **kwargs),
+                "last_used": time.monotonic()
+            }
+            self._evict_over_budget()
+            closable = self._closable(time.monotonic())
+        owner.set_result(provider)
+        self._close(closable)
+        return provider
+
+    # The next three run with the lock held
+
+    def _evict_idle(self, now: float):
+        if self.idle_ttl is None:
+            return
+        for key, entry in list(self._entries.items()):
+            # Callers holding on to a wrapped provider use it without going through get()
+            provider = entry["provider"]
+            last_used = max(entry["last_used"], getattr(provider, "last_used", 0.0))
+            if now - last_used > self.idle_ttl and not getattr(provider, "in_flight", 0):
+                self._retire(self._entries.pop(key))
+
+    def _evict_over_budget(self):
+        # Never evict the most recently used entry (the one just requested)
+        while len(self._entries) > 1 and self.memory_usage() > self.memory_budget_bytes:
+            self._retire(self._entries.popitem(last=False)[1])
+
+    def _retire(self, entry: Dict[str, Any]):
+        self._retired.append((entry["provider"], time.monotonic()))
+
+    def _closable(self, now: float) -> List[LLMProvider]:
+        closable, waiting = [], []
+        for provider, retired_at in self._retired:
+            in_flight = getattr(provider, "in_flight", None)
+            idle = in_flight == 0 if in_flight is not None else now - retired_at >= self.retire_grace
+            (closable if idle else waiting).append((provider, retired_at))
+        self._retired = waiting
+        return [provider for provider, _ in closable]
+
+    @staticmethod
+    def _close(providers: List[LLMProvider]):
+        for provider in providers:
+            try:
+                provider.close()
+            except Exception as e:
+                print(f"Provider Close Error: {e}")
+
+    def memory_usage(self) -> int:
+        return sum(e["size"] for e in self._entries.values())
+
+    def evict(self, provider_type: str, **kwargs) -> bool:
+        with self._lock:
+            entry = self._entries.pop(self.make_key(provider_type, **kwargs), None)
+            if entry is not None:
+                self._retire(entry)
+            closable = self._closable(time.monotonic())
+        self._close(closable)
+        return entry is not None
+
+    def active(self) -> List[str]:
+        with self._lock:
+            return [e["provider"].get_name() for e in self._entries.values()]
+
+    def close_all(self):
+        """
+        Closes and forgets every instance. Only call when no requests are in flight.
+        """
+        with self._lock:
+            providers = [e["provider"] for e in self._entries.values()] + [p for p, _ in self._retired]
+            self._entries.clear()
+            self._retired = []
+        self._close(providers)
+
+
+# Shared by all optimizers in the process
+default_registry = ProviderRegistry()
@@ -0,0 +1,350 @@
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Iterator, List, Optional
+
+from .provider_interface import LLMProvider
+
+# Defaults per provider type. Requests-per-minute values are conservative
+# entry-tier limits; local backends are not rate limited.
+RESILIENCE_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "openai": {"requests_per_minute": None},
+    "ollama": {"requests_per_minute": None},
+    "llamacpp": {"requests_per_minute": None, "max_retries": 0},
+    "llamacpp_pool": {"requests_per_minute": None, "max_retries": 0},
+    "anthropic": {"requests_per_minute": 50},
+    "gemini": {"requests_per_minute": 15},
+    "groq": {"requests_per_minute": 30},
+}
+
+_RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. reserve() takes a token immediately (the balance may
+    go negative) and returns how long the caller must wait before using it, so the
+    same bucket serves blocking and async callers.
+
+    The refill rate adapts AIMD-style: halved on a rate-limit response, raised
+    by a small step on success, never above the configured rate.
+    """
+
+    def __init__(self, rate_per_second: float, capacity: Optional[float] = None):
+        self.max_rate = rate_per_second
+        self.rate = rate_per_second
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_second)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def on_throttled(self):
+        with self._lock:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. While open, calls are
+    rejected until `reset_timeout` has passed and the health probe succeeds;
+    then one trial call is let through (half-open) to decide whether to close.
+    """
+
+    def __init__(self, probe, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "half_open":
+                # A trial call is already in flight
+                return False
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+
+        # Probe outside the lock; it may do network I/O
+        try:
+            healthy = bool(self.probe())
+        except Exception:
+            healthy = False
+        with self._lock:
+            if not healthy:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+            return healthy
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = "closed"
+
+    def record_abandoned(self):
+        """
+        The call ended without an outcome (cancelled, or a stream left unfinished).
+        If it was the half-open trial, the next call may try again right away.
+        """
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self._opened_at = time.monotonic() - self.reset_timeout
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    for attr in ("status_code", "code", "status"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            # HTTP-date form
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def _is_transient(error: Exception) -> bool:
+    status = _status_code(error)
+    if status is not None:
+        return status in _RETRYABLE_STATUS
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    name = type(error).__name__
+    return "Timeout" in name or "Connection" in name or "ServiceUnavailable" in name
+
+
+class ResilientProvider(LLMProvider):
+    """
+    Wraps a provider with per-provider rate limiting, jittered exponential backoff
+    (honoring Retry-After) for transient errors, and a circuit breaker whose
+    recovery is gated on the provider's real health check.
+    """
+
+    def __init__(self, inner: LLMProvider, requests_per_minute: Optional[float] = None,
+                 max_retries: int = 4, base_delay: float = 0.5, max_delay: float = 30.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.inner = inner
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.bucket = TokenBucket(requests_per_minute / 60.0) if requests_per_minute else None
+        self.breaker = CircuitBreaker(inner.check_health, failure_threshold, reset_timeout)
+        self.stats = {"calls": 0, "retries": 0, "throttled": 0, "rejected": 0, "failures": 0}
+        # Calls currently running and when one last started or ended; the registry
+        # keeps providers in use by callers holding on to them, and closes evicted ones at 0
+        self.in_flight = 0
+        self.last_used = time.monotonic()
+        self._in_flight_lock = threading.Lock()
+        self._closed = False
+
+    def __getattr__(self, name):
+        # Expose provider-specific attributes (max_concurrency, prefix_stats, ...)
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    def _before_call(self) -> float:
+        if not self.breaker.allow():
+            self.stats["rejected"] += 1
+            raise CircuitOpenError(f"{self.inner.get_name()} is unavailable (circuit open), try again later")
+        self.stats["calls"] += 1
+        return self.bucket.reserve() if self.bucket else 0.0
+
+    def _after_error(self, error: Exception, attempt: int) -> Optional[float]:
+        """
+        Records the failure and returns the delay before the next attempt,
+        or None if the error should be raised.
+        """
+        status = _status_code(error)
+        if status == 429:
+            # Rate limiting means the backend is up: slow down, don't open the circuit
+            self.stats["throttled"] += 1
+            self.breaker.record_success()
+            if self.bucket:
+                self.bucket.on_throttled()
+        elif _is_transient(error):
+            self.breaker.record_failure()
+        else:
+            # A request error (bad model name, invalid key...) won't improve with retries
+            self.breaker.record_success()
+            return None
+
+        if attempt >= self.max_retries:
+            self.stats["failures"] += 1
+            return None
+        self.stats["retries"] += 1
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        # Full jitter keeps concurrent callers from retrying in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _after_success(self):
+        self.breaker.record_success()
+        if self.bucket:
+            self.bucket.on_success()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed or getattr(self.inner, "closed", False)
+
+    def _track(self, delta: int):
+        with self._in_flight_lock:
+            self.in_flight += delta
+            self.last_used = time.monotonic()
+
+    def generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
+        self._track(1)
+        try:
+            return self._generate(system_prompt, user_prompt, model, **kwargs)
+        finally:
+            self._track(-1)
+
+    async def agenerate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
+        self._track(1)
+        try:
+            return await self._agenerate(system_prompt, user_prompt, model, **kwargs)
+        finally:
+            self._track(-1)
+
+    def stream_generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Iterator[str]:
+        self._track(1)
+        try:
+            yield from self._stream_generate(system_prompt, user_prompt, model, **kwargs)
+        finally:
+            self._track(-1)
+
+    def _generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            time.sleep(self._before_call())
+            try:
+                result = self.inner.generate(system_prompt, user_prompt, model, **kwargs)
+            except Exception as e:
+                delay = self._after_error(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self.breaker.record_abandoned()
+                raise
+            self._after_success()
+            return result
+
+    async def _agenerate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            if self.breaker.state == "closed":
+                wait = self._before_call()
+            else:
+                # Recovery runs a blocking health probe; keep it off the event loop
+                wait = await asyncio.to_thread(self._before_call)
+            await asyncio.sleep(wait)
+            try:
+                result = await self.inner.agenerate(system_prompt, user_prompt, model, **kwargs)
+            except Exception as e:
+                delay = self._after_error(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled (hedging and comparisons cancel the losers)
+                self.breaker.record_abandoned()
+                raise
+            self._after_success()
+            return result
+
+    def _stream_generate(self, system_prompt: str, user_prompt: str, model: str, **kwargs) -> Iterator[str]:
+        # Retrying is only safe until the first chunk has been handed out
+        attempt = 0
+        while True:
+            time.sleep(self._before_call())
+            started = False
+            try:
+                for chunk in self.inner.stream_generate(system_prompt, user_prompt, model, **kwargs):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                delay = self._after_error(e, attempt)
+                if delay is None or started:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # GeneratorExit when the consumer stops reading
+                self.breaker.record_abandoned()
+                raise
+            self._after_success()
+            return
+
+    def list_models(self) -> List[str]:
+        return self.inner.list_models()
+
+    async def alist_models(self) -> List[str]:
+        return await self.inner.alist_models()
+
+    def count_tokens(self, text: str) -> Optional[int]:
+        return self.inner.count_tokens(text)
+
+    def check_health(self) -> bool:
+        return self.inner.check_health()
+
+    def get_name(self) -> str:
+        return self.inner.get_name()
+
+    def close(self):
+        self._closed = True
+        self.inner.close()
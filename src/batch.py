@@ -0,0 +1,256 @@
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from src.cache import ResponseCache
+from src.database import DatabaseManager
+from src.optimizer import PromptOptimizer
+from src.scheduler import BATCH, RequestScheduler, SCHEDULER_DEFAULTS
+
+# Upper bound on in-flight requests per backend. Local servers usually run one
+# (or a handful of) sequences at a time, cloud APIs are limited by rate limits.
+DEFAULT_CONCURRENCY: Dict[str, int] = {
+    provider_type: limits["max_concurrency"] for provider_type, limits in SCHEDULER_DEFAULTS.items()
+}
+
+# Keys checked (in order) for the raw prompt / identifier of a JSONL record
+PROMPT_KEYS = ("raw_prompt", "prompt", "body", "text")
+ID_KEYS = ("id", "request_id")
+
+
+def read_prompts(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Parses JSONL records into {"id", "raw_prompt"} items.
+    Plain (non-JSON) lines are treated as the raw prompt itself.
+    """
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            record = line
+
+        if isinstance(record, str):
+            yield {"id": line_no, "raw_prompt": record}
+            continue
+
+        if not isinstance(record, dict):
+            yield {"id": line_no, "error": "Unsupported record type"}
+            continue
+
+        item_id = next((record[k] for k in ID_KEYS if k in record), line_no)
+        raw_prompt = next((record[k] for k in PROMPT_KEYS if record.get(k)), None)
+        if raw_prompt is None:
+            yield {"id": item_id, "error": f"No prompt field found (expected one of {', '.join(PROMPT_KEYS)})"}
+        else:
+            yield {"id": item_id, "raw_prompt": str(raw_prompt)}
+
+
+class BatchOptimizer:
+    """
+    Runs many raw prompts through a PromptOptimizer over a bounded worker pool.
+    Results are yielded as soon as each one completes (not in input order).
+
+    Requests are sent with BATCH priority. When the optimizer has a scheduler,
+    twice as many requests are read ahead as may run, so the scheduler can pack
+    small prompts around large ones that don't fit the token budget yet, and
+    interactive requests sharing the scheduler go first.
+    """
+
+    def __init__(self, optimizer: PromptOptimizer, provider_type: str, max_workers: Optional[int] = None,
+                 hedge_backups: Optional[List[Tuple[str, str, Dict[str, Any]]]] = None, hedge_delay: float = 2.0):
+        self.optimizer = optimizer
+        self.provider_type = provider_type
+        # (provider_type, model, provider_kwargs) raced against the primary when it is slow
+        self.hedge_backups = hedge_backups or []
+        self.hedge_delay = hedge_delay
+        # Providers that know their own parallelism (e.g. a worker pool) take precedence
+        limit = getattr(optimizer.provider, "max_concurrency", None) or DEFAULT_CONCURRENCY.get(provider_type, 4)
+        self.max_workers = max(1, min(max_workers, limit) if max_workers else limit)
+        self.threads = self.max_workers
+        if optimizer.scheduler is not None:
+            optimizer.scheduler.configure(provider_type, batch_concurrency=self.max_workers)
+            self.threads = self.max_workers * 2
+
+    def _run_one(self, item: Dict[str, Any], model: str) -> Dict[str, Any]:
+        start = time.perf_counter()
+        if self.hedge_backups:
+            result = self.optimizer.optimize_prompt_hedged(item["raw_prompt"], model, self.hedge_backups,
+                                                           self.hedge_delay, priority=BATCH)
+        else:
+            result = self.optimizer.optimize_prompt(item["raw_prompt"], model, priority=BATCH)
+        output = {"id": item["id"], "raw_prompt": item["raw_prompt"]}
+        output.update(result)
+        output["elapsed"] = round(time.perf_counter() - start, 3)
+        return output
+
+    def run(self, items: Iterable[Dict[str, Any]], model: str) -> Iterator[Dict[str, Any]]:
+        """
+        Optimizes every item and yields results as they complete.
+        At most 2 * threads items are pulled from `items` at a time, so the
+        input can be an arbitrarily large stream.
+        """
+        max_pending = self.threads * 2
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="batch") as executor:
+            pending = set()
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < max_pending:
+                    item = next(items, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    if "error" in item:
+                        yield item
+                        continue
+                    pending.add(executor.submit(self._run_one, item, model))
+
+                if not pending:
+                    break
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+
+def _provider_kwargs(provider: str, args: argparse.Namespace, primary: bool = True) -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {}
+    if provider == "openai":
+        kwargs["base_url"] = args.base_url or "http://localhost:1234/v1"
+    elif provider == "ollama":
+        kwargs["host"] = args.host or "http://localhost:11434"
+    elif provider in ("llamacpp", "llamacpp_pool"):
+        if not args.model_path:
+            raise ValueError(f"--model-path is required for the {provider} provider")
+        kwargs["model_path"] = args.model_path
+        kwargs["n_gpu_layers"] = args.n_gpu_layers
+        if provider == "llamacpp_pool":
+            kwargs["workers"] = args.pool_workers
+            kwargs["n_gpu_layers"] = 0 if args.n_gpu_layers < 0 else args.n_gpu_layers
+    else:
+        # --api-key belongs to the primary provider; backups use the keychain
+        api_key = args.api_key if primary else None
+        if not api_key:
+            from src.utils.credential_manager import CredentialManager
+            api_key = CredentialManager.get_credential(f"{provider}_api_key")
+        kwargs["api_key"] = api_key
+    return kwargs
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="main.py batch",
+        description="Optimize every prompt in a JSONL file without starting the GUI."
+    )
+    parser.add_argument("input", help="JSONL file of raw prompts ('-' for stdin)")
+    parser.add_argument("-o", "--output", default="-", help="JSONL file for results ('-' for stdout)")
+    parser.add_argument("--provider", default="openai", choices=sorted(DEFAULT_CONCURRENCY.keys()))
+    parser.add_argument("--model", required=True, help="Model name passed to the provider")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Max concurrent requests (capped by the provider's concurrency limit)")
+    parser.add_argument("--base-url", help="Base URL for OpenAI-compatible servers")
+    parser.add_argument("--host", help="Ollama host")
+    parser.add_argument("--model-path", help="GGUF model path for llama.cpp")
+    parser.add_argument("--n-gpu-layers", type=int, default=-1)
+    parser.add_argument("--pool-workers", type=int, default=None,
+                        help="Worker processes for llamacpp_pool (default: CPU cores / 4)")
+    parser.add_argument("--api-key", help="API key for cloud providers (defaults to the OS keychain)")
+    parser.add_argument("--cache-path", default="prompt_forge_cache.db", help="Response cache file")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the provider, bypassing the cache")
+    parser.add_argument("--hedge", action="append", default=[], metavar="PROVIDER:MODEL",
+                        help="Backup backend raced against the primary when it is slow (repeatable)")
+    parser.add_argument("--hedge-delay", type=float, default=2.0,
+                        help="Seconds to wait for the primary before sending to a backup")
+    parser.add_argument("--save-history", action="store_true",
+                        help="Also record successful results in the GUI's history database")
+    parser.add_argument("--history-db", default="prompt_forge.db", help="History database for --save-history")
+    parser.add_argument("--tokens-per-minute", type=int, default=None,
+                        help="Token budget per minute for the provider (default: its entry-tier limit)")
+    parser.add_argument("--context-tokens", type=int, default=None,
+                        help="Model context size; longer prompts are optimized in chunks (llama.cpp reports its own)")
+    parser.add_argument("--template-version", type=int, default=None,
+                        help="Version of the optimize meta-prompt template (default: the latest)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Attach each call's CPU, memory and GPU usage to the results (use with --workers 1)")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    try:
+        optimizer = PromptOptimizer(provider_type=args.provider, **_provider_kwargs(args.provider, args))
+        optimizer.set_template("optimize", args.template_version)
+        hedge_backups = []
+        for spec in args.hedge:
+            provider, _, model = spec.partition(":")
+            if provider not in DEFAULT_CONCURRENCY or not model:
+                raise ValueError(f"Invalid --hedge value '{spec}', expected PROVIDER:MODEL")
+            hedge_backups.append((provider, model, _provider_kwargs(provider, args, primary=False)))
+    except Exception as e:
+        print(f"Provider Load Error: {e}", file=sys.stderr)
+        return 1
+
+    optimizer.cache = ResponseCache(args.cache_path, enabled=not args.no_cache)
+    optimizer.profile_resources = args.profile
+    optimizer.max_prompt_tokens = args.context_tokens
+    limits = {args.provider: {"tokens_per_minute": args.tokens_per_minute}} if args.tokens_per_minute else None
+    optimizer.scheduler = RequestScheduler(limits)
+    batch = BatchOptimizer(optimizer, args.provider, max_workers=args.workers,
+                           hedge_backups=hedge_backups, hedge_delay=args.hedge_delay)
+
+    # Results are queued to a background writer that commits them in batches
+    db = DatabaseManager(args.history_db) if args.save_history else None
+
+    source = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    sink = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    completed = failed = 0
+    prompt_tokens = cached_tokens = 0
+    start = time.perf_counter()
+    try:
+        for result in batch.run(read_prompts(source), args.model):
+            sink.write(json.dumps(result, ensure_ascii=False) + "\n")
+            sink.flush()
+            completed += 1
+            metrics = result.get("metrics") or {}
+            if metrics.get("cached_tokens") is not None and not result.get("cached"):
+                prompt_tokens += metrics.get("prompt_tokens") or 0
+                cached_tokens += metrics["cached_tokens"]
+            if "error" in result:
+                failed += 1
+            elif db is not None and not result.get("cached"):
+                # Cache hits are already in history
+                db.enqueue_session(result["raw_prompt"], result.get("elements", {}), result.get("final_prompt", ""),
+                                   metrics=result.get("metrics"), resources=result.get("resources"))
+            print(f"[{completed}] {result['id']} {'FAILED' if 'error' in result else 'ok'}", file=sys.stderr)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+        if db is not None:
+            db.close()
+
+    elapsed = time.perf_counter() - start
+    stats = optimizer.cache.stats()
+    optimizer.cache.close()
+    schedule = optimizer.scheduler.stats().get(args.provider, {})
+    print(f"Done: {completed} prompts ({failed} failed) in {elapsed:.1f}s "
+          f"with {batch.max_workers} workers, "
+          f"{stats['hits_memory'] + stats['hits_disk']} cache hits, "
+          f"{schedule.get('rejected', 0)} too long for the context", file=sys.stderr)
+    if prompt_tokens:
+        print(f"Prompt cache: {cached_tokens} of {prompt_tokens} prompt tokens "
+              f"({cached_tokens / prompt_tokens:.0%}) served from the backend's cache "
+              f"(template {optimizer.template.id})", file=sys.stderr)
+    return 0 if failed == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+# A disk hit only rewrites its access time when the stored one is older than
+# this, so reads rarely write; LRU eviction doesn't need finer times
+_TOUCH_INTERVAL = 3600.0
+
+class ResponseCache:
+    """
+    Two-tier cache of parsed optimizer responses.
+
+    Entries are keyed on a hash of everything that determines the response
+    (backend and its connection, model, system prompt, user prompt, sampling
+    params).
+    A bounded in-memory LRU sits in front of an SQLite file; both tiers expire
+    entries after `ttl_seconds` and evict least recently used entries when full.
+    Pass path=None for a memory-only cache.
+    """
+
+    def __init__(self, path: Optional[str] = "prompt_forge_cache.db", max_memory_entries: int = 256,
+                 max_disk_entries: int = 10000, ttl_seconds: Optional[float] = 7 * 24 * 3600,
+                 enabled: bool = True):
+        self.enabled = enabled
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        # key -> (json value, created timestamp)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_responses_accessed ON responses (accessed)")
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(provider: str, model: str, system_prompt: str, user_prompt: str,
+                 params: Optional[Dict[str, Any]] = None) -> str:
+        """
+        `provider` identifies the backend instance, not just its type (e.g.
+        ProviderRegistry.make_key of its config), so two servers that use the
+        same model name don't share entries.
+        """
+        payload = json.dumps(
+            [provider, model, system_prompt, user_prompt, params or {}],
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    return json.loads(entry[0])
+                del self._memory[key]
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT value, created, accessed FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    if not self._expired(row[1], now):
+                        if now - row[2] > _TOUCH_INTERVAL:
+                            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                            self._conn.commit()
+                        self._remember(key, row[0], row[1])
+                        self.hits_disk += 1
+                        return json.loads(row[0])
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Dict[str, Any]):
+        if not self.enabled:
+            return
+        now = time.time()
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, data, now)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, data, now, now)
+                )
+                self._evict_disk(now)
+                self._conn.commit()
+
+    def _remember(self, key: str, data: str, created: float):
+        self._memory[key] = (data, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _evict_disk(self, now: float):
+        if self.ttl_seconds is not None:
+            cur = self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+            self.evictions += max(cur.rowcount, 0)
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_disk_entries:
+            cur = self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY accessed ASC LIMIT ?)",
+                (count - self.max_disk_entries,)
+            )
+            self.evictions += max(cur.rowcount, 0)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM responses")
+                self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            disk_entries = 0
+            if self._conn is not None:
+                disk_entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
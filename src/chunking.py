@@ -0,0 +1,109 @@
+from typing import Callable, List, Tuple
+
+# Boundaries a long prompt is split at, most preferred first
+_SEPARATORS = ("\n\n", "\n", ". ", " ")
+
+# Written by the reduce step where the data belongs; replaced by the original text
+DATA_PLACEHOLDER = "{{DATA}}"
+
+MAP_SYSTEM_PROMPT = """
+You are an expert prompt engineer. A raw prompt was too long to read at once and has been split into parts. You will see one part. Extract what this part contributes to a structured prompt.
+
+You MUST return the output in strict JSON format:
+{
+    "elements": {
+        "persona": "...",
+        "context": "...",
+        "instruction": "...",
+        "constraints": "...",
+        "format": "...",
+        "exemplars": "...",
+        "tone": "...",
+        "delimiters": "...",
+        "data": "...",
+        "technique": "..."
+    },
+    "is_data": false
+}
+
+Use an empty string for elements this part doesn't mention. In "data", describe the data in this part briefly (what it is, its format, how much of it); do not copy it. Set "is_data" to true if this part is mostly material to be processed (documents, records, code, logs) rather than instructions.
+
+Do not include any text before or after the JSON.
+"""
+
+REDUCE_SYSTEM_PROMPT = """
+You are an expert prompt engineer and optimization engine. A long raw prompt was analyzed in parts, and you get the structured elements found in each part, in order. Merge them into one set of elements (drop repetitions; when parts contradict each other, prefer the later part) and rewrite them into a highly effective, structured prompt using best practices (CRISPE, Chain-of-Thought).
+
+The raw prompt's data is too long to repeat. In the final prompt, write the placeholder {{DATA}} once, where the data belongs; it will be replaced by the original data.
+
+You MUST return the output in strict JSON format:
+{
+    "elements": {
+        "persona": "...",
+        "context": "...",
+        "instruction": "...",
+        "constraints": "...",
+        "format": "...",
+        "exemplars": "...",
+        "tone": "...",
+        "delimiters": "...",
+        "data": "...",
+        "technique": "..."
+    },
+    "final_prompt": "..."
+}
+
+Do not include any text before or after the JSON.
+"""
+
+
+def _pieces(text: str, max_tokens: int, count_tokens: Callable[[str], int], level: int = 0) -> List[Tuple[str, int]]:
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return [(text, tokens)]
+    if level == len(_SEPARATORS):
+        # A single run without any separator (e.g. base64): cut it by characters
+        size = max(1, len(text) * max_tokens // tokens)
+        return [(text[i:i + size], count_tokens(text[i:i + size])) for i in range(0, len(text), size)]
+    separator = _SEPARATORS[level]
+    parts = text.split(separator)
+    pieces = []
+    for i, part in enumerate(parts):
+        # Separators stay attached, so the chunks join back into the original text
+        if i < len(parts) - 1:
+            part += separator
+        if part:
+            pieces.extend(_pieces(part, max_tokens, count_tokens, level + 1))
+    return pieces
+
+
+def split_text(text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    """
+    Splits text into chunks of about max_tokens tokens or fewer, cutting at
+    paragraph, line, sentence or word boundaries (in that order of preference).
+    "".join(chunks) == text.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for piece, tokens in _pieces(text, max_tokens, count_tokens):
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def insert_data(final_prompt: str, data: str) -> str:
+    """
+    Puts the original data into the reduced final prompt, at the placeholder
+    if the model wrote one, otherwise after the prompt.
+    """
+    if DATA_PLACEHOLDER in final_prompt:
+        return final_prompt.replace(DATA_PLACEHOLDER, data, 1).replace(DATA_PLACEHOLDER, "")
+    if not data:
+        return final_prompt
+    return f"{final_prompt.rstrip()}\n\n<data>\n{data.strip()}\n</data>"
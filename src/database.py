@@ -1,21 +1,234 @@
 import json
+import queue
+import threading
+import uuid
 from datetime import datetime
-from typing import List, Optional, Dict, Any
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
-from sqlalchemy.orm import declarative_base, sessionmaker, scoped_session
+from typing import Callable, List, Optional, Dict, Any, Iterable, Iterator, Tuple
+from sqlalchemy import (create_engine, event, insert, select, Column, ForeignKey, Index, Integer, Float, String,
+                        Text, DateTime, MetaData, Table, and_, or_, func)
+from sqlalchemy.orm import declarative_base, relationship, sessionmaker, scoped_session
 
 Base = declarative_base()
 
+# Characters of the raw prompt loaded for history list entries
+HISTORY_PREVIEW_CHARS = 40
+
+# Applied to every new SQLite connection. WAL lets readers (the history list)
+# run alongside the writer, and with WAL synchronous=NORMAL only fsyncs at
+# checkpoints, which is still safe against application crashes.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",  # 64 MiB
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Full-text index over the prompt text and the structured element values.
+# It stores its own copy of the text, since the element text is gathered from
+# session_elements, and triggers keep it in sync. Element rows written before
+# their session (as add_sessions does) are picked up by the session insert
+# trigger; element changes to an existing session rebuild its row.
+_ELEMENTS_TEXT_SQL = (
+    "(SELECT group_concat(text, ' ') FROM "
+    "(SELECT text FROM session_elements WHERE session_id = {id} ORDER BY position))"
+)
+_FTS_REINDEX_SQL = """
+        DELETE FROM prompt_sessions_fts WHERE rowid = {id};
+        INSERT INTO prompt_sessions_fts(rowid, raw_prompt, final_prompt, elements)
+        SELECT id, raw_prompt, final_prompt, """ + _ELEMENTS_TEXT_SQL + """
+        FROM prompt_sessions WHERE id = {id};"""
+FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS prompt_sessions_fts USING fts5(
+        raw_prompt, final_prompt, elements,
+        tokenize = 'porter unicode61'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS prompt_sessions_fts_insert AFTER INSERT ON prompt_sessions BEGIN
+        INSERT INTO prompt_sessions_fts(rowid, raw_prompt, final_prompt, elements)
+        VALUES (new.id, new.raw_prompt, new.final_prompt, {_ELEMENTS_TEXT_SQL.format(id="new.id")});
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS prompt_sessions_fts_delete AFTER DELETE ON prompt_sessions BEGIN
+        DELETE FROM prompt_sessions_fts WHERE rowid = old.id;
+    END""",
+    # Foreign keys aren't enforced by SQLite by default, so cascade here
+    """CREATE TRIGGER IF NOT EXISTS prompt_sessions_delete_elements AFTER DELETE ON prompt_sessions BEGIN
+        DELETE FROM session_elements WHERE session_id = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS prompt_sessions_fts_update AFTER UPDATE ON prompt_sessions BEGIN
+        {_FTS_REINDEX_SQL.format(id="new.id")}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS session_elements_fts_insert AFTER INSERT ON session_elements
+        WHEN EXISTS (SELECT 1 FROM prompt_sessions WHERE id = new.session_id) BEGIN
+        {_FTS_REINDEX_SQL.format(id="new.session_id")}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS session_elements_fts_delete AFTER DELETE ON session_elements
+        WHEN EXISTS (SELECT 1 FROM prompt_sessions WHERE id = old.session_id) BEGIN
+        {_FTS_REINDEX_SQL.format(id="old.session_id")}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS session_elements_fts_update AFTER UPDATE ON session_elements
+        WHEN EXISTS (SELECT 1 FROM prompt_sessions WHERE id = new.session_id) BEGIN
+        {_FTS_REINDEX_SQL.format(id="new.session_id")}
+    END""",
+]
+FTS_BACKFILL = f"""
+    INSERT INTO prompt_sessions_fts(rowid, raw_prompt, final_prompt, elements)
+    SELECT id, raw_prompt, final_prompt, {_ELEMENTS_TEXT_SQL.format(id="prompt_sessions.id")}
+    FROM prompt_sessions
+"""
+FTS_SEARCH = """
+    SELECT s.id, s.timestamp, s.topic_group, substr(s.raw_prompt, 1, :preview),
+           snippet(prompt_sessions_fts, -1, '[', ']', '…', 10), prompt_sessions_fts.rank
+    FROM prompt_sessions_fts
+    JOIN prompt_sessions AS s ON s.id = prompt_sessions_fts.rowid
+    WHERE prompt_sessions_fts MATCH :query
+    ORDER BY prompt_sessions_fts.rank
+    LIMIT :limit OFFSET :offset
+"""
+
+# Schema version kept in PRAGMA user_version; see DatabaseManager._migrate
+SCHEMA_VERSION = 5
+
+# Per-call metrics stored on each session (see src.utils.metrics.CallTimer)
+METRIC_FIELDS = ("provider", "model", "latency_ms", "ttft_ms", "prompt_tokens", "completion_tokens", "cached_tokens",
+                 "template_version")
+
+# Resource usage of the call (see src.utils.hardware_monitor.ResourceProfiler)
+# and the local backend settings it ran with
+RESOURCE_FIELDS = ("cpu_time_ms", "cpu_cores", "system_cpu_mean", "system_cpu_peak", "rss_peak_mb", "rss_growth_mb",
+                   "gpu_memory_peak_mb", "gpu_memory_growth_mb", "gpu_load_peak", "n_ctx", "n_gpu_layers")
+
+# Moves the pre-1 JSON blob into session_elements (one row per key, in order).
+# Values become text the way _element_text stores them: strings as they are,
+# null as '', anything else as JSON.
+_MIGRATE_ELEMENTS_SQL = """
+    INSERT OR IGNORE INTO session_elements (session_id, position, element_key, text)
+    SELECT s.id,
+           row_number() OVER (PARTITION BY s.id ORDER BY j.id) - 1,
+           j.key,
+           CASE j.type WHEN 'text' THEN j.value WHEN 'null' THEN '' WHEN 'true' THEN 'true'
+                       WHEN 'false' THEN 'false' ELSE CAST(j.value AS TEXT) END
+    FROM prompt_sessions AS s, json_each(s.structured_elements_json) AS j
+    WHERE json_valid(s.structured_elements_json) AND json_type(s.structured_elements_json) = 'object'
+"""
+# A blob that isn't an object (a list, a bare string, invalid JSON) is kept whole
+# as a single "elements" element, so dropping the column loses nothing
+_MIGRATE_OTHER_ELEMENTS_SQL = """
+    INSERT OR IGNORE INTO session_elements (session_id, position, element_key, text)
+    SELECT id, 0, 'elements',
+           CASE WHEN json_valid(structured_elements_json) AND json_type(structured_elements_json) = 'text'
+                THEN json_extract(structured_elements_json, '$') ELSE structured_elements_json END
+    FROM prompt_sessions
+    WHERE structured_elements_json IS NOT NULL AND structured_elements_json != ''
+      AND NOT (json_valid(structured_elements_json)
+               AND json_type(structured_elements_json) IN ('object', 'null'))
+"""
+
+
+# Nearest-rank percentiles of one metric column per backend; {picks} holds one
+# "min(CASE WHEN rn >= p * n THEN value END)" per requested percentile
+BACKEND_PERCENTILES = """
+    WITH ranked AS (
+        SELECT provider, model, {column} AS value,
+               row_number() OVER (PARTITION BY provider, model ORDER BY {column}) AS rn,
+               count(*) OVER (PARTITION BY provider, model) AS n
+        FROM prompt_sessions
+        WHERE provider IS NOT NULL AND {column} IS NOT NULL
+          AND (:since IS NULL OR timestamp >= :since)
+    )
+    SELECT provider, model, max(n), {picks}
+    FROM ranked
+    GROUP BY provider, model
+"""
+
+# Calls without a cached_tokens figure (backends that don't report it) are left out
+PROMPT_CACHE_STATS = """
+    SELECT provider, model, template_version, count(*), sum(prompt_tokens), sum(cached_tokens),
+           sum(CASE WHEN cached_tokens > 0 THEN 1 ELSE 0 END)
+    FROM prompt_sessions
+    WHERE provider IS NOT NULL AND cached_tokens IS NOT NULL
+      AND (:since IS NULL OR timestamp >= :since)
+    GROUP BY provider, model, template_version
+    ORDER BY provider, model, template_version
+"""
+
+BACKEND_TOKENS = """
+    SELECT provider, model, avg(prompt_tokens), avg(completion_tokens),
+           sum(completion_tokens) * 1000.0 / sum(CASE WHEN completion_tokens IS NOT NULL THEN latency_ms END)
+    FROM prompt_sessions
+    WHERE provider IS NOT NULL AND (:since IS NULL OR timestamp >= :since)
+    GROUP BY provider, model
+"""
+
+def to_fts_query(text: str) -> str:
+    """
+    Turns free text into a safe FTS5 query: every word must match (quoted, so
+    FTS syntax characters in the input are literal) and the last word also
+    matches as a prefix, which suits search-as-you-type.
+    """
+    terms = ['"' + word.replace('"', '""') + '"' for word in text.split()]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+class SessionElement(Base):
+    """
+    One structured element (persona, context, ...) of a session.
+    """
+    __tablename__ = 'session_elements'
+
+    session_id = Column(Integer, ForeignKey('prompt_sessions.id', ondelete='CASCADE'), primary_key=True)
+    element_key = Column(String(64), primary_key=True, index=True)
+    # Order of the key in the model's response
+    position = Column(Integer, nullable=False, default=0)
+    text = Column(Text)
+
+
 class PromptSession(Base):
     __tablename__ = 'prompt_sessions'
 
     id = Column(Integer, primary_key=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    topic_group = Column(String(255))
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+    topic_group = Column(String(255), index=True)
     raw_prompt = Column(Text)
-    # Storing JSON as Text for broad compatibility
-    structured_elements_json = Column(Text) 
     final_prompt = Column(Text)
+    # Metrics of the LLM call that produced the session; NULL for sessions
+    # saved before they were recorded or answered without a call
+    provider = Column(String(32))
+    model = Column(String(255))
+    latency_ms = Column(Float)
+    ttft_ms = Column(Float)
+    prompt_tokens = Column(Integer)
+    completion_tokens = Column(Integer)
+    # Prompt tokens served from the backend's prompt cache, and the meta-prompt
+    # template (src.templates) the call was made with
+    cached_tokens = Column(Integer)
+    template_version = Column(String(64))
+    # Resource profile of the call; NULL unless profiling was enabled
+    cpu_time_ms = Column(Float)
+    cpu_cores = Column(Float)
+    system_cpu_mean = Column(Float)
+    system_cpu_peak = Column(Float)
+    rss_peak_mb = Column(Float)
+    rss_growth_mb = Column(Float)
+    gpu_memory_peak_mb = Column(Float)
+    gpu_memory_growth_mb = Column(Float)
+    gpu_load_peak = Column(Float)
+    n_ctx = Column(Integer)
+    n_gpu_layers = Column(Integer)
+    # Shared by the sessions of one multi-model comparison (see save_comparison)
+    comparison_id = Column(String(32), index=True)
+    # Loaded with the session in one extra IN query, never one query per row
+    elements = relationship(SessionElement, order_by=SessionElement.position, lazy="selectin",
+                            cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        # Per-backend percentile queries read this index in order
+        Index("ix_prompt_sessions_backend_latency", "provider", "model", "latency_ms"),
+    )
+
+    @property
+    def structured_elements(self) -> Dict[str, str]:
+        return {element.element_key: element.text for element in self.elements}
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -23,29 +236,228 @@ class PromptSession(Base):
             "timestamp": self.timestamp.isoformat(),
             "topic_group": self.topic_group,
             "raw_prompt": self.raw_prompt,
-            "structured_elements": json.loads(self.structured_elements_json) if self.structured_elements_json else {},
-            "final_prompt": self.final_prompt
+            "structured_elements": self.structured_elements,
+            "final_prompt": self.final_prompt,
+            "metrics": {field: getattr(self, field) for field in METRIC_FIELDS},
+            "resources": {field: getattr(self, field) for field in RESOURCE_FIELDS},
+            "comparison_id": self.comparison_id
+        }
+
+    def to_summary(self) -> Dict[str, Any]:
+        """
+        The fields shown in the history list, same shape as get_history_page rows.
+        """
+        return {
+            "id": self.id,
+            "timestamp": self.timestamp,
+            "topic_group": self.topic_group,
+            "preview": (self.raw_prompt or "")[:HISTORY_PREVIEW_CHARS]
         }
 
+# Bulk inserts go through temp tables and one INSERT ... SELECT per table: the
+# FTS trigger then runs inside one statement, which is several times faster
+# than firing it from one INSERT execution per row. `seq` is the position of
+# the session in the batch.
+_staging_metadata = MetaData()
+_session_staging = Table(
+    "prompt_sessions_staging", _staging_metadata,
+    Column("seq", Integer, primary_key=True),
+    Column("raw_prompt", Text),
+    Column("final_prompt", Text),
+    Column("topic_group", String(255)),
+    Column("timestamp", DateTime),
+    Column("comparison_id", String(32)),
+    *[Column(column.name, column.type) for column in PromptSession.__table__.columns
+      if column.name in METRIC_FIELDS + RESOURCE_FIELDS],
+    prefixes=["TEMPORARY"]
+)
+_element_staging = Table(
+    "session_elements_staging", _staging_metadata,
+    Column("seq", Integer),
+    Column("position", Integer),
+    Column("element_key", String(64)),
+    Column("text", Text),
+    prefixes=["TEMPORARY"]
+)
+_STAGING_COLUMNS = "raw_prompt, final_prompt, topic_group, timestamp, comparison_id, " + ", ".join(METRIC_FIELDS + RESOURCE_FIELDS)
+
+
+def _apply_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def _session_row(raw_prompt: str, structured_elements: Dict, final_prompt: str,
+                 topic_group: str = "General", timestamp: Optional[datetime] = None,
+                 metrics: Optional[Dict[str, Any]] = None,
+                 resources: Optional[Dict[str, Any]] = None,
+                 comparison_id: Optional[str] = None) -> Dict[str, Any]:
+    row = {
+        "raw_prompt": raw_prompt,
+        "structured_elements": structured_elements or {},
+        "final_prompt": final_prompt,
+        "topic_group": topic_group,
+        "timestamp": timestamp or datetime.now(),
+        "comparison_id": comparison_id
+    }
+    for field in METRIC_FIELDS:
+        row[field] = (metrics or {}).get(field)
+    for field in RESOURCE_FIELDS:
+        row[field] = (resources or {}).get(field)
+    return row
+
+
+def _element_text(value: Any) -> str:
+    # Models occasionally return lists or objects for an element
+    if isinstance(value, str):
+        return value
+    if value is None:
+        return ""
+    return json.dumps(value, ensure_ascii=False)
+
+
+class SessionWriter:
+    """
+    Background thread that performs session inserts for its callers. submit()
+    only enqueues; the writer takes everything that has queued up (up to
+    `max_batch`) and writes it with add_sessions in one transaction, so a burst
+    of saves costs a single commit.
+    """
+
+    def __init__(self, db: "DatabaseManager", max_batch: int = 1000):
+        self.db = db
+        self.max_batch = max_batch
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="session-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, raw_prompt: str, structured_elements: Dict, final_prompt: str, topic_group: str = "General",
+               callback: Optional[Callable[[Dict[str, Any]], None]] = None, metrics: Optional[Dict[str, Any]] = None,
+               resources: Optional[Dict[str, Any]] = None):
+        """
+        Queues a session. `callback` runs on the writer thread with the saved
+        session's summary (see PromptSession.to_summary).
+        """
+        row = _session_row(raw_prompt, structured_elements, final_prompt, topic_group,
+                           metrics=metrics, resources=resources)
+        self._queue.put((row, callback))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until everything submitted so far has been written.
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            entries = [item for item in batch if isinstance(item, tuple)]
+            if entries:
+                try:
+                    ids = self.db.add_sessions([row for row, _ in entries])
+                except Exception as e:
+                    print(f"DB Error: {e}")
+                    ids = []
+                for session_id, (row, callback) in zip(ids, entries):
+                    if callback is not None:
+                        callback({
+                            "id": session_id,
+                            "timestamp": row["timestamp"],
+                            "topic_group": row["topic_group"],
+                            "preview": (row["raw_prompt"] or "")[:HISTORY_PREVIEW_CHARS]
+                        })
+
+            for item in batch:
+                if item is None:
+                    running = False
+                elif isinstance(item, threading.Event):
+                    item.set()
+
+
 class DatabaseManager:
     def __init__(self, db_path: str = "prompt_forge.db"):
+        self.db_path = db_path
         self.engine = create_engine(f'sqlite:///{db_path}')
+        event.listen(self.engine, "connect", _apply_pragmas)
         Base.metadata.create_all(self.engine)
-        self.Session = scoped_session(sessionmaker(bind=self.engine))
+        self._migrate()
+        # create_all skips tables that already exist, so databases created
+        # before the indexes were added get them here
+        for index in PromptSession.__table__.indexes:
+            index.create(self.engine, checkfirst=True)
+        self._ensure_search_index()
+        # Objects stay readable after commit without a refresh SELECT
+        self.Session = scoped_session(sessionmaker(bind=self.engine, expire_on_commit=False))
+        self.writer: Optional[SessionWriter] = None
+        self._writer_lock = threading.Lock()
+
+    def _migrate(self):
+        """
+        Upgrades databases created by older versions, tracked with PRAGMA user_version.
+        Version 1 moves structured elements from the JSON column into session_elements.
+        Version 2 adds the per-call metric columns, version 3 the resource profile
+        columns, version 4 comparison_id and version 5 cached_tokens and template_version.
+        """
+        with self.engine.begin() as conn:
+            version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+            if version >= SCHEMA_VERSION:
+                return
+            columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(prompt_sessions)")}
+            if "structured_elements_json" in columns:
+                # The old FTS triggers read the JSON column; they are recreated
+                # from FTS_SCHEMA afterwards. The indexed text itself is unchanged.
+                for trigger in ("prompt_sessions_fts_insert", "prompt_sessions_fts_update"):
+                    conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger}")
+                conn.exec_driver_sql(_MIGRATE_ELEMENTS_SQL)
+                conn.exec_driver_sql(_MIGRATE_OTHER_ELEMENTS_SQL)
+                conn.exec_driver_sql("ALTER TABLE prompt_sessions DROP COLUMN structured_elements_json")
+            for column in PromptSession.__table__.columns:
+                if column.name not in columns:
+                    column_type = column.type.compile(dialect=self.engine.dialect)
+                    conn.exec_driver_sql(f"ALTER TABLE prompt_sessions ADD COLUMN {column.name} {column_type}")
+            conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
 
-    def add_session(self, raw_prompt: str, structured_elements: Dict, final_prompt: str, topic_group: str = "General") -> PromptSession:
+    def _ensure_search_index(self):
+        with self.engine.begin() as conn:
+            exists = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'prompt_sessions_fts'"
+            ).first()
+            for statement in FTS_SCHEMA:
+                conn.exec_driver_sql(statement)
+            if not exists:
+                # Index sessions saved before search existed
+                conn.exec_driver_sql(FTS_BACKFILL)
+
+    def add_session(self, raw_prompt: str, structured_elements: Dict, final_prompt: str, topic_group: str = "General",
+                    metrics: Optional[Dict[str, Any]] = None,
+                    resources: Optional[Dict[str, Any]] = None) -> PromptSession:
         session = self.Session()
         try:
-            new_entry = PromptSession(
-                raw_prompt=raw_prompt,
-                structured_elements_json=json.dumps(structured_elements),
-                final_prompt=final_prompt,
-                topic_group=topic_group,
-                timestamp=datetime.now()
-            )
+            row = _session_row(raw_prompt, structured_elements, final_prompt, topic_group,
+                               metrics=metrics, resources=resources)
+            elements = row.pop("structured_elements")
+            new_entry = PromptSession(**row)
+            new_entry.elements = [
+                SessionElement(element_key=key, position=position, text=_element_text(value))
+                for position, (key, value) in enumerate(elements.items())
+            ]
             session.add(new_entry)
             session.commit()
-            session.refresh(new_entry)
             return new_entry
         except Exception as e:
             session.rollback()
@@ -53,6 +465,108 @@ class DatabaseManager:
         finally:
             session.close()
 
+    def add_sessions(self, sessions: Iterable[Dict[str, Any]]) -> List[int]:
+        """
+        Inserts many sessions in a single transaction and returns their ids in order.
+        Each item has the add_session arguments as keys (raw_prompt,
+        structured_elements, final_prompt and optionally topic_group, timestamp,
+        comparison_id, metrics and resources, or the metric and resource fields
+        themselves).
+        """
+        session_rows = []
+        element_rows = []
+        for seq, item in enumerate(sessions):
+            metrics = item.get("metrics") or {field: item.get(field) for field in METRIC_FIELDS}
+            resources = item.get("resources") or {field: item.get(field) for field in RESOURCE_FIELDS}
+            row = _session_row(item["raw_prompt"], item.get("structured_elements"), item["final_prompt"],
+                               item.get("topic_group", "General"), item.get("timestamp"), metrics, resources,
+                               item.get("comparison_id"))
+            for position, (key, value) in enumerate(row.pop("structured_elements").items()):
+                element_rows.append({"seq": seq, "position": position, "element_key": key,
+                                     "text": _element_text(value)})
+            row["seq"] = seq
+            session_rows.append(row)
+        if not session_rows:
+            return []
+
+        with self.engine.begin() as conn:
+            # Take the write lock up front: the ids below are read before anything is
+            # written to the main database, so no other writer may commit in between
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            _staging_metadata.create_all(conn, checkfirst=True)
+            conn.execute(_session_staging.delete())
+            conn.execute(_element_staging.delete())
+            conn.execute(insert(_session_staging), session_rows)
+            if element_rows:
+                conn.execute(insert(_element_staging), element_rows)
+
+            # Ids are assigned explicitly so elements can be written first
+            first_id = conn.exec_driver_sql("SELECT coalesce(max(id), 0) + 1 FROM prompt_sessions").scalar()
+            conn.exec_driver_sql(
+                "INSERT INTO session_elements (session_id, position, element_key, text) "
+                "SELECT ? + seq, position, element_key, text FROM session_elements_staging",
+                (first_id,)
+            )
+            conn.exec_driver_sql(
+                f"INSERT INTO prompt_sessions (id, {_STAGING_COLUMNS}) "
+                f"SELECT ? + seq, {_STAGING_COLUMNS} FROM prompt_sessions_staging ORDER BY seq",
+                (first_id,)
+            )
+            conn.execute(_session_staging.delete())
+            conn.execute(_element_staging.delete())
+        return list(range(first_id, first_id + len(session_rows)))
+
+    def save_comparison(self, raw_prompt: str, results: Iterable[Dict[str, Any]],
+                        topic_group: str = "General") -> Tuple[str, List[int]]:
+        """
+        Stores the successful results of a multi-model comparison (see
+        PromptOptimizer.aoptimize_prompt_fanout) as linked sessions, in one
+        transaction. Returns the comparison id and the new session ids.
+        """
+        comparison_id = uuid.uuid4().hex
+        ids = self.add_sessions([
+            {
+                "raw_prompt": raw_prompt,
+                "structured_elements": result.get("elements", {}),
+                "final_prompt": result.get("final_prompt", ""),
+                "topic_group": topic_group,
+                "comparison_id": comparison_id,
+                "metrics": result.get("metrics"),
+                "resources": result.get("resources")
+            }
+            for result in results if "error" not in result
+        ])
+        return comparison_id, ids
+
+    def get_comparison(self, comparison_id: str) -> List[PromptSession]:
+        """
+        The sessions of one comparison, in the order they were saved.
+        """
+        session = self.Session()
+        try:
+            return session.query(PromptSession).filter(
+                PromptSession.comparison_id == comparison_id
+            ).order_by(PromptSession.id).all()
+        finally:
+            session.close()
+
+    def enqueue_session(self, raw_prompt: str, structured_elements: Dict, final_prompt: str,
+                        topic_group: str = "General", callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                        metrics: Optional[Dict[str, Any]] = None, resources: Optional[Dict[str, Any]] = None):
+        """
+        Saves a session on the background writer without waiting for the disk.
+        """
+        with self._writer_lock:
+            if self.writer is None:
+                self.writer = SessionWriter(self)
+        self.writer.submit(raw_prompt, structured_elements, final_prompt, topic_group, callback, metrics, resources)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits for queued sessions to be written.
+        """
+        return self.writer.flush(timeout) if self.writer is not None else True
+
     def get_history(self, limit: int = 50) -> List[PromptSession]:
         session = self.Session()
         try:
@@ -60,6 +574,211 @@ class DatabaseManager:
         finally:
             session.close()
 
+    def get_history_page(self, limit: int = 50, before: Optional[Tuple[datetime, int]] = None) -> List[Dict[str, Any]]:
+        """
+        Returns history summaries, newest first, using keyset pagination:
+        pass the (timestamp, id) of the last row of the previous page as `before`.
+        Each page is an index range scan regardless of how deep it is, and only the
+        columns the history list shows are loaded.
+        """
+        session = self.Session()
+        try:
+            query = session.query(
+                PromptSession.id,
+                PromptSession.timestamp,
+                PromptSession.topic_group,
+                func.substr(PromptSession.raw_prompt, 1, HISTORY_PREVIEW_CHARS)
+            )
+            if before is not None:
+                timestamp, session_id = before
+                query = query.filter(or_(
+                    PromptSession.timestamp < timestamp,
+                    and_(PromptSession.timestamp == timestamp, PromptSession.id < session_id)
+                ))
+            rows = query.order_by(PromptSession.timestamp.desc(), PromptSession.id.desc()).limit(limit).all()
+            return [
+                {"id": row[0], "timestamp": row[1], "topic_group": row[2], "preview": row[3] or ""}
+                for row in rows
+            ]
+        finally:
+            session.close()
+
+    def iter_raw_prompts(self, after_id: int = 0, batch_size: int = 1000) -> Iterator[List[Tuple[int, str]]]:
+        """
+        Yields batches of (id, raw_prompt) for sessions with id > after_id, in id order.
+        """
+        while True:
+            with self.engine.connect() as conn:
+                batch = [tuple(row) for row in conn.execute(
+                    select(PromptSession.id, PromptSession.raw_prompt)
+                    .where(PromptSession.id > after_id)
+                    .order_by(PromptSession.id)
+                    .limit(batch_size)
+                )]
+            if not batch:
+                return
+            yield batch
+            after_id = batch[-1][0]
+
+    def search_sessions(self, text: str, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Full-text search over raw prompts, final prompts and element text, best
+        match first (bm25). Rows have the get_history_page fields plus a
+        `snippet` with the matched terms in [brackets] and the `rank`.
+        Ranking and snippets are computed inside SQLite.
+        """
+        query = to_fts_query(text)
+        if not query:
+            return []
+        with self.engine.connect() as conn:
+            rows = conn.exec_driver_sql(FTS_SEARCH, {
+                "query": query, "preview": HISTORY_PREVIEW_CHARS, "limit": limit, "offset": offset
+            }).fetchall()
+        return [
+            {
+                "id": row[0],
+                "timestamp": datetime.fromisoformat(row[1]) if isinstance(row[1], str) else row[1],
+                "topic_group": row[2],
+                "preview": row[3] or "",
+                "snippet": row[4],
+                "rank": row[5]
+            }
+            for row in rows
+        ]
+
+    def find_elements(self, element_key: str, contains: Optional[str] = None, topic_group: Optional[str] = None,
+                      model: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Values of one element across sessions (e.g. every persona used), newest first.
+        `contains` filters on a substring of the element text, `model` on the
+        model that produced the session.
+        """
+        query = (
+            select(SessionElement.session_id, PromptSession.timestamp, SessionElement.text)
+            .join(PromptSession, PromptSession.id == SessionElement.session_id)
+            .where(SessionElement.element_key == element_key)
+        )
+        if contains:
+            query = query.where(SessionElement.text.contains(contains))
+        if topic_group is not None:
+            query = query.where(PromptSession.topic_group == topic_group)
+        if model is not None:
+            query = query.where(PromptSession.model == model)
+        query = query.order_by(PromptSession.timestamp.desc()).limit(limit)
+        with self.engine.connect() as conn:
+            return [{"session_id": row[0], "timestamp": row[1], "text": row[2]} for row in conn.execute(query)]
+
+    def element_stats(self) -> List[Dict[str, Any]]:
+        """
+        Per element key: how many sessions filled it, how many distinct values
+        were used and their average length, aggregated in SQL.
+        """
+        query = (
+            select(
+                SessionElement.element_key,
+                func.count(),
+                func.count(func.distinct(SessionElement.text)),
+                func.avg(func.length(SessionElement.text))
+            )
+            .where(SessionElement.text != "")
+            .group_by(SessionElement.element_key)
+            .order_by(func.count().desc())
+        )
+        with self.engine.connect() as conn:
+            return [
+                {"element_key": row[0], "sessions": row[1], "distinct_values": row[2],
+                 "avg_length": round(row[3] or 0, 1)}
+                for row in conn.execute(query)
+            ]
+
+    def backend_percentiles(self, percentiles: Iterable[float] = (50, 90, 99),
+                            since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """
+        Latency statistics per (provider, model), fastest first. For each
+        percentile p there are "latency_p{p}" and "ttft_p{p}" entries in ms
+        (nearest-rank), plus the call count, mean token counts and completion
+        throughput in tokens/s. Percentiles are computed in SQL with window functions.
+        """
+        percentiles = list(percentiles)
+        params = {"since": since.isoformat(" ") if since else None}
+        stats: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        with self.engine.connect() as conn:
+            for metric in ("latency", "ttft"):
+                picks = ", ".join(
+                    f"min(CASE WHEN rn >= {float(p) / 100} * n THEN value END)" for p in percentiles
+                )
+                sql = BACKEND_PERCENTILES.format(column=f"{metric}_ms", picks=picks)
+                for row in conn.exec_driver_sql(sql, params):
+                    entry = stats.setdefault((row[0], row[1]), {"provider": row[0], "model": row[1]})
+                    entry.setdefault("calls", row[2])
+                    for p, value in zip(percentiles, row[3:]):
+                        entry[f"{metric}_p{p:g}"] = round(value, 1) if value is not None else None
+
+            for row in conn.exec_driver_sql(BACKEND_TOKENS, params):
+                entry = stats.get((row[0], row[1]))
+                if entry is not None:
+                    entry["avg_prompt_tokens"] = round(row[2], 1) if row[2] is not None else None
+                    entry["avg_completion_tokens"] = round(row[3], 1) if row[3] is not None else None
+                    entry["tokens_per_second"] = round(row[4], 1) if row[4] is not None else None
+
+        first = f"latency_p{percentiles[0]:g}" if percentiles else None
+        return sorted(stats.values(), key=lambda e: (e.get(first) is None, e.get(first) or 0))
+
+    def prompt_cache_stats(self, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """
+        How much of the prompt the backends served from their prompt caches, per
+        (provider, model, template_version): calls, calls with a cache hit,
+        prompt and cached token totals, and the cached share of prompt tokens,
+        i.e. the prefill (or input billing) the stable template prefix saved.
+        """
+        params = {"since": since.isoformat(" ") if since else None}
+        stats = []
+        with self.engine.connect() as conn:
+            for row in conn.exec_driver_sql(PROMPT_CACHE_STATS, params):
+                prompt_tokens, cached_tokens = row[4] or 0, row[5] or 0
+                stats.append({
+                    "provider": row[0],
+                    "model": row[1],
+                    "template_version": row[2],
+                    "calls": row[3],
+                    "cache_hits": row[6],
+                    "prompt_tokens": prompt_tokens,
+                    "cached_tokens": cached_tokens,
+                    "cached_share": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else None
+                })
+        return stats
+
+    def resource_stats(self, provider: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Resource usage of profiled calls per backend configuration (provider,
+        model, n_ctx, n_gpu_layers), for sizing hardware and picking settings.
+        Means are per call; memory figures are the worst seen.
+        """
+        query = select(
+            PromptSession.provider, PromptSession.model, PromptSession.n_ctx, PromptSession.n_gpu_layers,
+            func.count(),
+            func.avg(PromptSession.latency_ms),
+            func.sum(PromptSession.completion_tokens) * 1000.0 / func.sum(PromptSession.latency_ms),
+            func.avg(PromptSession.cpu_time_ms),
+            func.avg(PromptSession.cpu_cores),
+            func.max(PromptSession.rss_peak_mb),
+            func.avg(PromptSession.rss_growth_mb),
+            func.max(PromptSession.gpu_memory_peak_mb),
+            func.max(PromptSession.gpu_load_peak)
+        ).where(PromptSession.cpu_time_ms.isnot(None)).group_by(
+            PromptSession.provider, PromptSession.model, PromptSession.n_ctx, PromptSession.n_gpu_layers
+        ).order_by(PromptSession.provider, PromptSession.model)
+        if provider is not None:
+            query = query.where(PromptSession.provider == provider)
+        keys = ("provider", "model", "n_ctx", "n_gpu_layers", "calls", "latency_ms_mean", "tokens_per_second",
+                "cpu_time_ms_mean", "cpu_cores_mean", "rss_peak_mb", "rss_growth_mb_mean",
+                "gpu_memory_peak_mb", "gpu_load_peak")
+        with self.engine.connect() as conn:
+            return [
+                {key: round(value, 1) if isinstance(value, float) else value for key, value in zip(keys, row)}
+                for row in conn.execute(query)
+            ]
+
     def get_session(self, session_id: int) -> Optional[PromptSession]:
         session = self.Session()
         try:
@@ -68,4 +787,8 @@ class DatabaseManager:
             session.close()
 
     def close(self):
+        with self._writer_lock:
+            writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.close()
         self.Session.remove()
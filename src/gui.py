@@ -1,15 +1,287 @@
-import customtkinter as ctk
+import asyncio
+import json
+import os
 import threading
+import time
+import tkinter as tk
+from tkinter import filedialog
+import customtkinter as ctk
 import pyperclip
-from typing import Dict
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from src.batch import BatchOptimizer, read_prompts
+from src.cache import ResponseCache
 from src.optimizer import PromptOptimizer
 from src.database import DatabaseManager
-from src.utils.hardware_monitor import HardwareMonitor
+from src.scheduler import RequestScheduler
+from src.similarity import SimilarityIndex
+from src.utils.async_runner import shared_runner
+from src.utils.hardware_monitor import HardwareSampler
 from src.utils.credential_manager import CredentialManager
 
 ctk.set_appearance_mode("Dark")
 ctk.set_default_color_theme("blue")
 
+# Map display name to internal provider key
+BACKEND_MAP = {
+    "LLM Studio": "openai",
+    "Ollama": "ollama",
+    "Llama.cpp": "llamacpp",
+    "Anthropic": "anthropic",
+    "Google Gemini": "gemini",
+    "Groq": "groq"
+}
+
+# Default connection (URL / host) of the local server backends
+DEFAULT_CONNECTION = {
+    "openai": "http://localhost:1234/v1",
+    "ollama": "http://localhost:11434"
+}
+
+# Backends running on this machine; their optimizations are resource profiled
+LOCAL_BACKENDS = ("openai", "ollama", "llamacpp")
+
+# Minimum seconds between streamed token flushes to the UI
+STREAM_FLUSH_INTERVAL = 0.05
+
+# How often hardware usage is sampled (on a background thread) and redrawn
+HARDWARE_INTERVAL_MS = 2000
+# Samples shown in the hardware sparklines
+HARDWARE_SPARK_WIDTH = 12
+
+# History list geometry and paging
+HISTORY_ROW_HEIGHT = 34
+HISTORY_PAGE_SIZE = 100
+# Delay after the last keystroke before the history search runs (ms)
+SEARCH_DEBOUNCE_MS = 250
+
+
+class HistoryList(ctk.CTkFrame):
+    """
+    Virtualized history list. Only enough buttons to fill the viewport exist;
+    scrolling moves them and rebinds them to other rows. Rows are pulled from
+    `fetch_page(limit, before)` one keyset page at a time as the user scrolls
+    towards the end, so the list costs the same with 50 or 50,000 sessions.
+    """
+
+    def __init__(self, master, fetch_page: Callable[..., List[Dict[str, Any]]],
+                 on_select: Callable[[int], None], **kwargs):
+        super().__init__(master, **kwargs)
+        self.fetch_page = fetch_page
+        self.on_select = on_select
+        self.rows: List[Dict[str, Any]] = []
+        self.exhausted = False
+        # Pool of (button, canvas window id), reused for whichever rows are visible
+        self._pool: List[Tuple[ctk.CTkButton, int]] = []
+
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+        self.canvas = tk.Canvas(self, highlightthickness=0, bd=0,
+                                bg=self._apply_appearance_mode(self.cget("fg_color")))
+        self.canvas.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar = ctk.CTkScrollbar(self, command=self._on_scrollbar)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+
+        self.canvas.bind("<Configure>", lambda e: self._render())
+        self._bind_wheel(self.canvas)
+
+    def _bind_wheel(self, widget):
+        widget.bind("<MouseWheel>", self._on_wheel)
+        widget.bind("<Button-4>", lambda e: self._scroll_units(-1))
+        widget.bind("<Button-5>", lambda e: self._scroll_units(1))
+
+    def _on_wheel(self, event):
+        # Windows reports multiples of 120, macOS small deltas
+        delta = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        self._scroll_units(-delta)
+
+    def _scroll_units(self, units: int):
+        self.canvas.yview_scroll(units, "units")
+        self._render()
+
+    def _on_scrollbar(self, *args):
+        self.canvas.yview(*args)
+        self._render()
+
+    def reload(self, fetch_page: Optional[Callable[..., List[Dict[str, Any]]]] = None):
+        """
+        Drops the loaded rows and starts again from the first page, optionally
+        from a different source.
+        """
+        if fetch_page is not None:
+            self.fetch_page = fetch_page
+        self.rows = []
+        self.exhausted = False
+        self.canvas.yview_moveto(0)
+        self._load_more()
+        self._render()
+
+    def prepend(self, row: Dict[str, Any]):
+        """
+        Adds a just-saved session at the top without reloading anything.
+        """
+        self.rows.insert(0, row)
+        self._render()
+
+    def _load_more(self):
+        if self.exhausted:
+            return
+        before = (self.rows[-1]["timestamp"], self.rows[-1]["id"]) if self.rows else None
+        page = self.fetch_page(HISTORY_PAGE_SIZE, before)
+        self.rows.extend(page)
+        if len(page) < HISTORY_PAGE_SIZE:
+            self.exhausted = True
+
+    def _render(self):
+        width = self.canvas.winfo_width()
+        height = max(self.canvas.winfo_height(), HISTORY_ROW_HEIGHT)
+        visible = height // HISTORY_ROW_HEIGHT + 2
+        first = max(0, int(self.canvas.canvasy(0)) // HISTORY_ROW_HEIGHT)
+
+        # Fetch the next page before the user reaches the end of what is loaded
+        if first + visible * 2 >= len(self.rows):
+            self._load_more()
+        self.canvas.configure(scrollregion=(0, 0, width, len(self.rows) * HISTORY_ROW_HEIGHT))
+
+        while len(self._pool) < visible:
+            button = ctk.CTkButton(
+                self.canvas,
+                text=" ",  # Creates the label now so the wheel binding below covers it
+                fg_color="transparent",
+                border_width=1,
+                anchor="w",
+                height=HISTORY_ROW_HEIGHT - 4,
+                text_color=("gray10", "gray90")
+            )
+            self._bind_wheel(button)
+            for child in button.winfo_children():
+                self._bind_wheel(child)
+            self._pool.append((button, self.canvas.create_window(0, 0, window=button, anchor="nw")))
+
+        for offset, (button, window) in enumerate(self._pool):
+            index = first + offset
+            if offset >= visible or index >= len(self.rows):
+                self.canvas.itemconfigure(window, state="hidden")
+                continue
+            row = self.rows[index]
+            if row.get("snippet"):
+                # Search results show where the query matched
+                label = " ".join(row["snippet"].split())
+            else:
+                label = f"{row['preview'][:20]}..."
+            button.configure(
+                text=f"{row['timestamp'].strftime('%H:%M')} - {label}",
+                command=lambda sid=row["id"]: self.on_select(sid)
+            )
+            self.canvas.coords(window, 0, index * HISTORY_ROW_HEIGHT + 2)
+            self.canvas.itemconfigure(window, state="normal", width=width)
+
+class ComparisonWindow(ctk.CTkToplevel):
+    """
+    Side-by-side view of one raw prompt optimized by several models. The user
+    ticks the targets, then one column per target fills in as each model
+    finishes. `on_run(targets)` receives the chosen (backend, model) pairs.
+    """
+
+    def __init__(self, master, raw_prompt: str, choices: List[Tuple[str, str]],
+                 on_run: Callable[[List[Tuple[str, str]]], None]):
+        super().__init__(master)
+        self.title("Compare Models")
+        self.geometry("1300x800")
+        self.on_run = on_run
+        self.columns: List[Dict[str, Any]] = []
+
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(2, weight=1)
+        preview = " ".join(raw_prompt.split())
+        ctk.CTkLabel(self, text=preview[:150] + ("..." if len(preview) > 150 else ""),
+                     anchor="w", wraplength=1200).grid(row=0, column=0, padx=10, pady=(10, 0), sticky="ew")
+
+        # Target selection
+        self.setup_frame = ctk.CTkFrame(self)
+        self.setup_frame.grid(row=1, column=0, padx=10, pady=10, sticky="ew")
+        self.checkboxes: List[Tuple[ctk.CTkCheckBox, Tuple[str, str]]] = []
+        for i, (backend, model) in enumerate(choices):
+            checkbox = ctk.CTkCheckBox(self.setup_frame, text=f"{backend} / {model}")
+            checkbox.grid(row=i // 3, column=i % 3, padx=10, pady=5, sticky="w")
+            self.checkboxes.append((checkbox, (backend, model)))
+        extra_row = (len(choices) + 2) // 3
+        ctk.CTkLabel(self.setup_frame, text="More (backend:model, comma separated):").grid(
+            row=extra_row, column=0, padx=10, pady=5, sticky="w")
+        self.extra_entry = ctk.CTkEntry(self.setup_frame, placeholder_text="groq:llama3-8b-8192, ollama:llama3")
+        self.extra_entry.grid(row=extra_row, column=1, padx=10, pady=5, sticky="ew")
+        self.run_btn = ctk.CTkButton(self.setup_frame, text="Run Comparison", command=self._on_run_clicked)
+        self.run_btn.grid(row=extra_row, column=2, padx=10, pady=5)
+        self.status_label = ctk.CTkLabel(self.setup_frame, text="", anchor="w")
+        self.status_label.grid(row=extra_row + 1, column=0, columnspan=3, padx=10, pady=(0, 5), sticky="w")
+
+        self.results_frame = ctk.CTkScrollableFrame(self, orientation="horizontal")
+        self.results_frame.grid(row=2, column=0, padx=10, pady=(0, 10), sticky="nsew")
+
+    def _on_run_clicked(self):
+        targets = [target for checkbox, target in self.checkboxes if checkbox.get()]
+        for spec in self.extra_entry.get().split(","):
+            backend, _, model = spec.strip().partition(":")
+            if backend and model:
+                targets.append((backend.strip(), model.strip()))
+        if not targets:
+            self.status_label.configure(text="Select at least one model.")
+            return
+        self.run_btn.configure(state="disabled")
+        self.show_targets(targets)
+        self.status_label.configure(text=f"Running {len(targets)} models...")
+        self.on_run(targets)
+
+    def show_targets(self, targets: List[Tuple[str, str]]):
+        for column in self.columns:
+            column["frame"].destroy()
+        self.columns = []
+        for i, (backend, model) in enumerate(targets):
+            frame = ctk.CTkFrame(self.results_frame, width=400)
+            frame.grid(row=0, column=i, padx=5, pady=5, sticky="ns")
+            ctk.CTkLabel(frame, text=f"{backend} / {model}", font=ctk.CTkFont(weight="bold")).pack(padx=10, pady=(10, 0))
+            stats = ctk.CTkLabel(frame, text="Running...")
+            stats.pack(padx=10)
+            textbox = ctk.CTkTextbox(frame, width=380, height=560, wrap="word")
+            textbox.pack(padx=10, pady=5, fill="both", expand=True)
+            ctk.CTkButton(frame, text="Copy Prompt", width=120,
+                          command=lambda i=i: self._copy(i)).pack(pady=(0, 10))
+            self.columns.append({"frame": frame, "stats": stats, "textbox": textbox, "final_prompt": ""})
+
+    def show_result(self, index: int, result: Dict[str, Any]):
+        # Results may arrive after the window was closed
+        if not self.winfo_exists():
+            return
+        column = self.columns[index]
+        textbox = column["textbox"]
+        textbox.delete("0.0", "end")
+        metrics = result.get("metrics") or {}
+        if "error" in result:
+            column["stats"].configure(text="Failed")
+            textbox.insert("0.0", result["error"])
+            return
+        tokens = ""
+        if metrics.get("completion_tokens") is not None:
+            tokens = f" · {metrics.get('prompt_tokens') or 0} + {metrics['completion_tokens']} tokens"
+            if metrics.get("cached_tokens"):
+                tokens += f" ({metrics['cached_tokens']} from prompt cache)"
+        latency = "cached" if result.get("cached") else f"{metrics.get('latency_ms', 0) / 1000:.1f}s"
+        column["stats"].configure(text=latency + tokens)
+        column["final_prompt"] = result.get("final_prompt", "")
+        elements = "\n".join(f"{key.title()}: {value}" for key, value in result.get("elements", {}).items())
+        textbox.insert("0.0", f"{column['final_prompt']}\n\n--- Elements ---\n{elements}")
+
+    def show_done(self, elapsed_ms: float, saved: int):
+        if not self.winfo_exists():
+            return
+        self.status_label.configure(text=f"Done in {elapsed_ms / 1000:.1f}s (the slowest model), "
+                                         f"{saved} results saved to history.")
+        self.run_btn.configure(state="normal")
+
+    def _copy(self, index: int):
+        pyperclip.copy(self.columns[index]["final_prompt"])
+
+
 class App(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -19,9 +291,23 @@ class App(ctk.CTk):
         
         # Initialize Core Logic
         self.db = DatabaseManager()
+        # One background event loop drives all provider calls
+        self.async_runner = shared_runner()
         # Default to OpenAI initially, user can change
-        # Pass defaults for OpenAI
-        self.optimizer = PromptOptimizer(provider_type="openai", base_url="http://localhost:1234/v1")
+        # Pass defaults for OpenAI. Loaded lazily: load_models configures the
+        # provider on a worker thread, so the SDK import doesn't delay the window
+        self.optimizer = PromptOptimizer(provider_type="openai", lazy=True, base_url=DEFAULT_CONNECTION["openai"])
+        # Repeat optimizations are answered from the local response cache
+        self.optimizer.cache = ResponseCache()
+        # Near-duplicates of past prompts are answered from history
+        self.similarity = SimilarityIndex(self.db)
+        self.optimizer.similarity = self.similarity
+        # Shared with background batches, whose requests yield to the window's
+        self.optimizer.scheduler = RequestScheduler()
+        # CPU/RAM/GPU usage is sampled off the UI thread into a ring buffer
+        self.hardware = HardwareSampler(interval=HARDWARE_INTERVAL_MS / 1000).start()
+        # Set once the streamed final_prompt field has closed
+        self.stream_final_closed = False
         
         # Layout Config
         self.grid_columnconfigure(1, weight=1)
@@ -65,15 +351,22 @@ class App(ctk.CTk):
         
         self.pass_entry = ctk.CTkEntry(self.sidebar_frame)
         self.pass_entry.grid(row=4, column=0, padx=20, pady=(0, 10), sticky="ew")
-        self.pass_entry.insert(0, "http://localhost:1234/v1") # Default
+        self.pass_entry.insert(0, DEFAULT_CONNECTION["openai"]) # Default
 
         ctk.CTkLabel(self.sidebar_frame, text="Model:", anchor="w").grid(row=5, column=0, padx=20, pady=(10, 0), sticky="w")
         self.model_option_menu = ctk.CTkOptionMenu(self.sidebar_frame, dynamic_resizing=False, values=["Loading..."])
         self.model_option_menu.grid(row=6, column=0, padx=20, pady=(0, 10), sticky="ew")
 
         # History
-        ctk.CTkLabel(self.sidebar_frame, text="History:", anchor="w").grid(row=7, column=0, padx=20, pady=(20, 0), sticky="w")
-        self.history_frame = ctk.CTkScrollableFrame(self.sidebar_frame, label_text="Past Sessions", height=300)
+        history_header = ctk.CTkFrame(self.sidebar_frame, fg_color="transparent")
+        history_header.grid(row=7, column=0, padx=20, pady=(20, 0), sticky="ew")
+        history_header.grid_columnconfigure(1, weight=1)
+        ctk.CTkLabel(history_header, text="History:", anchor="w").grid(row=0, column=0, padx=(0, 10), sticky="w")
+        self.search_entry = ctk.CTkEntry(history_header, placeholder_text="Search...")
+        self.search_entry.grid(row=0, column=1, sticky="ew")
+        self.search_entry.bind("<KeyRelease>", self.on_search_changed)
+        self.search_after_id = None
+        self.history_frame = HistoryList(self.sidebar_frame, self.db.get_history_page, self.load_session, height=300)
         self.history_frame.grid(row=8, column=0, padx=20, pady=10, sticky="nsew")
 
         # Hardware Stats (Bottom)
@@ -84,8 +377,8 @@ class App(ctk.CTk):
         self.gpu_label = ctk.CTkLabel(self.hardware_frame, text="GPU: --%", font=ctk.CTkFont(size=11))
         self.gpu_label.pack(side="right", padx=5)
         
-        # Start Hardware Monitor
-        self.update_hardware_stats()
+        # Start Hardware Monitor; it only reads samples taken by self.hardware
+        self.after(HARDWARE_INTERVAL_MS, self.update_hardware_stats)
 
     def create_section_a(self):
         # Input Section
@@ -102,6 +395,16 @@ class App(ctk.CTk):
         self.optimize_btn = ctk.CTkButton(self.frame_a, text="Optimize Prompt", command=self.on_optimize, height=40)
         self.optimize_btn.grid(row=1, column=1, padx=10, pady=10, sticky="ns")
 
+        self.compare_btn = ctk.CTkButton(self.frame_a, text="Compare Models...", command=self.on_compare,
+                                         fg_color="transparent", border_width=1)
+        self.compare_btn.grid(row=2, column=1, padx=10, pady=(0, 10), sticky="ew")
+
+        self.batch_btn = ctk.CTkButton(self.frame_a, text="Batch File...", command=self.on_batch,
+                                       fg_color="transparent", border_width=1)
+        self.batch_btn.grid(row=3, column=1, padx=10, pady=(0, 10), sticky="ew")
+        self.batch_label = ctk.CTkLabel(self.frame_a, text="", anchor="w", font=ctk.CTkFont(size=11))
+        self.batch_label.grid(row=3, column=0, padx=10, pady=(0, 10), sticky="w")
+
     def create_section_b(self):
         # Structured Elements
         self.frame_b = ctk.CTkScrollableFrame(self.main_frame, label_text="Structured Elements")
@@ -150,32 +453,44 @@ class App(ctk.CTk):
         self.copy_master_btn = ctk.CTkButton(btn_frame, text="Master Copy", command=lambda: self.copy_to_clipboard(self.final_prompt_textbox.get("0.0", "end")))
         self.copy_master_btn.pack(pady=10, padx=10)
 
-    def on_optimize(self):
+        # Shown when the result was reused from a similar past prompt
+        self.similar_frame = ctk.CTkFrame(self.frame_c, fg_color="transparent")
+        self.similar_frame.grid(row=2, column=0, columnspan=2, padx=10, pady=(0, 10), sticky="ew")
+        self.similar_frame.grid_columnconfigure(0, weight=1)
+        self.similar_label = ctk.CTkLabel(self.similar_frame, text="", anchor="w")
+        self.similar_label.grid(row=0, column=0, sticky="w")
+        ctk.CTkButton(self.similar_frame, text="Optimize Anyway", width=140,
+                      command=lambda: self.on_optimize(use_similar=False)).grid(row=0, column=1, padx=(10, 0))
+        self.similar_frame.grid_remove()
+
+    def on_optimize(self, use_similar: bool = True):
         raw_prompt = self.raw_prompt_textbox.get("0.0", "end").strip()
         if not raw_prompt:
             return
 
         self.optimize_btn.configure(state="disabled", text="Optimizing...")
-        
-        # Run in thread to not freeze UI
-        threading.Thread(target=self.run_optimization, args=(raw_prompt,)).start()
 
-    def run_optimization(self, raw_prompt):
-        conn_value = self.pass_entry.get().strip()
+        # Read widget state on the UI thread, then run on the background loop
+        backend, kwargs = self.get_provider_config()
         model = self.model_option_menu.get()
-        backend_name = self.backend_menu.get()
-        
-        # Map display name to internal key
-        backend_map = {
-            "LLM Studio": "openai", 
-            "Ollama": "ollama",
-            "Llama.cpp": "llamacpp",
-            "Anthropic": "anthropic",
-            "Google Gemini": "gemini",
-            "Groq": "groq"
-        }
-        backend = backend_map.get(backend_name, "openai")
-         
+        self.async_runner.submit(self.run_optimization(raw_prompt, backend, kwargs, model, use_similar))
+
+    def get_provider_config(self) -> Tuple[str, Dict[str, Any]]:
+        conn_value = self.pass_entry.get().strip()
+        backend = BACKEND_MAP.get(self.backend_menu.get(), "openai")
+        return backend, self.provider_kwargs(backend, conn_value)
+
+    def default_provider_kwargs(self, backend: str) -> Dict[str, Any]:
+        # Settings for a backend other than the selected one: default local
+        # servers, the saved API key for cloud providers
+        if backend in DEFAULT_CONNECTION:
+            return self.provider_kwargs(backend, DEFAULT_CONNECTION[backend])
+        if backend == "llamacpp":
+            raise ValueError("Select Llama.cpp in the sidebar to use it (it needs a model path)")
+        return self.provider_kwargs(backend, CredentialManager.get_credential(f"{backend}_api_key"))
+
+    @staticmethod
+    def provider_kwargs(backend: str, conn_value: str) -> Dict[str, Any]:
         # Configure Provider
         kwargs = {}
         if backend == "openai":
@@ -185,21 +500,192 @@ class App(ctk.CTk):
         elif backend == "llamacpp":
             kwargs["model_path"] = conn_value
             # Defaults for CPU/GPU - could expose to UI later
+            # Same settings for model listing and optimizing, so the loaded
+            # model is reused from the provider registry instead of reloaded
             kwargs["n_gpu_layers"] = -1 # Try all layers if GPU avail
         else:
             # Cloud providers use api_key
             kwargs["api_key"] = conn_value
-            # Save credential
-            if conn_value:
-                CredentialManager.save_credential(f"{backend}_api_key", conn_value)
+        return kwargs
 
+    def configure_provider(self, backend: str, kwargs: Dict[str, Any], save_credential: bool = False):
+        # Blocking: provider construction may load a model from disk
+        if save_credential and kwargs.get("api_key"):
+            CredentialManager.save_credential(f"{backend}_api_key", kwargs["api_key"])
         self.optimizer.set_provider(backend, **kwargs)
-        
-        result = self.optimizer.optimize_prompt(raw_prompt, model)
-        
+        # Record the CPU/memory/GPU cost of local optimizations with the session
+        self.optimizer.profile_resources = backend in LOCAL_BACKENDS
+
+    async def run_optimization(self, raw_prompt: str, backend: str, kwargs: Dict[str, Any], model: str,
+                               use_similar: bool = True):
+        try:
+            await asyncio.to_thread(self.configure_provider, backend, kwargs, True)
+            self.after(0, self.clear_results)
+            # Provider streams are blocking iterators, so consume on a worker thread
+            result = await asyncio.to_thread(self.consume_stream, raw_prompt, model, use_similar)
+        except Exception as e:
+            result = {"error": f"Provider Load Error: {str(e)}"}
+
         # Update UI in main thread
         self.after(0, lambda: self.display_results(result, raw_prompt))
 
+    def on_compare(self):
+        raw_prompt = self.raw_prompt_textbox.get("0.0", "end").strip()
+        if not raw_prompt:
+            return
+        backend = BACKEND_MAP.get(self.backend_menu.get(), "openai")
+        models = [m for m in self.model_option_menu.cget("values") or [] if m not in ("Loading...", "No models found")]
+        window = ComparisonWindow(self, raw_prompt, [(backend, model) for model in models],
+                                  on_run=lambda targets: self.start_comparison(window, raw_prompt, targets))
+        window.focus()
+
+    def start_comparison(self, window: ComparisonWindow, raw_prompt: str, targets: List[Tuple[str, str]]):
+        # Read widget state on the UI thread, then fan out on the background loop
+        current_backend, current_kwargs = self.get_provider_config()
+        resolved = []
+        errors = {}
+        for i, (backend, model) in enumerate(targets):
+            try:
+                kwargs = current_kwargs if backend == current_backend else self.default_provider_kwargs(backend)
+                resolved.append((backend, model, kwargs))
+            except Exception as e:
+                errors[i] = {"error": str(e)}
+                resolved.append(None)
+        for i, error in errors.items():
+            window.show_result(i, error)
+        self.async_runner.submit(self.run_comparison(window, raw_prompt, resolved))
+
+    async def run_comparison(self, window: ComparisonWindow, raw_prompt: str,
+                             targets: List[Optional[Tuple[str, str, Dict[str, Any]]]]):
+        # None marks targets that failed before dispatch; they keep their column
+        indexes = [i for i, target in enumerate(targets) if target is not None]
+
+        def on_result(index: int, result: Dict[str, Any]):
+            self.after(0, lambda: window.show_result(indexes[index], result))
+
+        outcome = await self.optimizer.aoptimize_prompt_fanout(
+            raw_prompt, [targets[i] for i in indexes], on_result=on_result
+        )
+        try:
+            _, ids = await asyncio.to_thread(self.db.save_comparison, raw_prompt, outcome["results"])
+        except Exception as e:
+            print(f"DB Error: {e}")
+            ids = []
+        self.after(0, lambda: self.on_comparison_done(window, outcome["elapsed_ms"], len(ids)))
+
+    def on_comparison_done(self, window: ComparisonWindow, elapsed_ms: float, saved: int):
+        window.show_done(elapsed_ms, saved)
+        # While searching, the list shows search results rather than recent sessions
+        if saved and not self.search_entry.get().strip():
+            self.load_history()
+
+    def on_batch(self):
+        path = filedialog.askopenfilename(title="Prompts to optimize",
+                                          filetypes=[("JSON Lines", "*.jsonl"), ("Text", "*.txt"), ("All files", "*.*")])
+        if not path:
+            return
+        backend, kwargs = self.get_provider_config()
+        model = self.model_option_menu.get()
+        # Its own optimizer, so changing the backend in the sidebar doesn't redirect the
+        # batch; the registry, cache and scheduler are shared with the window's
+        optimizer = PromptOptimizer(provider_type=backend, registry=self.optimizer.registry, lazy=True, **kwargs)
+        optimizer.cache = self.optimizer.cache
+        optimizer.scheduler = self.optimizer.scheduler
+        output_path = os.path.splitext(path)[0] + ".optimized.jsonl"
+        self.batch_btn.configure(state="disabled")
+        self.batch_label.configure(text=f"Batch: starting {os.path.basename(path)}...")
+        threading.Thread(target=self.run_batch, args=(optimizer, backend, model, path, output_path),
+                         name="gui-batch", daemon=True).start()
+
+    def run_batch(self, optimizer: PromptOptimizer, backend: str, model: str, path: str, output_path: str):
+        # Batch requests have BATCH priority: optimizations started in the window go first
+        completed = failed = 0
+        try:
+            batch = BatchOptimizer(optimizer, backend)
+            with open(path, "r", encoding="utf-8") as source, open(output_path, "w", encoding="utf-8") as sink:
+                for result in batch.run(read_prompts(source), model):
+                    sink.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    completed += 1
+                    if "error" in result:
+                        failed += 1
+                    elif not result.get("cached"):
+                        self.db.enqueue_session(result["raw_prompt"], result.get("elements", {}),
+                                                result.get("final_prompt", ""), metrics=result.get("metrics"),
+                                                callback=lambda summary: self.similarity.invalidate())
+                    text = f"Batch: {completed} done ({failed} failed)"
+                    self.after(0, lambda text=text: self.batch_label.configure(text=text))
+            message = f"Batch: {completed} done ({failed} failed), saved to {os.path.basename(output_path)}"
+            # So the history reload below includes the last results
+            self.db.flush(timeout=10)
+        except Exception as e:
+            print(f"Batch Error: {e}")
+            message = f"Batch failed: {e}"
+        self.after(0, lambda: self.on_batch_done(message))
+
+    def on_batch_done(self, message: str):
+        self.batch_label.configure(text=message)
+        self.batch_btn.configure(state="normal")
+        if not self.search_entry.get().strip():
+            self.load_history()
+
+    def consume_stream(self, raw_prompt: str, model: str, use_similar: bool = True) -> Dict:
+        result = {"error": "No response from provider"}
+        pending = []
+        last_flush = time.monotonic()
+
+        def flush():
+            nonlocal last_flush
+            if pending:
+                text = "".join(pending)
+                pending.clear()
+                self.after(0, lambda t=text: self.display_stream_event({"type": "token", "text": t}))
+            last_flush = time.monotonic()
+
+        for event in self.optimizer.optimize_prompt_stream(raw_prompt, model, use_similar=use_similar):
+            if event["type"] == "token":
+                pending.append(event["text"])
+                # Batch tokens so Tk gets a few updates per second, not one per token
+                if time.monotonic() - last_flush >= STREAM_FLUSH_INTERVAL:
+                    flush()
+            elif event["type"] in ("element", "final_prompt"):
+                # Tokens before the event are shown before it
+                flush()
+                self.after(0, lambda e=event: self.display_stream_event(e))
+            elif event["type"] == "result":
+                result = event["result"]
+            elif event["type"] == "error":
+                result = {"error": event["error"]}
+        # The last partial batch
+        flush()
+        return result
+
+    def clear_results(self):
+        self.stream_final_closed = False
+        self.similar_frame.grid_remove()
+        for textbox in self.element_widgets.values():
+            textbox.delete("0.0", "end")
+        self.final_prompt_textbox.delete("0.0", "end")
+
+    def display_stream_event(self, event: Dict):
+        if event["type"] == "token":
+            # Show raw output until the final_prompt field itself has closed
+            if not self.stream_final_closed:
+                self.final_prompt_textbox.insert("end", event["text"])
+                self.final_prompt_textbox.see("end")
+        elif event["type"] == "element":
+            self.set_element_text(event["key"], event["value"])
+        elif event["type"] == "final_prompt":
+            self.stream_final_closed = True
+            self.final_prompt_textbox.delete("0.0", "end")
+            self.final_prompt_textbox.insert("0.0", event["value"])
+
+    def set_element_text(self, key: str, text):
+        # normalize key
+        normalized_key = key.lower()
+        if normalized_key in self.element_widgets:
+            self.element_widgets[normalized_key].delete("0.0", "end")
+            self.element_widgets[normalized_key].insert("0.0", str(text))
+
     def display_results(self, result: Dict, raw_prompt: str):
         self.optimize_btn.configure(state="normal", text="Optimize Prompt")
         
@@ -213,74 +699,63 @@ class App(ctk.CTk):
 
         # Fill elements
         for key, text in elements.items():
-            # normalize key
-            normalized_key = key.lower()
-            if normalized_key in self.element_widgets:
-                self.element_widgets[normalized_key].delete("0.0", "end")
-                self.element_widgets[normalized_key].insert("0.0", str(text))
+            self.set_element_text(key, text)
         
         # Fill final prompt
         self.final_prompt_textbox.delete("0.0", "end")
         self.final_prompt_textbox.insert("0.0", final)
 
-        # Save to DB
+        similar = result.get("similar")
+        if similar:
+            # Already in history; offer a fresh run instead of saving a copy
+            self.similar_label.configure(
+                text=f"Reused from a similar prompt ({similar['score']:.0%} match, {similar['timestamp'][:16].replace('T', ' ')})"
+            )
+            self.similar_frame.grid()
+            return
+        if result.get("cached"):
+            # The original run is already in history
+            return
+
+        # Save to DB on the background writer so the UI never waits for the disk
+        self.db.enqueue_session(
+            raw_prompt, elements, final, metrics=result.get("metrics"), resources=result.get("resources"),
+            callback=lambda summary: self.on_writer_saved(summary)
+        )
+
+    def on_writer_saved(self, summary: Dict[str, Any]):
+        # Runs on the database writer thread
+        self.similarity.invalidate()
+        self.after(0, lambda: self.on_session_saved(summary))
+
+    def on_session_saved(self, summary: Dict[str, Any]):
+        # While searching, the list shows search results rather than recent sessions
+        if not self.search_entry.get().strip():
+            self.history_frame.prepend(summary)
+
+    def load_models(self):
+        # Fetch models on the background loop
+        backend, kwargs = self.get_provider_config()
+        conn_value = self.pass_entry.get().strip()
+        self.async_runner.submit(self.fetch_models(backend, kwargs, conn_value))
+
+    async def fetch_models(self, backend: str, kwargs: Dict[str, Any], conn_value: str):
+        # For Llama.cpp, the first instantiation is heavy (loads model), so it runs in a worker thread.
         try:
-            self.db.add_session(raw_prompt, elements, final)
-            self.load_history() # Refresh history
+            await asyncio.to_thread(self.configure_provider, backend, kwargs)
         except Exception as e:
-            print(f"DB Error: {e}")
+            print(f"Provider Load Error: {e}")
+            return
 
-    def load_models(self):
-        # Fetch models in background
-        def fetch():
-            # Ensure provider is configured correctly before fetching
-            backend_name = self.backend_menu.get()
-            conn_value = self.pass_entry.get().strip()
-            
-            # Map display name to internal key
-            backend_map = {
-                "LLM Studio": "openai", 
-                "Ollama": "ollama",
-                "Llama.cpp": "llamacpp",
-                "Anthropic": "anthropic",
-                "Google Gemini": "gemini",
-                "Groq": "groq"
-            }
-            backend = backend_map.get(backend_name, "openai")
-
-            kwargs = {}
-            if backend == "openai":
-                kwargs["base_url"] = conn_value
-            elif backend == "ollama":
-                kwargs["host"] = conn_value
-            elif backend == "llamacpp":
-                kwargs["model_path"] = conn_value
-                kwargs["n_gpu_layers"] = 0 # Just for check
+        # Only fetch if we have a connection value (API key or URL)
+        if conn_value:
+            models = await self.optimizer.aget_available_models()
+            if models:
+                self.after(0, lambda: self.model_option_menu.configure(values=models))
+                self.after(0, lambda: self.model_option_menu.set(models[0]))
             else:
-                kwargs["api_key"] = conn_value
-            
-            # For Llama.cpp, instantiation is heavy (loads model). 
-            # We skip reloading if it's just a fetch/check unless the user optimizes.
-            # But get_available_models needs the instance.
-            # Llama.cpp loading might freeze UI if not careful, but this is already in a thread.
-            try:
-                self.optimizer.set_provider(backend, **kwargs)
-            except Exception as e:
-                print(f"Provider Load Error: {e}")
-                return
-
-
-            # Only fetch if we have a connection value (API key or URL)
-            if conn_value:
-                models = self.optimizer.get_available_models()
-                if models:
-                    self.after(0, lambda: self.model_option_menu.configure(values=models))
-                    self.after(0, lambda: self.model_option_menu.set(models[0]))
-                else:
-                    self.after(0, lambda: self.model_option_menu.set("No models found"))
-        
-        threading.Thread(target=fetch).start()
-    
+                self.after(0, lambda: self.model_option_menu.set("No models found"))
+
     def change_backend(self, choice):
         # Update URL/Key fields based on choice
         self.pass_entry.delete(0, "end")
@@ -288,12 +763,12 @@ class App(ctk.CTk):
         if choice == "LLM Studio":
             self.conn_label.configure(text="Backend URL:")
             self.pass_entry.configure(show="")
-            self.pass_entry.insert(0, "http://localhost:1234/v1")
+            self.pass_entry.insert(0, DEFAULT_CONNECTION["openai"])
             
         elif choice == "Ollama":
             self.conn_label.configure(text="Backend Host:")
             self.pass_entry.configure(show="")
-            self.pass_entry.insert(0, "http://localhost:11434")
+            self.pass_entry.insert(0, DEFAULT_CONNECTION["ollama"])
 
         elif choice == "Llama.cpp":
             self.conn_label.configure(text="Model Path:")
@@ -307,12 +782,7 @@ class App(ctk.CTk):
             self.pass_entry.configure(show="*")
             
             # Try load from keychain
-            backend_map = {
-                "Anthropic": "anthropic",
-                "Google Gemini": "gemini",
-                "Groq": "groq"
-            }
-            key = f"{backend_map.get(choice)}_api_key"
+            key = f"{BACKEND_MAP.get(choice)}_api_key"
             saved_key = CredentialManager.get_credential(key)
             if saved_key:
                 self.pass_entry.insert(0, saved_key)
@@ -320,36 +790,39 @@ class App(ctk.CTk):
         self.load_models()
 
     def update_hardware_stats(self):
-        stats = HardwareMonitor.get_system_stats()
-        self.cpu_label.configure(text=f"CPU: {stats['cpu_percent']}%")
-        
-        if stats['gpu_found']:
-             # Use first GPU for display
-             gpu = stats['gpus'][0]
-             self.gpu_label.configure(text=f"GPU: {gpu['load']}")
-        else:
-             self.gpu_label.configure(text="GPU: N/A")
+        # Memory reads only: sampling happens on the sampler thread
+        stats = self.hardware.latest()
+        if stats is not None:
+            cpu_spark = self.hardware.sparkline("cpu", HARDWARE_SPARK_WIDTH)
+            self.cpu_label.configure(text=f"CPU: {stats['cpu']:.0f}% {cpu_spark}")
+
+            if stats['gpus']:
+                 # Use first GPU for display
+                 gpu_spark = self.hardware.sparkline("gpu_load", HARDWARE_SPARK_WIDTH)
+                 self.gpu_label.configure(text=f"GPU: {stats['gpu_load']:.0f}% {gpu_spark}")
+            else:
+                 self.gpu_label.configure(text="GPU: N/A")
 
-        # Schedule next update (2 seconds)
-        self.after(2000, self.update_hardware_stats)
+        self.after(HARDWARE_INTERVAL_MS, self.update_hardware_stats)
 
     def load_history(self):
-        # Clear existing
-        for widget in self.history_frame.winfo_children():
-            widget.destroy()
-
-        sessions = self.db.get_history()
-        for s in sessions:
-            btn = ctk.CTkButton(
-                self.history_frame, 
-                text=f"{s.timestamp.strftime('%H:%M')} - {s.raw_prompt[:20]}...", 
-                command=lambda sid=s.id: self.load_session(sid),
-                fg_color="transparent", 
-                border_width=1,
-                anchor="w",
-                text_color=("gray10", "gray90")
-            )
-            btn.pack(fill="x", pady=2)
+        self.history_frame.reload()
+
+    def on_search_changed(self, event=None):
+        # Debounced so typing doesn't run a query per keystroke
+        if self.search_after_id is not None:
+            self.after_cancel(self.search_after_id)
+        self.search_after_id = self.after(SEARCH_DEBOUNCE_MS, self.run_search)
+
+    def run_search(self):
+        self.search_after_id = None
+        text = self.search_entry.get().strip()
+        if not text:
+            self.history_frame.reload(self.db.get_history_page)
+            return
+        self.history_frame.reload(
+            lambda limit, before: self.db.search_sessions(text, limit, offset=len(self.history_frame.rows))
+        )
 
     def load_session(self, session_id):
         session = self.db.get_session(session_id)
@@ -359,7 +832,7 @@ class App(ctk.CTk):
         self.raw_prompt_textbox.delete("0.0", "end")
         self.raw_prompt_textbox.insert("0.0", session.raw_prompt)
         
-        elements = session.to_dict()["structured_elements"]
+        elements = session.structured_elements
         for key, text in elements.items():
              normalized_key = key.lower()
              if normalized_key in self.element_widgets:
@@ -373,6 +846,12 @@ class App(ctk.CTk):
         pyperclip.copy(text)
 
     def on_closing(self):
+        self.hardware.stop()
+        # Providers close their async clients on the shared loop, so it is stopped last
+        self.optimizer.registry.close_all()
+        self.async_runner.stop()
+        self.optimizer.cache.close()
+        self.similarity.close()
         self.db.close()
         self.destroy()
 
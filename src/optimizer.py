@@ -1,104 +1,752 @@
+import asyncio
 import json
-import re
-from typing import Dict, Any, Optional
+import time
+from typing import Callable, Dict, Any, Iterator, List, Optional, Tuple
 
-from src.backends.factory import ProviderFactory
 from src.backends.provider_interface import LLMProvider
+from src.backends.registry import ProviderRegistry, default_registry
+from src.cache import ResponseCache
+from src.chunking import insert_data, split_text
+from src.scheduler import DEFAULT_COMPLETION_TOKENS, INTERACTIVE, RequestScheduler, Ticket, TokenBudgetError, count_tokens
+from src.similarity import FALLBACK_PERSONA, SimilarityIndex
+from src.templates import (CHUNK_MAP_TEMPLATE, CHUNK_REDUCE_TEMPLATE, OPTIMIZE_TEMPLATE, PromptTemplate,
+                           TemplateRegistry, default_templates)
+from src.utils.async_runner import shared_runner
+from src.utils.hardware_monitor import ResourceProfiler
+from src.utils.metrics import CallTimer, extract_usage
+from src.utils.stream_parser import StreamingJSONParser
+
+# Keys of the "elements" object the meta-prompt asks the model to fill
+ELEMENT_KEYS = [
+    "persona", "context", "instruction", "constraints", "format",
+    "exemplars", "tone", "delimiters", "data", "technique"
+]
+
+# Smallest chunk worth a map call; a context leaving less room is too small to chunk into
+MIN_CHUNK_TOKENS = 256
+
+# Accepts raw control characters (e.g. newlines) inside strings, which models often emit
+_LENIENT_DECODER = json.JSONDecoder(strict=False)
 
 class PromptOptimizer:
-    def __init__(self, provider_type: str = "openai", **kwargs):
-        self.provider: LLMProvider = ProviderFactory.create_provider(provider_type, **kwargs)
-        self.system_prompt = """
-You are an expert prompt engineer and optimization engine. Your task is to analyze the user's raw prompt and rewrite it into a highly effective, structured prompt using best practices (CRISPE, Chain-of-Thought).
-
-You MUST return the output in strict JSON format.
-
-Example Output Structure:
-{
-    "elements": {
-        "persona": "...",
-        "context": "...",
-        "instruction": "...",
-        "constraints": "...",
-        "format": "...",
-        "exemplars": "...",
-        "tone": "...",
-        "delimiters": "...",
-        "data": "...",
-        "technique": "..."
-    },
-    "final_prompt": "..."
-}
-
-Do not include any text before or after the JSON.
-"""
+    def __init__(self, provider_type: str = "openai", registry: Optional[ProviderRegistry] = None,
+                 lazy: bool = False, **kwargs):
+        # Providers are reused across set_provider calls while their config is unchanged
+        self.registry = registry or default_registry
+        self.provider_type = provider_type
+        # With lazy set, the provider (and its SDK) is only loaded when first used
+        self._provider: Optional[LLMProvider] = None
+        self._provider_kwargs = kwargs
+        if not lazy:
+            self._provider = self.registry.get(provider_type, **kwargs)
+        # Optional response cache; set to a ResponseCache to skip repeat LLM calls
+        self.cache: Optional[ResponseCache] = None
+        # Optional index of past sessions; near-duplicate prompts get the stored result
+        self.similarity: Optional[SimilarityIndex] = None
+        # When set, each call's CPU, memory and GPU usage is attached as "resources"
+        # (meant for local backends; the figures cover this whole process)
+        self.profile_resources = False
+        # Optional scheduler shared with other optimizers: queues requests by priority
+        # and keeps each provider within its token and concurrency budgets
+        self.scheduler: Optional[RequestScheduler] = None
+        # Context window to fit requests into when the provider doesn't report one
+        # (llama.cpp does); longer raw prompts are optimized in chunks
+        self.max_prompt_tokens: Optional[int] = None
+        # Versioned meta-prompt (see src.templates); its id is recorded with each session
+        self.template: PromptTemplate = OPTIMIZE_TEMPLATE
+
+    @property
+    def system_prompt(self) -> str:
+        return self.template.system_prompt
+
+    def set_template(self, name: str, version: Optional[int] = None, registry: Optional[TemplateRegistry] = None):
+        """
+        Switches to another meta-prompt template (the latest version unless given).
+        """
+        self.template = (registry or default_templates).get(name, version)
+
+    @property
+    def provider(self) -> LLMProvider:
+        if self._provider is None or getattr(self._provider, "closed", False):
+            # Also after the registry evicted and closed the one held here
+            self._provider = self.registry.get(self.provider_type, **self._provider_kwargs)
+        return self._provider
+
+    @provider.setter
+    def provider(self, provider: LLMProvider):
+        self._provider = provider
 
     def set_provider(self, provider_type: str, **kwargs):
-        self.provider = ProviderFactory.create_provider(provider_type, **kwargs)
+        self._provider = self.registry.get(provider_type, **kwargs)
+        self.provider_type = provider_type
+        self._provider_kwargs = kwargs
 
-    def optimize_prompt(self, raw_prompt: str, model: str) -> Dict[str, Any]:
+    def optimize_prompt(self, raw_prompt: str, model: str, use_cache: bool = True, use_similar: bool = True,
+                        priority: int = INTERACTIVE, **gen_kwargs) -> Dict[str, Any]:
         """
         Sends the raw prompt to the LLM via the active provider and returns the parsed JSON response.
+        Extra keyword arguments (temperature, max_tokens, ...) are passed to the provider.
+        With a similarity index set, a near-duplicate of a past prompt returns that
+        session's result instead, marked with a "similar" entry; pass
+        use_similar=False to optimize anyway.
+        With a scheduler set, the call first waits its turn among requests of the
+        same `priority` (INTERACTIVE or BATCH from src.scheduler).
         """
+        user_prompt = self._build_user_prompt(raw_prompt)
+        cache_key = self._cache_key(user_prompt, model, gen_kwargs) if use_cache else None
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        similar = self._similar_get(raw_prompt, use_similar)
+        if similar is not None:
+            return similar
+
+        try:
+            if self._needs_chunking(self.provider, user_prompt, gen_kwargs):
+                return shared_runner().run(self.aoptimize_prompt_chunked(
+                    raw_prompt, model, use_cache=use_cache, priority=priority, **gen_kwargs
+                ))
+            ticket = self._schedule(self.provider_type, self.provider, user_prompt, gen_kwargs, priority)
+        except Exception as e:
+            return {"error": f"Optimization Error: {str(e)}"}
+        # Started first so its setup (the first GPU probe) isn't counted as latency
+        profiler = self._start_profiler()
+        timer = CallTimer(self.provider_type, model, self.template.id)
+        output = None
         try:
             result = self.provider.generate(
                 system_prompt=self.system_prompt,
-                user_prompt=f"Optimize this prompt:\n\n{raw_prompt}",
-                model=model
+                user_prompt=user_prompt,
+                model=model,
+                **gen_kwargs
             )
-            content = result["content"]
-            parsed = self._parse_json_response(content)
-            # Ensure "final_prompt" exists even if parsing falls back
-            if "final_prompt" not in parsed:
-                parsed["final_prompt"] = content
-            return parsed
+            output = self._finish(result["content"], cache_key)
+            output["metrics"] = timer.finish(result.get("raw"))
 
+        except Exception as e:
+            output = {"error": f"Optimization Error: {str(e)}", "metrics": timer.finish()}
+        finally:
+            self._unschedule(ticket, output)
+            if output is None and profiler is not None:
+                # Interrupted: nothing to report, but sampling must stop
+                profiler.stop()
+        self._attach_resources(output, profiler)
+        return output
+
+    async def aoptimize_prompt(self, raw_prompt: str, model: str, use_cache: bool = True, use_similar: bool = True,
+                               priority: int = INTERACTIVE, **gen_kwargs) -> Dict[str, Any]:
+        """
+        Async variant of optimize_prompt, driven by the provider's agenerate.
+        """
+        user_prompt = self._build_user_prompt(raw_prompt)
+        cache_key = self._cache_key(user_prompt, model, gen_kwargs) if use_cache else None
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        if use_similar and self.similarity is not None:
+            # The lookup touches the database, keep it off the event loop
+            similar = await asyncio.to_thread(self._similar_get, raw_prompt, use_similar)
+            if similar is not None:
+                return similar
+
+        try:
+            if self._needs_chunking(self.provider, user_prompt, gen_kwargs):
+                return await self.aoptimize_prompt_chunked(raw_prompt, model, use_cache=use_cache,
+                                                           priority=priority, **gen_kwargs)
+            ticket = await self._aschedule(self.provider_type, self.provider, user_prompt, gen_kwargs, priority)
         except Exception as e:
             return {"error": f"Optimization Error: {str(e)}"}
+        # Started first so its setup (the first GPU probe) isn't counted as latency;
+        # starting and stopping read process counters, so both run off the event loop
+        profiler = await asyncio.to_thread(self._start_profiler) if self.profile_resources else None
+        timer = CallTimer(self.provider_type, model, self.template.id)
+        output = None
+        try:
+            result = await self.provider.agenerate(
+                system_prompt=self.system_prompt,
+                user_prompt=user_prompt,
+                model=model,
+                **gen_kwargs
+            )
+            output = self._finish(result["content"], cache_key)
+            output["metrics"] = timer.finish(result.get("raw"))
+
+        except Exception as e:
+            output = {"error": f"Optimization Error: {str(e)}", "metrics": timer.finish()}
+        finally:
+            # Also on cancellation, so an abandoned request doesn't keep its slot
+            self._unschedule(ticket, output)
+            if output is None and profiler is not None:
+                # Cancelled: stop sampling off the loop, without waiting for the report
+                asyncio.get_running_loop().run_in_executor(None, profiler.stop)
+        if profiler is not None:
+            await asyncio.to_thread(self._attach_resources, output, profiler)
+        return output
+
+    def optimize_prompt_stream(self, raw_prompt: str, model: str, use_cache: bool = True, use_similar: bool = True,
+                               priority: int = INTERACTIVE, **gen_kwargs) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of optimize_prompt. Yields events as the response is generated:
+            {"type": "token", "text": str}                  - every chunk of raw output
+            {"type": "element", "key": str, "value": str}   - an elements.* field has closed
+            {"type": "final_prompt", "value": str}          - final_prompt has closed
+            {"type": "result", "result": dict}              - parsed response, same as optimize_prompt
+            {"type": "error", "error": str}
+        A cache or near-duplicate hit, and a raw prompt too long for the model's
+        context (optimized in chunks), yield the element/final_prompt/result
+        events once the result is known, without tokens.
+        """
+        user_prompt = self._build_user_prompt(raw_prompt)
+        cache_key = self._cache_key(user_prompt, model, gen_kwargs) if use_cache else None
+        cached = self._cache_get(cache_key)
+        if cached is None:
+            cached = self._similar_get(raw_prompt, use_similar)
+        if cached is not None:
+            yield from self._result_events(cached)
+            return
+
+        try:
+            if self._needs_chunking(self.provider, user_prompt, gen_kwargs):
+                yield from self._result_events(shared_runner().run(self.aoptimize_prompt_chunked(
+                    raw_prompt, model, use_cache=use_cache, priority=priority, **gen_kwargs
+                )))
+                return
+            ticket = self._schedule(self.provider_type, self.provider, user_prompt, gen_kwargs, priority)
+        except Exception as e:
+            yield {"type": "error", "error": f"Optimization Error: {str(e)}"}
+            return
+        chunks = []
+        parser = StreamingJSONParser()
+        result = None
+        profiler = self._start_profiler()
+        timer = CallTimer(self.provider_type, model, self.template.id)
+        # Filled by providers that report token counts for streams
+        usage: Dict[str, Any] = {}
+        try:
+            for chunk in self.provider.stream_generate(
+                system_prompt=self.system_prompt,
+                user_prompt=user_prompt,
+                model=model,
+                usage=usage,
+                **gen_kwargs
+            ):
+                timer.first_token()
+                chunks.append(chunk)
+                yield {"type": "token", "text": chunk}
+
+                # Emit fields that have completed within this chunk
+                for path, value in parser.feed(chunk):
+                    if path == ("final_prompt",):
+                        yield {"type": "final_prompt", "value": value}
+                    elif len(path) == 2 and path[0] == "elements" and str(path[1]).lower() in ELEMENT_KEYS:
+                        yield {"type": "element", "key": str(path[1]).lower(), "value": value}
+
+            result = self._finish("".join(chunks), cache_key, parser.close())
+            result["metrics"] = timer.finish(usage)
+            self._unschedule(ticket, result)
+            self._attach_resources(result, profiler)
+            yield {"type": "result", "result": result}
+
+        except Exception as e:
+            yield {"type": "error", "error": f"Optimization Error: {str(e)}"}
+        finally:
+            # Also stops sampling and frees the slot when the consumer abandons the stream
+            self._unschedule(ticket, result)
+            if profiler is not None:
+                profiler.stop()
+
+    def optimize_prompt_hedged(self, raw_prompt: str, model: str,
+                               backups: List[Tuple[str, str, Dict[str, Any]]],
+                               hedge_delay: float = 2.0, priority: int = INTERACTIVE, **gen_kwargs) -> Dict[str, Any]:
+        """
+        Blocking wrapper around aoptimize_prompt_hedged, run on the shared event loop.
+        """
+        return shared_runner().run(
+            self.aoptimize_prompt_hedged(raw_prompt, model, backups, hedge_delay, priority=priority, **gen_kwargs)
+        )
+
+    async def aoptimize_prompt_hedged(self, raw_prompt: str, model: str,
+                                      backups: List[Tuple[str, str, Dict[str, Any]]],
+                                      hedge_delay: float = 2.0, priority: int = INTERACTIVE,
+                                      **gen_kwargs) -> Dict[str, Any]:
+        """
+        Hedged optimization: sends the request to the active provider and, if no valid
+        answer arrived within `hedge_delay` seconds (or an attempt failed), also to the
+        next backup. `backups` is a list of (provider_type, model, provider_kwargs).
+        The first response that parses as JSON wins and the other attempts are cancelled.
+        """
+        user_prompt = self._build_user_prompt(raw_prompt)
+        cached = self._cache_get(self._cache_key(user_prompt, model, gen_kwargs))
+        if cached is not None:
+            return cached
+        if self.similarity is not None:
+            similar = await asyncio.to_thread(self._similar_get, raw_prompt)
+            if similar is not None:
+                return similar
+
+        # Backups are only built when launched, so unused ones cost nothing
+        targets = [(self.provider_type, model, self._provider_kwargs)]
+        targets.extend(backups)
+
+        async def attempt(provider_type: str, target_model: str, provider_kwargs: Dict[str, Any],
+                          provider: Optional[LLMProvider]) -> Dict[str, Any]:
+            if provider is None:
+                # Construction may load a local model from disk
+                provider = await asyncio.to_thread(self.registry.get, provider_type, **provider_kwargs)
+            ticket = await self._aschedule(provider_type, provider, user_prompt, gen_kwargs, priority)
+            output = None
+            try:
+                timer = CallTimer(provider_type, target_model, self.template.id)
+                result = await provider.agenerate(
+                    system_prompt=self.system_prompt,
+                    user_prompt=user_prompt,
+                    model=target_model,
+                    **gen_kwargs
+                )
+                parsed = self._try_parse_json(result["content"])
+                if parsed is None:
+                    raise ValueError("Response was not valid JSON")
+                cache_key = self._cache_key_for(provider_type, provider_kwargs, user_prompt, target_model, gen_kwargs)
+                output = self._finish(result["content"], cache_key, parsed)
+                output["metrics"] = timer.finish(result.get("raw"))
+                return output
+            finally:
+                # Losing attempts are cancelled; their slots go back right away
+                self._unschedule(ticket, output)
+
+        pending = {}
+        errors = []
+        launched = 0
+
+        def launch():
+            nonlocal launched
+            provider_type, target_model, provider_kwargs = targets[launched]
+            provider = self.provider if launched == 0 else None
+            task = asyncio.ensure_future(attempt(provider_type, target_model, provider_kwargs, provider))
+            pending[task] = f"{provider_type}/{target_model}"
+            launched += 1
+
+        try:
+            launch()
+            while pending:
+                timeout = hedge_delay if launched < len(targets) else None
+                done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Nothing back within the delay: hedge with the next backend
+                    launch()
+                    continue
+
+                for task in done:
+                    label = pending.pop(task)
+                    if task.exception() is None:
+                        result = task.result()
+                        result["hedge"] = {"winner": label, "attempts": launched}
+                        return result
+                    errors.append(f"{label}: {task.exception()}")
+
+                # A failed attempt is replaced right away rather than after the delay
+                if launched < len(targets):
+                    launch()
+
+            return {"error": "Optimization Error: all hedged attempts failed (" + "; ".join(errors) + ")"}
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def optimize_prompt_fanout(self, raw_prompt: str, targets: List[Tuple[str, str, Dict[str, Any]]],
+                               on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+                               **gen_kwargs) -> Dict[str, Any]:
+        """
+        Blocking wrapper around aoptimize_prompt_fanout, run on the shared event loop.
+        """
+        return shared_runner().run(self.aoptimize_prompt_fanout(raw_prompt, targets, on_result, **gen_kwargs))
+
+    async def aoptimize_prompt_fanout(self, raw_prompt: str, targets: List[Tuple[str, str, Dict[str, Any]]],
+                                      on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+                                      use_cache: bool = True, priority: int = INTERACTIVE,
+                                      **gen_kwargs) -> Dict[str, Any]:
+        """
+        Comparison mode: optimizes one raw prompt with every target concurrently, so
+        the wall time is that of the slowest target rather than the sum. `targets`
+        is a list of (provider_type, model, provider_kwargs), as for hedging.
+
+        Returns {"results": [...], "elapsed_ms": float} with one result per target,
+        in order, shaped like optimize_prompt results plus a "target" entry
+        ({"provider", "model"}). A failing target only fails its own result.
+        on_result(index, result) is called on the event loop as each one completes.
+        """
+        user_prompt = self._build_user_prompt(raw_prompt)
+        start = time.perf_counter()
+
+        async def run(index: int, provider_type: str, target_model: str, provider_kwargs: Dict[str, Any]):
+            cache_key = (self._cache_key_for(provider_type, provider_kwargs, user_prompt, target_model, gen_kwargs)
+                         if use_cache else None)
+            output = self._cache_get(cache_key)
+            timer = ticket = None
+            if output is None:
+                try:
+                    # Construction may load a local model from disk
+                    provider = await asyncio.to_thread(self.registry.get, provider_type, **provider_kwargs)
+                    ticket = await self._aschedule(provider_type, provider, user_prompt, gen_kwargs, priority)
+                    timer = CallTimer(provider_type, target_model, self.template.id)
+                    result = await provider.agenerate(
+                        system_prompt=self.system_prompt,
+                        user_prompt=user_prompt,
+                        model=target_model,
+                        **gen_kwargs
+                    )
+                    output = self._finish(result["content"], cache_key)
+                    output["metrics"] = timer.finish(result.get("raw"))
+                except Exception as e:
+                    output = {"error": f"Optimization Error: {str(e)}",
+                              "metrics": timer.finish() if timer is not None else None}
+                finally:
+                    self._unschedule(ticket, output)
+            output["target"] = {"provider": provider_type, "model": target_model}
+            if on_result is not None:
+                on_result(index, output)
+            return output
+
+        results = await asyncio.gather(*(run(i, *target) for i, target in enumerate(targets)))
+        return {"results": list(results), "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+    def optimize_prompt_chunked(self, raw_prompt: str, model: str, **kwargs) -> Dict[str, Any]:
+        """
+        Blocking wrapper around aoptimize_prompt_chunked, run on the shared event loop.
+        """
+        return shared_runner().run(self.aoptimize_prompt_chunked(raw_prompt, model, **kwargs))
+
+    async def aoptimize_prompt_chunked(self, raw_prompt: str, model: str, use_cache: bool = True,
+                                       priority: int = INTERACTIVE, chunk_tokens: Optional[int] = None,
+                                       **gen_kwargs) -> Dict[str, Any]:
+        """
+        Map-reduce optimization for raw prompts longer than the model's context
+        (optimize_prompt and its variants switch to it on their own).
+
+        Map: the raw prompt is split into chunks of at most `chunk_tokens` tokens
+        (default: what the context leaves room for) at paragraph, line or sentence
+        boundaries, and every chunk is analyzed concurrently into structured
+        elements. Chunks that are mostly data are only described, not copied.
+        Reduce: the per-chunk elements are merged (in rounds if they don't fit
+        one request) into one set of elements and a final prompt. The original
+        data is then inserted where the final prompt references it.
+
+        The result has the shape of optimize_prompt's, plus "chunked":
+        {"chunks", "data_chunks", "unparsed_chunks", "reduce_calls"}.
+        """
+        user_prompt = self._build_user_prompt(raw_prompt)
+        cache_key = self._cache_key(user_prompt, model, gen_kwargs) if use_cache else None
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": None, "reported": False}
+        stats = {"chunks": 0, "data_chunks": 0, "unparsed_chunks": 0, "reduce_calls": 0}
+        try:
+            provider = self.provider
+            budget = chunk_tokens or self._chunk_budget(provider, gen_kwargs)
+            chunks = split_text(raw_prompt, budget, lambda text: count_tokens(text, provider))
+            stats["chunks"] = len(chunks)
+            # Each call also passes through the scheduler when one is set
+            limit = asyncio.Semaphore(getattr(provider, "max_concurrency", None) or 4)
+
+            async def analyze(index: int, chunk: str) -> Dict[str, Any]:
+                async with limit:
+                    parsed = await self._chunk_call(provider, CHUNK_MAP_TEMPLATE,
+                                                    f"Part {index + 1} of {len(chunks)}:\n\n{chunk}",
+                                                    model, gen_kwargs, priority, usage)
+                if parsed is None:
+                    # Keep the text rather than lose it: it goes into the prompt verbatim
+                    stats["unparsed_chunks"] += 1
+                    return {"elements": {}, "is_data": True}
+                return parsed
+
+            analyses = await asyncio.gather(*(analyze(i, chunk) for i, chunk in enumerate(chunks)))
+            data_chunks = [chunk for chunk, analysis in zip(chunks, analyses) if analysis.get("is_data") is True]
+            stats["data_chunks"] = len(data_chunks)
+            reduced = await self._reduce_elements(provider, [a.get("elements") or {} for a in analyses], budget,
+                                                  model, gen_kwargs, priority, usage, stats)
+        except Exception as e:
+            return {"error": f"Optimization Error: {str(e)}"}
+
+        parsed = {
+            "elements": reduced.get("elements") or {},
+            "final_prompt": insert_data(str(reduced.get("final_prompt") or ""), "".join(data_chunks))
+        }
+        output = self._finish(json.dumps(parsed, ensure_ascii=False), cache_key, parsed)
+        output["metrics"] = {
+            "provider": self.provider_type,
+            "model": model,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            "ttft_ms": None,
+            "prompt_tokens": usage["prompt_tokens"] if usage["reported"] else None,
+            "completion_tokens": usage["completion_tokens"] if usage["reported"] else None,
+            "cached_tokens": usage["cached_tokens"],
+            # The template that wrote the final prompt
+            "template_version": CHUNK_REDUCE_TEMPLATE.id
+        }
+        output["chunked"] = stats
+        return output
+
+    def _context_limit(self, provider: LLMProvider) -> Optional[int]:
+        return self.max_prompt_tokens or getattr(provider, "context_tokens", None)
+
+    def _needs_chunking(self, provider: LLMProvider, user_prompt: str, gen_kwargs: Dict[str, Any]) -> bool:
+        context = self._context_limit(provider)
+        if not context:
+            return False
+        needed = (self.template.prefix_tokens(provider) + count_tokens(user_prompt, provider)
+                  + (gen_kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS))
+        return needed > context
+
+    def _chunk_budget(self, provider: LLMProvider, gen_kwargs: Dict[str, Any]) -> int:
+        """
+        Tokens of raw prompt one map or reduce request has room for.
+        """
+        context = self._context_limit(provider)
+        if not context:
+            raise ValueError("The model's context size is unknown; set max_prompt_tokens or pass chunk_tokens")
+        # The "Part i of n" header is covered by the margin
+        overhead = max(CHUNK_MAP_TEMPLATE.prefix_tokens(provider), CHUNK_REDUCE_TEMPLATE.prefix_tokens(provider)) + 32
+        budget = context - overhead - (gen_kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+        if budget < MIN_CHUNK_TOKENS:
+            raise TokenBudgetError(f"The {context}-token context leaves too little room to optimize in chunks")
+        return budget
+
+    async def _chunk_call(self, provider: LLMProvider, template: PromptTemplate, text: str, model: str,
+                          gen_kwargs: Dict[str, Any], priority: int,
+                          usage: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        One map or reduce request; returns its JSON object, or None if it had none.
+        """
+        user_prompt = template.render(text)
+        ticket = await self._aschedule(self.provider_type, provider, user_prompt, gen_kwargs, priority, template)
+        output = None
+        try:
+            result = await provider.agenerate(
+                system_prompt=template.system_prompt,
+                user_prompt=user_prompt,
+                model=model,
+                **gen_kwargs
+            )
+            output = {"metrics": extract_usage(result.get("raw"))}
+        finally:
+            self._unschedule(ticket, output)
+        for key in ("prompt_tokens", "completion_tokens"):
+            if output["metrics"][key] is not None:
+                usage[key] += output["metrics"][key]
+                usage["reported"] = True
+        if output["metrics"]["cached_tokens"] is not None:
+            usage["cached_tokens"] = (usage["cached_tokens"] or 0) + output["metrics"]["cached_tokens"]
+        return self._try_parse_json(result["content"])
+
+    async def _reduce_elements(self, provider: LLMProvider, element_sets: List[Dict[str, Any]], budget: int,
+                               model: str, gen_kwargs: Dict[str, Any], priority: int,
+                               usage: Dict[str, Any], stats: Dict[str, int]) -> Dict[str, Any]:
+        """
+        Merges per-chunk elements into one result with a final prompt. Sets that
+        don't fit one request are merged in groups first, round by round.
+        """
+        while True:
+            parts = [json.dumps(elements, ensure_ascii=False) for elements in element_sets]
+            groups: List[List[str]] = [[]]
+            group_tokens = 0
+            for part in parts:
+                tokens = count_tokens(part, provider)
+                if groups[-1] and group_tokens + tokens > budget:
+                    groups.append([])
+                    group_tokens = 0
+                groups[-1].append(part)
+                group_tokens += tokens
+            if 1 < len(groups) == len(parts):
+                # Every set fills a request on its own; merging pairs still shrinks the list
+                groups = [parts[i:i + 2] for i in range(0, len(parts), 2)]
+
+            requests = [
+                "\n\n".join(f"Part {i + 1}: {part}" for i, part in enumerate(group))
+                for group in groups
+            ]
+            stats["reduce_calls"] += len(requests)
+            merged = await asyncio.gather(*(
+                self._chunk_call(provider, CHUNK_REDUCE_TEMPLATE, request, model, gen_kwargs, priority, usage)
+                for request in requests
+            ))
+            if any(result is None for result in merged):
+                raise ValueError("Merging the analyzed chunks failed: the response was not valid JSON")
+            if len(merged) == 1:
+                return merged[0]
+            element_sets = [result.get("elements") or {} for result in merged]
+
+    def _result_events(self, result: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        # Stream events for a result that is already complete
+        if "error" in result:
+            yield {"type": "error", "error": result["error"]}
+            return
+        for key, value in result.get("elements", {}).items():
+            yield {"type": "element", "key": key.lower(), "value": value}
+        yield {"type": "final_prompt", "value": result.get("final_prompt", "")}
+        yield {"type": "result", "result": result}
+
+    def _schedule(self, provider_type: str, provider: LLMProvider, user_prompt: str,
+                  gen_kwargs: Dict[str, Any], priority: int) -> Optional[Ticket]:
+        """
+        Waits until the scheduler admits the request (no-op without a scheduler).
+        Raises TokenBudgetError for a prompt that can't fit the model's context.
+        """
+        if self.scheduler is None:
+            return None
+        ticket = self.scheduler.prepare(provider_type, provider, [self.template.prefix_tokens(provider), user_prompt],
+                                        gen_kwargs.get("max_tokens"), priority)
+        return self.scheduler.acquire(ticket)
+
+    async def _aschedule(self, provider_type: str, provider: LLMProvider, user_prompt: str,
+                         gen_kwargs: Dict[str, Any], priority: int,
+                         template: Optional[PromptTemplate] = None) -> Optional[Ticket]:
+        if self.scheduler is None:
+            return None
+        template = template or self.template
+        ticket = self.scheduler.prepare(provider_type, provider, [template.prefix_tokens(provider), user_prompt],
+                                        gen_kwargs.get("max_tokens"), priority)
+        return await self.scheduler.aacquire(ticket)
+
+    def _unschedule(self, ticket: Optional[Ticket], output: Optional[Dict[str, Any]]):
+        # Frees the slot; the reported token usage replaces the estimate
+        if ticket is None:
+            return
+        metrics = (output or {}).get("metrics")
+        self.scheduler.release(ticket, metrics)
+        if metrics is not None:
+            metrics["queue_ms"] = ticket.queue_ms
+
+    def _start_profiler(self) -> Optional[ResourceProfiler]:
+        return ResourceProfiler().start() if self.profile_resources else None
+
+    def _attach_resources(self, output: Dict[str, Any], profiler: Optional[ResourceProfiler]):
+        if profiler is None:
+            return
+        resources = profiler.stop()
+        # Local backend settings, so resource use can be compared across configurations
+        resources["n_ctx"] = self._provider_kwargs.get("n_ctx")
+        resources["n_gpu_layers"] = self._provider_kwargs.get("n_gpu_layers")
+        output["resources"] = resources
+
+    def _build_user_prompt(self, raw_prompt: str) -> str:
+        return self.template.render(raw_prompt)
+
+    def _cache_key(self, user_prompt: str, model: str, gen_kwargs: Dict[str, Any]) -> Optional[str]:
+        return self._cache_key_for(self.provider_type, self._provider_kwargs, user_prompt, model, gen_kwargs)
+
+    def _cache_key_for(self, provider_type: str, provider_kwargs: Dict[str, Any], user_prompt: str, model: str,
+                       gen_kwargs: Dict[str, Any]) -> Optional[str]:
+        if self.cache is None or not self.cache.enabled:
+            return None
+        # The backend's config (base_url, host, model path...) tells apart servers that
+        # use the same model names; the API key doesn't change the answer
+        identity = ProviderRegistry.make_key(
+            provider_type, **{k: v for k, v in provider_kwargs.items() if k != "api_key"}
+        )
+        return ResponseCache.make_key(identity, model, self.system_prompt, user_prompt, gen_kwargs)
+
+    def _cache_get(self, cache_key: Optional[str]) -> Optional[Dict[str, Any]]:
+        if cache_key is None:
+            return None
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            cached["cached"] = True
+        return cached
+
+    def _similar_get(self, raw_prompt: str, use_similar: bool = True) -> Optional[Dict[str, Any]]:
+        if not use_similar or self.similarity is None:
+            return None
+        try:
+            return self.similarity.find_similar(raw_prompt)
+        except Exception as e:
+            # The index is an optimization; never fail a request because of it
+            print(f"Similarity lookup failed: {e}")
+            return None
+
+    def _finish(self, content: str, cache_key: Optional[str], parsed: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if parsed is None:
+            parsed = self._try_parse_json(content)
+        result = self._build_result(content, parsed)
+        # Only successfully parsed responses are worth replaying
+        if cache_key is not None and parsed is not None:
+            self.cache.put(cache_key, result)
+        return result
+
+    def _build_result(self, content: str, parsed: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if parsed is None:
+            parsed = self._parse_json_response(content)
+        # Ensure "final_prompt" exists even if parsing falls back
+        if "final_prompt" not in parsed:
+            parsed["final_prompt"] = content
+        return parsed
 
     def _parse_json_response(self, content: str) -> Dict[str, Any]:
         """
         Robustly parses JSON from the LLM response, handling potential markdown blocks.
         """
+        parsed = self._try_parse_json(content)
+        if parsed is None:
+            return self._fallback_response(content)
+        return parsed
+
+    def _try_parse_json(self, content: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the JSON object found in the response, or None if there isn't a valid one.
+        """
         try:
             # 1. Try direct parsing
-            return json.loads(content)
+            parsed = json.loads(content)
+            if isinstance(parsed, dict):
+                return parsed
         except json.JSONDecodeError:
-            # 2. Try to find JSON block if wrapped in markdown
-            match = re.search(r'```json\s*(\{.*?\})\s*```', content, re.DOTALL)
-            if match:
-                try:
-                    return json.loads(match.group(1))
-                except json.JSONDecodeError:
-                    pass
-            
-            # 3. Try to find the first { and last }
-            match = re.search(r'(\{.*\})', content, re.DOTALL)
-            if match:
-                try:
-                    return json.loads(match.group(1))
-                except json.JSONDecodeError:
-                    pass
-            
-            # 4. Fallback: Return raw content structure
-            return {
-                "elements": {
-                    "persona": "Error parsing JSON",
-                    "context": "The model response could not be parsed as JSON.",
-                    "instruction": "N/A",
-                    "constraints": "N/A",
-                    "format": "N/A",
-                    "exemplars": "N/A",
-                    "tone": "N/A",
-                    "delimiters": "N/A",
-                    "data": "N/A",
-                    "technique": "N/A"
-                },
-                "final_prompt": content  # Return the raw content so the user doesn't lose it
-            }
+            pass
+
+        # 2. Decode the object starting at the first '{', ignoring whatever follows it
+        #    (closing markdown fence, trailing chatter)
+        start = content.find("{")
+        if start < 0:
+            return None
+        try:
+            parsed, _ = _LENIENT_DECODER.raw_decode(content, start)
+            if isinstance(parsed, dict):
+                return parsed
+        except json.JSONDecodeError:
+            pass
+
+        # 3. Single incremental pass that also skips braces in the preamble
+        parser = StreamingJSONParser()
+        parser.feed(content)
+        return parser.close()
+
+    def _fallback_response(self, content: str) -> Dict[str, Any]:
+        # Fallback: Return raw content structure
+        return {
+            "elements": {
+                "persona": FALLBACK_PERSONA,
+                "context": "The model response could not be parsed as JSON.",
+                "instruction": "N/A",
+                "constraints": "N/A",
+                "format": "N/A",
+                "exemplars": "N/A",
+                "tone": "N/A",
+                "delimiters": "N/A",
+                "data": "N/A",
+                "technique": "N/A"
+            },
+            "final_prompt": content  # Return the raw content so the user doesn't lose it
+        }
 
     def get_available_models(self) -> list:
         try:
             return self.provider.list_models()
         except Exception:
             return []
+
+    async def aget_available_models(self) -> list:
+        try:
+            return await self.provider.alist_models()
+        except Exception:
+            return []
@@ -0,0 +1,363 @@
+import asyncio
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Deque, List, Optional, Sequence, Union
+
+# Priority classes; lower values are dispatched first
+INTERACTIVE = 0
+BATCH = 1
+
+# Limits per provider type:
+#   max_concurrency      requests in flight at once
+#   tokens_per_minute    prompt + completion tokens admitted per rolling minute
+#                        (conservative entry-tier limits; local backends have none)
+#   max_inflight_tokens  tokens of all in-flight requests together, for servers
+#                        that split one context between parallel slots
+#   batch_concurrency    optional lower cap for batch requests only
+SCHEDULER_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "openai": {"max_concurrency": 4},
+    "ollama": {"max_concurrency": 2},
+    "llamacpp": {"max_concurrency": 1},
+    "llamacpp_pool": {"max_concurrency": 4},
+    "anthropic": {"max_concurrency": 8, "tokens_per_minute": 40000},
+    "gemini": {"max_concurrency": 8, "tokens_per_minute": 250000},
+    "groq": {"max_concurrency": 8, "tokens_per_minute": 6000},
+}
+
+# Completion tokens reserved for a request without max_tokens; the optimizer's
+# JSON answer (ten elements and the final prompt) rarely needs more
+DEFAULT_COMPLETION_TOKENS = 1024
+
+_WINDOW_SECONDS = 60.0
+
+
+class TokenBudgetError(ValueError):
+    pass
+
+
+def count_tokens(text: str, provider: Any = None) -> int:
+    """
+    Token count of `text`: exact when the provider has a local tokenizer
+    (llama.cpp), otherwise estimated from its character and word counts.
+    """
+    counter = getattr(provider, "count_tokens", None)
+    if counter is not None:
+        try:
+            tokens = counter(text)
+            if tokens is not None:
+                return tokens
+        except Exception:
+            pass
+    # About 4 characters per token in English prose; short words and symbols are denser
+    return max(1, int(max(len(text) / 4, len(text.split()) * 4 / 3)))
+
+
+class Ticket:
+    """
+    One request's claim on a provider: created by RequestScheduler.prepare,
+    granted by acquire/aacquire and handed back with release.
+    """
+
+    def __init__(self, provider_type: str, prompt_tokens: int, completion_tokens: int, priority: int, seq: int):
+        self.provider_type = provider_type
+        self.prompt_tokens = prompt_tokens
+        self.tokens = prompt_tokens + completion_tokens
+        self.priority = priority
+        self.seq = seq
+        self.granted = False
+        self.released = False
+        self.queue_ms: Optional[float] = None
+        # Times a later batch request was dispatched ahead of this one
+        self.skipped = 0
+        self._enqueued = time.monotonic()
+        # [admitted at, tokens, still in window] entry of the lane's minute window
+        self._charge: Optional[List[Any]] = None
+        self._wake = None
+
+
+class _Lane:
+    def __init__(self):
+        self.waiting: List[Ticket] = []
+        self.in_flight = 0
+        self.batch_in_flight = 0
+        self.inflight_tokens = 0
+        self.window: Deque[List[Any]] = deque()
+        self.window_tokens = 0
+        self.last_interactive = float("-inf")
+        # When the oldest charge leaves the minute window, while a ticket waits on it
+        self.retry_at: Optional[float] = None
+        self.stats = {"admitted": 0, "rejected": 0, "queue_ms": {INTERACTIVE: 0.0, BATCH: 0.0},
+                      "requests": {INTERACTIVE: 0, BATCH: 0}}
+
+
+class RequestScheduler:
+    """
+    Admits requests to each provider type in priority order while keeping it
+    under its concurrency, tokens-per-minute and context budgets.
+
+    Requests are costed in tokens (prompt, counted locally, plus the completion
+    they may produce) before they are sent. Interactive requests always go
+    first; batch requests are packed into what is left, so a small prompt may
+    overtake a large one that doesn't fit yet. A batch request overtaken
+    `max_skips` times stops further overtaking until it has run, and a prompt
+    that can never fit the model's context is rejected with TokenBudgetError.
+
+    While interactive requests have been seen on a provider in the last
+    `reserve_seconds`, batch work leaves one slot and (1 - batch_share) of the
+    token budgets free for them, so a click in the GUI doesn't queue behind a
+    whole batch.
+
+        ticket = scheduler.acquire(scheduler.prepare("groq", provider, [system, user], priority=BATCH))
+        try:
+            ...call the provider...
+        finally:
+            scheduler.release(ticket, metrics)
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, Any]]] = None, batch_share: float = 0.8,
+                 max_skips: int = 8, reserve_seconds: float = 120.0,
+                 completion_tokens: int = DEFAULT_COMPLETION_TOKENS):
+        self.limits = {provider_type: dict(values) for provider_type, values in SCHEDULER_DEFAULTS.items()}
+        for provider_type, values in (limits or {}).items():
+            self.limits.setdefault(provider_type, {}).update(values)
+        self.batch_share = batch_share
+        self.max_skips = max_skips
+        self.reserve_seconds = reserve_seconds
+        self.completion_tokens = completion_tokens
+        self._cond = threading.Condition()
+        self._lanes: Dict[str, _Lane] = {}
+        self._seq = itertools.count()
+
+    def configure(self, provider_type: str, **limits):
+        """
+        Changes limits of one provider type (None removes a limit).
+        """
+        with self._cond:
+            self.limits.setdefault(provider_type, {}).update(limits)
+            self._dispatch(provider_type)
+
+    def prepare(self, provider_type: str, provider: Any, texts: Sequence[Union[str, int]],
+                max_tokens: Optional[int] = None, priority: int = INTERACTIVE) -> Ticket:
+        """
+        Costs a request made of `texts` (system and user prompt) for `provider`.
+        Parts already tokenized (a template's system prompt) can be given as token counts.
+        Raises TokenBudgetError if it can't fit the provider's context window.
+        """
+        prompt_tokens = sum(text if isinstance(text, int) else count_tokens(text, provider) for text in texts)
+        completion_tokens = max_tokens or self.completion_tokens
+        context = getattr(provider, "context_tokens", None)
+        if context and prompt_tokens + completion_tokens > context:
+            with self._cond:
+                self._lane(provider_type).stats["rejected"] += 1
+            raise TokenBudgetError(
+                f"Prompt needs about {prompt_tokens} tokens plus {completion_tokens} for the answer, "
+                f"more than the {context}-token context of {provider_type}"
+            )
+        # Providers that know their own parallelism (e.g. a worker pool) take precedence
+        concurrency = getattr(provider, "max_concurrency", None)
+        if concurrency and self.limits.get(provider_type, {}).get("max_concurrency") != concurrency:
+            self.configure(provider_type, max_concurrency=concurrency)
+        return Ticket(provider_type, prompt_tokens, completion_tokens, priority, next(self._seq))
+
+    def acquire(self, ticket: Ticket) -> Ticket:
+        """
+        Blocks until the ticket is admitted.
+        """
+        with self._cond:
+            self._enqueue(ticket)
+            try:
+                while True:
+                    retry = self._dispatch(ticket.provider_type)
+                    if ticket.granted:
+                        return ticket
+                    self._cond.wait(retry)
+            except BaseException:
+                self._abandon(ticket)
+                raise
+
+    async def aacquire(self, ticket: Ticket) -> Ticket:
+        """
+        Async variant of acquire; waiting doesn't block the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        ticket._wake = lambda: loop.call_soon_threadsafe(changed.set)
+        with self._cond:
+            self._enqueue(ticket)
+        try:
+            while True:
+                with self._cond:
+                    retry = self._dispatch(ticket.provider_type)
+                    if ticket.granted:
+                        break
+                    changed.clear()
+                try:
+                    # Woken when admitted or when the wait it should time out on changes
+                    await asyncio.wait_for(changed.wait(), retry)
+                except asyncio.TimeoutError:
+                    # Tokens have left the minute window
+                    pass
+        except BaseException:
+            with self._cond:
+                self._abandon(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: Optional[Ticket], usage: Optional[Dict[str, Any]] = None):
+        """
+        Frees the ticket's capacity. `usage` (a metrics dict with prompt_tokens and
+        completion_tokens) replaces the estimate in the minute window.
+        """
+        if ticket is None:
+            return
+        with self._cond:
+            if ticket.granted and not ticket.released:
+                self._settle(ticket, usage)
+                self._dispatch(ticket.provider_type)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._cond:
+            report = {}
+            for provider_type, lane in self._lanes.items():
+                self._expire(lane, time.monotonic())
+                requests = lane.stats["requests"]
+                report[provider_type] = {
+                    "waiting": len(lane.waiting),
+                    "in_flight": lane.in_flight,
+                    "inflight_tokens": lane.inflight_tokens,
+                    "tokens_last_minute": lane.window_tokens,
+                    "admitted": lane.stats["admitted"],
+                    "rejected": lane.stats["rejected"],
+                    "interactive_queue_ms": round(lane.stats["queue_ms"][INTERACTIVE] / requests[INTERACTIVE], 1)
+                    if requests[INTERACTIVE] else None,
+                    "batch_queue_ms": round(lane.stats["queue_ms"][BATCH] / requests[BATCH], 1)
+                    if requests[BATCH] else None,
+                }
+            return report
+
+    # Everything below runs with the condition's lock held
+
+    def _lane(self, provider_type: str) -> _Lane:
+        lane = self._lanes.get(provider_type)
+        if lane is None:
+            lane = self._lanes[provider_type] = _Lane()
+        return lane
+
+    def _enqueue(self, ticket: Ticket):
+        lane = self._lane(ticket.provider_type)
+        if ticket.priority == INTERACTIVE:
+            lane.last_interactive = time.monotonic()
+        lane.waiting.append(ticket)
+        lane.waiting.sort(key=lambda t: (t.priority, t.seq))
+
+    def _expire(self, lane: _Lane, now: float):
+        while lane.window and now - lane.window[0][0] >= _WINDOW_SECONDS:
+            charge = lane.window.popleft()
+            charge[2] = False
+            lane.window_tokens -= charge[1]
+
+    def _blocked_by(self, ticket: Ticket, lane: _Lane, limits: Dict[str, Any], reserve: bool) -> Optional[str]:
+        batch = ticket.priority != INTERACTIVE
+        share = self.batch_share if batch and reserve else 1.0
+        concurrency = limits.get("max_concurrency")
+        if concurrency:
+            # Batch work leaves a slot for interactive requests, unless there is only one
+            cap = concurrency - 1 if batch and reserve and concurrency > 1 else concurrency
+            if lane.in_flight >= cap:
+                return "concurrency"
+        if batch and limits.get("batch_concurrency") and lane.batch_in_flight >= limits["batch_concurrency"]:
+            return "concurrency"
+        # A request larger than a budget still runs, alone
+        inflight_tokens = limits.get("max_inflight_tokens")
+        if inflight_tokens and lane.in_flight and lane.inflight_tokens + ticket.tokens > inflight_tokens * share:
+            return "context"
+        tokens_per_minute = limits.get("tokens_per_minute")
+        if tokens_per_minute and lane.window_tokens and lane.window_tokens + ticket.tokens > tokens_per_minute * share:
+            return "rate"
+        return None
+
+    def _dispatch(self, provider_type: str) -> Optional[float]:
+        """
+        Admits every waiting ticket that fits. Returns the seconds until the minute
+        window frees tokens if a ticket waits on it (None otherwise).
+        """
+        lane = self._lane(provider_type)
+        limits = self.limits.get(provider_type, {})
+        now = time.monotonic()
+        self._expire(lane, now)
+        reserve = now - lane.last_interactive < self.reserve_seconds
+        retry = retry_at = None
+        passed: List[Ticket] = []
+        granted = False
+        for ticket in list(lane.waiting):
+            reason = self._blocked_by(ticket, lane, limits, reserve)
+            if reason is None:
+                # Packing: a batch request may overtake earlier ones that don't fit,
+                # but not one that has already been overtaken max_skips times
+                if any(t.skipped >= self.max_skips for t in passed):
+                    break
+                for t in passed:
+                    t.skipped += 1
+                self._grant(ticket, lane, now)
+                granted = True
+                continue
+            if reason == "rate" and lane.window:
+                retry_at = lane.window[0][0] + _WINDOW_SECONDS
+                retry = max(0.01, retry_at - now)
+            if ticket.priority == INTERACTIVE:
+                # Nothing may take the capacity the interactive request waits for
+                break
+            passed.append(ticket)
+        if retry_at != lane.retry_at:
+            # Waiters may be sleeping without a timeout, or with one for an earlier
+            # window: wake them all to pick up the new one
+            lane.retry_at = retry_at
+            self._cond.notify_all()
+            for waiting in lane.waiting:
+                if waiting._wake is not None:
+                    waiting._wake()
+        elif granted:
+            self._cond.notify_all()
+        return retry
+
+    def _grant(self, ticket: Ticket, lane: _Lane, now: float):
+        lane.waiting.remove(ticket)
+        ticket.granted = True
+        ticket.queue_ms = round((now - ticket._enqueued) * 1000, 1)
+        lane.in_flight += 1
+        lane.inflight_tokens += ticket.tokens
+        if ticket.priority != INTERACTIVE:
+            lane.batch_in_flight += 1
+        ticket._charge = [now, ticket.tokens, True]
+        lane.window.append(ticket._charge)
+        lane.window_tokens += ticket.tokens
+        lane.stats["admitted"] += 1
+        lane.stats["queue_ms"][min(ticket.priority, BATCH)] += ticket.queue_ms
+        lane.stats["requests"][min(ticket.priority, BATCH)] += 1
+        if ticket._wake is not None:
+            ticket._wake()
+
+    def _settle(self, ticket: Ticket, usage: Optional[Dict[str, Any]]):
+        lane = self._lane(ticket.provider_type)
+        ticket.released = True
+        lane.in_flight -= 1
+        lane.inflight_tokens -= ticket.tokens
+        if ticket.priority != INTERACTIVE:
+            lane.batch_in_flight -= 1
+        charge = ticket._charge
+        if usage and usage.get("completion_tokens") is not None and charge[2]:
+            used = (usage.get("prompt_tokens") or ticket.prompt_tokens) + usage["completion_tokens"]
+            lane.window_tokens += used - charge[1]
+            charge[1] = used
+
+    def _abandon(self, ticket: Ticket):
+        # Cancelled or interrupted while waiting (or right after being admitted)
+        lane = self._lane(ticket.provider_type)
+        if ticket.granted:
+            if not ticket.released:
+                self._settle(ticket, None)
+        elif ticket in lane.waiting:
+            lane.waiting.remove(ticket)
+        self._dispatch(ticket.provider_type)
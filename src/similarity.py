@@ -0,0 +1,235 @@
+import os
+import re
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from src.database import DatabaseManager
+
+# Byte n-gram lengths hashed into the feature vector
+NGRAM_SIZES = (3, 4)
+
+# Persona of PromptOptimizer's placeholder result for an unparseable response;
+# such sessions are kept in history but never reused
+FALLBACK_PERSONA = "Error parsing JSON"
+
+# Words and numbers a reused prompt must share with the new one
+_TOKEN_RE = re.compile(r"\w+")
+
+# Multiplicative hashing constants (Knuth / golden ratio), kept in uint64
+_BYTE_BASE = np.uint64(257)
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def embed(text: str, dim: int = 1024) -> np.ndarray:
+    """
+    Hashed byte n-gram vector of `text`, L2-normalized, so that the dot product of
+    two vectors is their cosine similarity. Counts are damped with log1p so
+    repeated boilerplate doesn't dominate. Runs entirely in NumPy; the hash is
+    deterministic across processes, so vectors can be persisted.
+    """
+    data = np.frombuffer((" " + " ".join(text.lower().split()) + " ").encode("utf-8"), dtype=np.uint8)
+    counts = np.zeros(dim, dtype=np.float32)
+    values = data.astype(np.uint64)
+    with np.errstate(over="ignore"):
+        for n in NGRAM_SIZES:
+            if len(values) < n:
+                continue
+            # Rolling polynomial hash of every window of n bytes, then a multiplicative mix
+            h = np.zeros(len(values) - n + 1, dtype=np.uint64)
+            for offset in range(n):
+                h = h * _BYTE_BASE + values[offset:len(values) - n + 1 + offset]
+            buckets = ((h * _MIX) >> np.uint64(40)) % np.uint64(dim)
+            counts += np.bincount(buckets.astype(np.int64), minlength=dim).astype(np.float32)
+    vector = np.log1p(counts)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def tokens(text: str) -> frozenset:
+    """
+    The set of lowercased words and numbers in `text`. Prompts with the same
+    tokens differ only in case, punctuation, spacing or repetition.
+    """
+    return frozenset(_TOKEN_RE.findall(text.lower()))
+
+
+class SimilarityIndex:
+    """
+    Embedding index over the raw prompts of the sessions in a DatabaseManager,
+    used to find past optimizations of nearly identical prompts.
+
+    Vectors live in one contiguous float32 matrix (dim * 4 bytes per session),
+    so a lookup is a single matrix-vector product. The embedding only finds
+    candidates: n-gram vectors can't tell "3 bullet points" from "5 bullet
+    points", so a match must also have the same words and numbers (see tokens).
+
+    The index is persisted next to the database (prompt_forge.db ->
+    prompt_forge_similarity.npz). It catches up with sessions saved since on
+    load, on a lookup after invalidate() (e.g. from a session-saved callback),
+    and otherwise at most once every `sync_interval` seconds.
+    """
+
+    def __init__(self, db: DatabaseManager, path: Optional[str] = None,
+                 threshold: float = 0.9, dim: int = 1024, enabled: bool = True, sync_interval: float = 30.0):
+        self.db = db
+        self.path = path or os.path.splitext(db.db_path)[0] + "_similarity.npz"
+        self.threshold = threshold
+        self.dim = dim
+        self.enabled = enabled
+        self.sync_interval = sync_interval
+        self.hits = 0
+        self.misses = 0
+        # Set when sessions may have been saved since the last sync
+        self._stale = True
+        self._synced_at = 0.0
+
+        self._lock = threading.Lock()
+        # Serializes sync() so concurrent callers don't index the same sessions twice
+        self._sync_lock = threading.Lock()
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                ids, vectors = data["ids"], data["vectors"]
+        except Exception as e:
+            # A corrupt or foreign file is rebuilt from the database
+            print(f"Similarity index unreadable, rebuilding: {e}")
+            return
+        if vectors.ndim != 2 or vectors.shape[1] != self.dim:
+            return
+        self._ids = ids.astype(np.int64)
+        self._vectors = vectors.astype(np.float32)
+        self._size = len(ids)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            ids, vectors = self._ids[:self._size], self._vectors[:self._size]
+            self._dirty = False
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, ids=ids, vectors=vectors)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _append(self, ids: List[int], vectors: np.ndarray):
+        # Caller holds the lock. Grows capacity geometrically to keep appends amortized O(1)
+        needed = self._size + len(ids)
+        if needed > len(self._ids):
+            capacity = max(needed, 2 * len(self._ids), 256)
+            grown_ids = np.zeros(capacity, dtype=np.int64)
+            grown_ids[:self._size] = self._ids[:self._size]
+            grown_vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+            grown_vectors[:self._size] = self._vectors[:self._size]
+            self._ids, self._vectors = grown_ids, grown_vectors
+        self._ids[self._size:needed] = ids
+        self._vectors[self._size:needed] = vectors
+        self._size = needed
+        self._dirty = True
+
+    def add(self, session_id: int, raw_prompt: str):
+        vector = embed(raw_prompt, self.dim)
+        with self._lock:
+            self._append([session_id], vector[None, :])
+
+    def sync(self) -> int:
+        """
+        Embeds sessions saved since the newest one in the index. Returns how many were added.
+        """
+        with self._sync_lock:
+            # Cleared first: a save reported while syncing marks the index stale again
+            self._stale = False
+            self._synced_at = time.monotonic()
+            with self._lock:
+                last_id = int(self._ids[:self._size].max()) if self._size else 0
+            added = 0
+            try:
+                for batch in self.db.iter_raw_prompts(after_id=last_id):
+                    vectors = np.stack([embed(raw or "", self.dim) for _, raw in batch])
+                    with self._lock:
+                        self._append([session_id for session_id, _ in batch], vectors)
+                    added += len(batch)
+            except BaseException:
+                self._stale = True
+                raise
+            return added
+
+    def invalidate(self):
+        """
+        Marks the index out of date, so the next lookup syncs. Safe to call from
+        any thread, e.g. DatabaseManager.enqueue_session's callback.
+        """
+        self._stale = True
+
+    def search(self, text: str, k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Returns up to k (session_id, cosine similarity) pairs, most similar first.
+        """
+        query = embed(text, self.dim)
+        with self._lock:
+            if self._size == 0:
+                return []
+            scores = self._vectors[:self._size] @ query
+            ids = self._ids[:self._size]
+            k = min(k, self._size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def find_similar(self, raw_prompt: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the stored optimization of the most similar past prompt, if its
+        similarity reaches the threshold, else None. The result has the same shape
+        as PromptOptimizer results plus a "similar" entry describing the match.
+        """
+        if not self.enabled:
+            return None
+        if self._stale or time.monotonic() - self._synced_at >= self.sync_interval:
+            self.sync()
+        query_tokens = tokens(raw_prompt)
+        for session_id, score in self.search(raw_prompt, k=3):
+            if score < self.threshold:
+                break
+            session = self.db.get_session(session_id)
+            if session is None:
+                # Deleted since it was indexed
+                continue
+            stored = session.to_dict()
+            if tokens(stored["raw_prompt"] or "") != query_tokens:
+                # Close in wording, but a word or number differs
+                continue
+            if stored["structured_elements"].get("persona") == FALLBACK_PERSONA:
+                # The model's answer couldn't be parsed; the response cache doesn't replay these either
+                continue
+            self.hits += 1
+            return {
+                "elements": stored["structured_elements"],
+                "final_prompt": stored["final_prompt"],
+                "similar": {
+                    "session_id": session_id,
+                    "score": round(score, 4),
+                    "raw_prompt": stored["raw_prompt"],
+                    "timestamp": stored["timestamp"]
+                }
+            }
+        self.misses += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": self._size, "hits": self.hits, "misses": self.misses, "threshold": self.threshold}
+
+    def close(self):
+        self.save()
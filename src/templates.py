@@ -0,0 +1,149 @@
+import hashlib
+import threading
+import weakref
+from typing import Any, Dict, List, Optional
+
+from src.chunking import MAP_SYSTEM_PROMPT, REDUCE_SYSTEM_PROMPT
+from src.scheduler import count_tokens
+
+# Where a template's user message takes the request's text
+INPUT_PLACEHOLDER = "{input}"
+
+OPTIMIZE_SYSTEM_PROMPT = """
+You are an expert prompt engineer and optimization engine. Your task is to analyze the user's raw prompt and rewrite it into a highly effective, structured prompt using best practices (CRISPE, Chain-of-Thought).
+
+You MUST return the output in strict JSON format.
+
+Example Output Structure:
+{
+    "elements": {
+        "persona": "...",
+        "context": "...",
+        "instruction": "...",
+        "constraints": "...",
+        "format": "...",
+        "exemplars": "...",
+        "tone": "...",
+        "delimiters": "...",
+        "data": "...",
+        "technique": "..."
+    },
+    "final_prompt": "..."
+}
+
+Do not include any text before or after the JSON.
+"""
+
+
+class PromptTemplate:
+    """
+    A versioned meta-prompt: a fixed system prompt and a user message template.
+
+    Everything that varies per request is laid out after a stable prefix: the
+    system prompt is never formatted, and the user message has fixed text
+    first and the request's text (INPUT_PLACEHOLDER) last. Every request made
+    with a template therefore starts with the same tokens, which backends with
+    prompt caching (llama.cpp and Ollama KV reuse, OpenAI-compatible servers,
+    Anthropic cache_control) can reuse instead of prefilling again. Hosted APIs
+    only cache prefixes above a minimum length (1024 tokens and up for
+    Anthropic and OpenAI); the shipped system prompts are a few hundred
+    tokens, so there they are not cached.
+
+    A template's text never changes; register a new version instead. The id
+    ("name@v2") is recorded with each session.
+    """
+
+    def __init__(self, name: str, version: int, system_prompt: str, user_template: str = INPUT_PLACEHOLDER):
+        if user_template.count(INPUT_PLACEHOLDER) != 1 or not user_template.endswith(INPUT_PLACEHOLDER):
+            raise ValueError(f"The user template of {name} must end with {INPUT_PLACEHOLDER}, used once")
+        self.name = name
+        self.version = version
+        self.system_prompt = system_prompt
+        self.user_template = user_template
+        self.lead_in = user_template[:-len(INPUT_PLACEHOLDER)]
+        self.fingerprint = hashlib.sha256(f"{system_prompt}\0{user_template}".encode("utf-8")).hexdigest()[:16]
+        # System prompt token counts per provider instance, i.e. per loaded model and tokenizer
+        self._prefix_tokens: "weakref.WeakKeyDictionary[Any, int]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+    def render(self, text: str) -> str:
+        """
+        The user message for `text`.
+        """
+        return self.lead_in + text
+
+    def prefix_tokens(self, provider: Any = None) -> int:
+        """
+        Token count of the system prompt for `provider`, counted once per provider
+        and reused for budgeting. Only the count is kept, not token ids; skipping
+        the prefill is up to the backend's own prefix cache.
+        """
+        if provider is None:
+            return count_tokens(self.system_prompt)
+        with self._lock:
+            tokens = self._prefix_tokens.get(provider)
+        if tokens is None:
+            tokens = count_tokens(self.system_prompt, provider)
+            with self._lock:
+                self._prefix_tokens[provider] = tokens
+        return tokens
+
+    def __repr__(self) -> str:
+        return f"PromptTemplate({self.id}, {self.fingerprint})"
+
+
+class TemplateRegistry:
+    """
+    Meta-prompt templates by name and version. get() without a version
+    returns the latest one.
+    """
+
+    def __init__(self):
+        self._templates: Dict[str, Dict[int, PromptTemplate]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, template: PromptTemplate) -> PromptTemplate:
+        with self._lock:
+            versions = self._templates.setdefault(template.name, {})
+            existing = versions.get(template.version)
+            if existing is not None:
+                if existing.fingerprint != template.fingerprint:
+                    raise ValueError(f"{template.id} is already registered with different text; "
+                                     f"register it as a new version")
+                return existing
+            versions[template.version] = template
+            return template
+
+    def get(self, name: str, version: Optional[int] = None) -> PromptTemplate:
+        with self._lock:
+            versions = self._templates.get(name)
+            if not versions:
+                raise KeyError(f"Unknown prompt template: {name}")
+            if version is None:
+                return versions[max(versions)]
+            if version not in versions:
+                raise KeyError(f"Unknown prompt template version: {name}@v{version}")
+            return versions[version]
+
+    def versions(self, name: str) -> List[int]:
+        with self._lock:
+            return sorted(self._templates.get(name, {}))
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return sorted(self._templates)
+
+
+default_templates = TemplateRegistry()
+OPTIMIZE_TEMPLATE = default_templates.register(
+    PromptTemplate("optimize", 1, OPTIMIZE_SYSTEM_PROMPT, "Optimize this prompt:\n\n" + INPUT_PLACEHOLDER)
+)
+CHUNK_MAP_TEMPLATE = default_templates.register(PromptTemplate("chunk_map", 1, MAP_SYSTEM_PROMPT))
+CHUNK_REDUCE_TEMPLATE = default_templates.register(
+    PromptTemplate("chunk_reduce", 1, REDUCE_SYSTEM_PROMPT,
+                   "Elements found in each part of the raw prompt, in order:\n\n" + INPUT_PLACEHOLDER)
+)
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Optional
+
+_shared_runner: Optional["AsyncRunner"] = None
+_shared_lock = threading.Lock()
+
+class AsyncRunner:
+    """
+    Runs a single asyncio event loop on a daemon thread.
+    Coroutines can be submitted from any thread (e.g. the Tk main loop) and are
+    all multiplexed on that one loop instead of one thread per request.
+    """
+
+    def __init__(self, name: str = "async-runner"):
+        self.loop = asyncio.new_event_loop()
+        self.stopped = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro: Coroutine) -> Future:
+        """
+        Schedules a coroutine on the loop and returns a concurrent.futures.Future.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """
+        Blocks the calling thread until the coroutine finishes and returns its result.
+        Must not be called from the loop thread itself.
+        """
+        return self.submit(coro).result(timeout)
+
+    def finish(self, coro: Coroutine, timeout: Optional[float] = 5.0):
+        """
+        Runs a cleanup coroutine (e.g. closing an async client) on the loop. Waits
+        up to `timeout` when called from another thread; on the loop thread itself
+        it is only scheduled, since waiting there would deadlock.
+        """
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self.loop.create_task(coro)
+        else:
+            self.run(coro, timeout)
+
+    def stop(self):
+        self.stopped = True
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+
+def shared_runner() -> AsyncRunner:
+    """
+    Returns the process-wide runner, starting it on first use.
+    Async provider clients are bound to the loop they first ran on, so all
+    async work in the process should go through this one loop.
+    """
+    global _shared_runner
+    with _shared_lock:
+        if _shared_runner is None or _shared_runner.stopped:
+            _shared_runner = AsyncRunner()
+        return _shared_runner
@@ -1,4 +1,3 @@
-import keyring
 import platform
 
 class CredentialManager:
@@ -7,6 +6,8 @@ class CredentialManager:
     @staticmethod
     def save_credential(key: str, value: str):
         try:
+            # Deferred: loading the keyring backends is slow and only needed for cloud providers
+            import keyring
             keyring.set_password(CredentialManager.SERVICE_NAME, key, value)
             return True
         except Exception as e:
@@ -16,6 +17,7 @@ class CredentialManager:
     @staticmethod
     def get_credential(key: str) -> str:
         try:
+            import keyring
             val = keyring.get_password(CredentialManager.SERVICE_NAME, key)
             return val if val else ""
         except Exception as e:
@@ -25,6 +27,7 @@ class CredentialManager:
     @staticmethod
     def delete_credential(key: str):
         try:
+            import keyring
             keyring.delete_password(CredentialManager.SERVICE_NAME, key)
         except Exception:
             pass
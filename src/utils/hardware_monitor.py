@@ -1,7 +1,22 @@
 import psutil
-import GPUtil
 import platform
-from typing import Dict, Any
+import threading
+import time
+from typing import Dict, Any, List, Optional, Sequence
+
+import numpy as np
+
+# Metrics kept by HardwareSampler, all in percent (GPU values are for the first GPU)
+SAMPLE_FIELDS = ("cpu", "ram", "gpu_load", "gpu_memory")
+
+_SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+def _get_gpus() -> list:
+    # Imported on first use: GPUtil is slow to load and optional at runtime
+    import GPUtil
+    return GPUtil.getGPUs()
+
 
 class HardwareMonitor:
     @staticmethod
@@ -12,9 +27,9 @@ class HardwareMonitor:
             "gpu_found": False,
             "gpus": []
         }
-        
+
         try:
-            gpus = GPUtil.getGPUs()
+            gpus = _get_gpus()
             if gpus:
                 stats["gpu_found"] = True
                 for gpu in gpus:
@@ -28,12 +43,300 @@ class HardwareMonitor:
         except Exception:
             # GPUtil might fail if no NVIDIA drivers or on Mac
             pass
-            
+
         return stats
 
     @staticmethod
     def is_gpu_available() -> bool:
         try:
-            return len(GPUtil.getGPUs()) > 0
+            return len(_get_gpus()) > 0
         except:
             return False
+
+
+def sparkline(values: Sequence[float], width: int = 20, low: float = 0.0, high: float = 100.0) -> str:
+    """
+    Renders the last `width` values as a row of block characters scaled to
+    [low, high]. Missing (NaN) values are shown as spaces.
+    """
+    values = np.asarray(values, dtype=np.float64)[-width:]
+    if len(values) == 0:
+        return ""
+    levels = np.clip((values - low) / (high - low), 0.0, 1.0) * (len(_SPARK_CHARS) - 1)
+    return "".join(" " if np.isnan(level) else _SPARK_CHARS[int(round(level))] for level in levels)
+
+
+class HardwareSampler:
+    """
+    Samples CPU, RAM and GPU usage on a background thread into a fixed-size
+    ring buffer (one NumPy array per metric), so readers such as the UI only
+    copy memory and never wait on psutil or nvidia-smi.
+
+    The buffer holds the last `capacity` samples (20 minutes at the default
+    2 s interval). Timestamps are time.time() values, so usage can be matched
+    against the start and end of an optimization.
+    """
+
+    def __init__(self, interval: float = 2.0, capacity: int = 600):
+        self.interval = interval
+        self.capacity = capacity
+        self._times = np.full(capacity, np.nan)
+        self._values = {field: np.full(capacity, np.nan, dtype=np.float32) for field in SAMPLE_FIELDS}
+        self._next = 0
+        self._count = 0
+        self._latest: Optional[Dict[str, Any]] = None
+        # None until the first probe; False stops querying a machine without a usable GPU
+        self._gpu_available: Optional[bool] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "HardwareSampler":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="hardware-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+            self._thread = None
+
+    def _run(self):
+        # cpu_percent(None) measures since the previous call; the first call only primes it
+        psutil.cpu_percent(interval=None)
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Hardware Sampler Error: {e}")
+
+    def _read_gpus(self) -> List[Dict[str, Any]]:
+        if self._gpu_available is False:
+            return []
+        try:
+            gpus = [{
+                "name": gpu.name,
+                "load": gpu.load * 100,
+                "memory_used": gpu.memoryUsed,
+                "memory_total": gpu.memoryTotal,
+                "temperature": gpu.temperature
+            } for gpu in _get_gpus()]
+        except Exception:
+            # GPUtil might fail if no NVIDIA drivers or on Mac
+            gpus = []
+        if self._gpu_available is None:
+            self._gpu_available = bool(gpus)
+        return gpus
+
+    def sample(self) -> Dict[str, Any]:
+        """
+        Takes one sample, stores it in the ring buffer and returns it.
+        """
+        gpus = self._read_gpus()
+        gpu = gpus[0] if gpus else None
+        sample = {
+            "time": time.time(),
+            "cpu": psutil.cpu_percent(interval=None),
+            "ram": psutil.virtual_memory().percent,
+            "gpu_load": gpu["load"] if gpu else float("nan"),
+            "gpu_memory": gpu["memory_used"] * 100 / gpu["memory_total"] if gpu and gpu["memory_total"] else float("nan"),
+            "gpus": gpus
+        }
+        with self._lock:
+            self._times[self._next] = sample["time"]
+            for field in SAMPLE_FIELDS:
+                self._values[field][self._next] = sample[field]
+            self._next = (self._next + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+            self._latest = sample
+        return sample
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        """
+        The most recent sample, or None before the first one.
+        """
+        with self._lock:
+            return self._latest
+
+    def snapshot(self, since: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """
+        Copies of the buffered samples in chronological order, as arrays keyed
+        "time" plus SAMPLE_FIELDS. `since` (a time.time() value) drops older samples.
+        """
+        with self._lock:
+            # Oldest sample sits at _next once the buffer has wrapped
+            order = (np.arange(self._count) + (self._next if self._count == self.capacity else 0)) % self.capacity
+            data = {"time": self._times[order]}
+            data.update({field: self._values[field][order] for field in SAMPLE_FIELDS})
+        if since is not None:
+            keep = data["time"] >= since
+            data = {key: values[keep] for key, values in data.items()}
+        return data
+
+    def summary(self, start: float, end: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Mean and peak of every metric over samples taken between start and end
+        (time.time() values). Metrics without samples in the window are None.
+        """
+        data = self.snapshot(since=start)
+        if end is not None:
+            keep = data["time"] <= end
+            data = {key: values[keep] for key, values in data.items()}
+        result: Dict[str, Any] = {"samples": int(len(data["time"]))}
+        for field in SAMPLE_FIELDS:
+            values = data[field][~np.isnan(data[field])]
+            result[f"{field}_mean"] = round(float(values.mean()), 1) if len(values) else None
+            result[f"{field}_peak"] = round(float(values.max()), 1) if len(values) else None
+        return result
+
+    def sparkline(self, field: str, width: int = 20) -> str:
+        return sparkline(self.snapshot()[field], width)
+
+
+class ResourceProfiler:
+    """
+    Measures what one request costs while it runs. A background thread samples,
+    every `interval` seconds:
+      - CPU time and RSS of this process and its children (llama.cpp runs
+        in-process, pool workers are child processes)
+      - system-wide CPU utilization (covers servers such as Ollama)
+      - GPU memory and load, every `gpu_interval` seconds (each GPUtil query
+        runs nvidia-smi)
+
+    Process counters are shared by everything running in the process, so the
+    figures are exact only when one request runs at a time, as in the GUI.
+
+        profiler = ResourceProfiler().start()
+        ...generate...
+        report = profiler.stop()
+    """
+
+    # Shared by all profilers: whether this machine has a GPU GPUtil can read
+    _gpu_available: Optional[bool] = None
+
+    def __init__(self, interval: float = 0.05, gpu_interval: float = 0.5):
+        self.interval = interval
+        self.gpu_interval = gpu_interval
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._samples = 0
+        self._system_cpu: List[float] = []
+        self._rss_peak = 0
+        self._gpu_memory_peak: Optional[float] = None
+        self._gpu_load_peak: Optional[float] = None
+        self._report: Optional[Dict[str, Any]] = None
+
+    def _process_tree(self) -> list:
+        try:
+            return [self._process] + self._process.children(recursive=True)
+        except psutil.Error:
+            return [self._process]
+
+    def _read_process(self):
+        """
+        Returns (CPU seconds, RSS bytes) summed over the process and its children.
+        """
+        cpu = rss = 0
+        for process in self._process_tree():
+            try:
+                with process.oneshot():
+                    times = process.cpu_times()
+                    cpu += times.user + times.system
+                    rss += process.memory_info().rss
+            except psutil.Error:
+                # Exited between listing and reading
+                continue
+        return cpu, rss
+
+    def _read_gpu(self):
+        """
+        Returns (used memory MB summed over GPUs, peak load %), or (None, None).
+        """
+        if ResourceProfiler._gpu_available is False:
+            return None, None
+        try:
+            gpus = _get_gpus()
+        except Exception:
+            gpus = []
+        if ResourceProfiler._gpu_available is None:
+            ResourceProfiler._gpu_available = bool(gpus)
+        if not gpus:
+            return None, None
+        return sum(gpu.memoryUsed for gpu in gpus), max(gpu.load * 100 for gpu in gpus)
+
+    def _record_gpu(self) -> Optional[float]:
+        memory, load = self._read_gpu()
+        if memory is not None:
+            self._gpu_memory_peak = max(self._gpu_memory_peak or 0.0, memory)
+            self._gpu_load_peak = max(self._gpu_load_peak or 0.0, load)
+        return memory
+
+    def start(self) -> "ResourceProfiler":
+        # GPU first: the first probe imports GPUtil, which shouldn't count as the request's CPU time
+        self._start_gpu_memory = self._record_gpu()
+        self._start_time = time.perf_counter()
+        self._start_cpu, self._start_rss = self._read_process()
+        self._rss_peak = self._start_rss
+        self._thread = threading.Thread(target=self._run, name="resource-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        last_times = psutil.cpu_times()
+        next_gpu = time.perf_counter() + self.gpu_interval
+        while not self._stop.wait(self.interval):
+            # System utilization from cpu_times deltas: psutil.cpu_percent keeps
+            # global state that other samplers would disturb
+            times = psutil.cpu_times()
+            total = sum(times) - sum(last_times)
+            if total > 0:
+                idle = (times.idle + getattr(times, "iowait", 0)) - (last_times.idle + getattr(last_times, "iowait", 0))
+                self._system_cpu.append(max(0.0, 100.0 * (1 - idle / total)))
+            last_times = times
+            _, rss = self._read_process()
+            self._rss_peak = max(self._rss_peak, rss)
+            self._samples += 1
+            if time.perf_counter() >= next_gpu:
+                self._record_gpu()
+                next_gpu = time.perf_counter() + self.gpu_interval
+
+    def stop(self) -> Dict[str, Any]:
+        """
+        Stops sampling and returns the report (see RESOURCE_FIELDS in src.database).
+        Further calls return the same report.
+        """
+        if self._report is not None:
+            return self._report
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        wall = time.perf_counter() - self._start_time
+        cpu, rss = self._read_process()
+        self._rss_peak = max(self._rss_peak, rss)
+        end_gpu_memory = self._record_gpu()
+        cpu_time = max(0.0, cpu - self._start_cpu)
+        mb = 1024 ** 2
+        self._report = {
+            "cpu_time_ms": round(cpu_time * 1000, 1),
+            # Average number of cores kept busy by this process tree
+            "cpu_cores": round(cpu_time / wall, 2) if wall > 0 else None,
+            "system_cpu_mean": round(sum(self._system_cpu) / len(self._system_cpu), 1) if self._system_cpu else None,
+            "system_cpu_peak": round(max(self._system_cpu), 1) if self._system_cpu else None,
+            "rss_peak_mb": round(self._rss_peak / mb, 1),
+            "rss_growth_mb": round((rss - self._start_rss) / mb, 1),
+            "gpu_memory_peak_mb": self._gpu_memory_peak,
+            "gpu_memory_growth_mb": (end_gpu_memory - self._start_gpu_memory
+                                     if end_gpu_memory is not None and self._start_gpu_memory is not None else None),
+            "gpu_load_peak": round(self._gpu_load_peak, 1) if self._gpu_load_peak is not None else None,
+            "resource_samples": self._samples
+        }
+        return self._report
+
+    def __enter__(self) -> "ResourceProfiler":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
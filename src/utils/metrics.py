@@ -0,0 +1,91 @@
+import time
+from typing import Dict, Any, Optional
+
+# (prompt, completion) token count keys as reported by each backend
+_USAGE_KEYS = (
+    ("prompt_tokens", "completion_tokens"),             # OpenAI, Groq, llama.cpp
+    ("input_tokens", "output_tokens"),                  # Anthropic
+    ("prompt_token_count", "candidates_token_count"),   # Gemini
+    ("prompt_eval_count", "eval_count"),                # Ollama
+)
+
+
+def _get(obj: Any, key: str) -> Any:
+    if obj is None:
+        return None
+    try:
+        return obj[key]
+    except (KeyError, TypeError, IndexError):
+        return getattr(obj, key, None)
+
+
+def _cached_tokens(raw: Any, source: Any) -> Optional[int]:
+    # Prompt tokens the backend served from its prompt / prefix cache
+    details = _get(source, "prompt_tokens_details")
+    for value in (
+        _get(source, "cache_read_input_tokens"),        # Anthropic
+        _get(details, "cached_tokens"),                 # OpenAI, Groq, llama.cpp server
+        _get(source, "cached_content_token_count"),     # Gemini
+        _get(raw, "prefix_tokens_reused"),              # llama.cpp in-process (see LlamaCppProvider)
+        _get(_get(raw, "timings"), "cache_n"),          # llama.cpp server without usage details
+    ):
+        if value is not None:
+            return int(value)
+    return None
+
+
+def extract_usage(raw: Any) -> Dict[str, Optional[int]]:
+    """
+    Reads prompt/completion token counts from a provider's raw response (or a
+    usage object), whichever of the known shapes it has, and how many prompt
+    tokens came from the backend's prompt cache. Missing counts are None.
+    """
+    sources = [raw, _get(raw, "usage"), _get(raw, "usage_metadata")]
+    for source in sources:
+        if source is None:
+            continue
+        for prompt_key, completion_key in _USAGE_KEYS:
+            prompt_tokens = _get(source, prompt_key)
+            completion_tokens = _get(source, completion_key)
+            if prompt_tokens is not None or completion_tokens is not None:
+                if prompt_key == "input_tokens" and prompt_tokens is not None:
+                    # Anthropic counts cache reads and writes separately from input_tokens
+                    prompt_tokens += ((_get(source, "cache_read_input_tokens") or 0)
+                                      + (_get(source, "cache_creation_input_tokens") or 0))
+                return {
+                    "prompt_tokens": int(prompt_tokens) if prompt_tokens is not None else None,
+                    "completion_tokens": int(completion_tokens) if completion_tokens is not None else None,
+                    "cached_tokens": _cached_tokens(raw, source)
+                }
+    return {"prompt_tokens": None, "completion_tokens": None, "cached_tokens": None}
+
+
+class CallTimer:
+    """
+    Measures one provider call: wall time, time to first token (streams) and
+    token usage, reported as the "metrics" dict attached to optimizer results
+    and stored with the session.
+    """
+
+    def __init__(self, provider_type: str, model: str, template_version: Optional[str] = None):
+        self.provider_type = provider_type
+        self.model = model
+        self.template_version = template_version
+        self._start = time.perf_counter()
+        self._first_token: Optional[float] = None
+
+    def first_token(self):
+        if self._first_token is None:
+            self._first_token = time.perf_counter()
+
+    def finish(self, usage: Optional[Any] = None) -> Dict[str, Any]:
+        end = time.perf_counter()
+        metrics = {
+            "provider": self.provider_type,
+            "model": self.model,
+            "latency_ms": round((end - self._start) * 1000, 1),
+            "ttft_ms": round((self._first_token - self._start) * 1000, 1) if self._first_token is not None else None,
+            "template_version": self.template_version
+        }
+        metrics.update(extract_usage(usage))
+        return metrics
@@ -0,0 +1,201 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Inside a string only quotes and backslashes matter
+_STRING_SPECIAL = re.compile(r'["\\]')
+# A bare scalar (number, true/false/null) ends at whitespace or a delimiter
+_SCALAR_END = re.compile(r'[\s,}\]]')
+
+Path = Tuple[Any, ...]
+
+
+class StreamingJSONParser:
+    """
+    Incremental parser for a single JSON object embedded in LLM output.
+
+    Chunks are passed to feed() as they arrive; each call returns the (path, value)
+    pairs that completed within it, e.g. (("elements", "persona"), "...") or
+    (("final_prompt",), "..."). Only values up to `emit_depth` keys deep are reported.
+
+    Everything before the first '{' (markdown fences, preamble) and after the
+    matching '}' (closing fence, trailing chatter) is skipped, and the input is
+    scanned once: only the token currently being read is kept in memory.
+    String values are decoded leniently, so raw newlines inside strings are accepted.
+    """
+
+    def __init__(self, emit_depth: int = 2):
+        self.emit_depth = emit_depth
+        self.result: Optional[Dict[str, Any]] = None
+        self.complete = False
+        self._buffer = ""
+        self._offset = 0        # absolute position of _buffer[0] in the whole input
+        self._pos = 0           # scan position within _buffer
+        self._token_start = 0   # start of the string/scalar being read
+        self._in_string = False
+        self._in_scalar = False
+        self._root_start = -1   # absolute position of the current root '{'
+        self._emitted = False
+        # Frames are [container, path, pending_key, expecting_value]
+        self._stack: List[list] = []
+
+    def feed(self, chunk: str) -> List[Tuple[Path, Any]]:
+        events: List[Tuple[Path, Any]] = []
+        if self.complete or not chunk:
+            return events
+
+        self._buffer += chunk
+        buf = self._buffer
+        pos = self._pos
+        n = len(buf)
+
+        while pos < n and not self.complete:
+            if self._in_string:
+                m = _STRING_SPECIAL.search(buf, pos)
+                if not m:
+                    pos = n
+                    break
+                if m.group() == "\\":
+                    if m.end() >= n:
+                        # Escape sequence split across chunks, wait for the rest
+                        pos = m.start()
+                        break
+                    pos = m.end() + 1
+                    continue
+                pos = m.end()
+                self._in_string = False
+                self._on_string(buf[self._token_start:pos], events)
+                continue
+
+            if self._in_scalar:
+                m = _SCALAR_END.search(buf, pos)
+                if not m:
+                    pos = n
+                    break
+                self._in_scalar = False
+                self._on_scalar(buf[self._token_start:m.start()], events)
+                pos = m.start()
+                continue
+
+            if not self._stack:
+                # Seeking the root object
+                start = buf.find("{", pos)
+                if start < 0:
+                    pos = n
+                    break
+                self.result = {}
+                self._root_start = self._offset + start
+                self._stack.append([self.result, (), None, False])
+                pos = start + 1
+                continue
+
+            c = buf[pos]
+            frame = self._stack[-1]
+            expecting_key = isinstance(frame[0], dict) and not frame[3]
+
+            if c == '"':
+                self._in_string = True
+                self._token_start = pos
+                pos += 1
+            elif c in " \t\r\n:,":
+                pos += 1
+            elif c == "}" or c == "]":
+                pos += 1
+                self._close_container(events)
+            elif expecting_key:
+                # Anything but a string key here means this was not the real
+                # JSON object (e.g. a brace inside the preamble); try the next one.
+                pos = self._restart(buf, pos)
+            elif c == "{" or c == "[":
+                container: Any = {} if c == "{" else []
+                path = self._attach(container)
+                self._stack.append([container, path, None, False])
+                pos += 1
+            else:
+                self._in_scalar = True
+                self._token_start = pos
+
+        self._trim(pos)
+        return events
+
+    def close(self) -> Optional[Dict[str, Any]]:
+        """
+        Signals end of input. Returns the parsed object if it was complete, else None.
+        """
+        if self._in_scalar and self._stack:
+            self._in_scalar = False
+            self._on_scalar(self._buffer[self._token_start:], [])
+        return self.result if self.complete else None
+
+    def _on_string(self, raw: str, events: List[Tuple[Path, Any]]):
+        try:
+            value = json.loads(raw, strict=False)
+        except json.JSONDecodeError:
+            value = raw[1:-1]
+
+        frame = self._stack[-1]
+        if isinstance(frame[0], dict) and not frame[3]:
+            frame[2] = value
+            frame[3] = True
+            return
+        self._emit(self._attach(value), value, events)
+
+    def _on_scalar(self, token: str, events: List[Tuple[Path, Any]]):
+        try:
+            value = json.loads(token)
+        except json.JSONDecodeError:
+            value = token
+        self._emit(self._attach(value), value, events)
+
+    def _attach(self, value: Any) -> Path:
+        frame = self._stack[-1]
+        container = frame[0]
+        if isinstance(container, dict):
+            key = frame[2]
+            container[key] = value
+            frame[3] = False
+        else:
+            key = len(container)
+            container.append(value)
+        return frame[1] + (key,)
+
+    def _close_container(self, events: List[Tuple[Path, Any]]):
+        container, path, _, _ = self._stack.pop()
+        if not self._stack:
+            self.complete = True
+            return
+        self._emit(path, container, events)
+
+    def _emit(self, path: Path, value: Any, events: List[Tuple[Path, Any]]):
+        if len(path) <= self.emit_depth:
+            events.append((path, value))
+            self._emitted = True
+
+    def _restart(self, buf: str, pos: int) -> int:
+        """
+        Abandons the current root candidate and resumes seeking after its '{'.
+        Only possible before anything was emitted; afterwards the offending
+        token is skipped so the fields already reported stay consistent.
+        """
+        if self._emitted:
+            m = _SCALAR_END.search(buf, pos + 1)
+            return m.start() if m else len(buf)
+        self._stack.clear()
+        self.result = None
+        return self._root_start + 1 - self._offset
+
+    def _trim(self, pos: int):
+        # Keep the root start while rewinding is still possible, otherwise
+        # only the token currently being read.
+        if not self._emitted and self._stack:
+            keep = self._root_start - self._offset
+        elif self._in_string or self._in_scalar:
+            keep = self._token_start
+        else:
+            keep = pos
+        keep = max(0, min(keep, pos))
+        if keep:
+            self._buffer = self._buffer[keep:]
+            self._offset += keep
+            self._token_start -= keep
+        self._pos = pos - keep
@@ -34,5 +34,928 @@ def test_core():
     except Exception as e:
         print(f"Optimizer Init Failed: {e}")
 
+def test_scheduler_rate_wakeup():
+    # A batch ticket first blocked by concurrency and then, after the other one is
+    # released, by the minute window must still be admitted once the window empties
+    import asyncio
+    import threading
+    import time
+    import src.scheduler as scheduler_module
+    from src.scheduler import BATCH, RequestScheduler
+
+    print("\nTesting Scheduler Wakeup...")
+    window = scheduler_module._WINDOW_SECONDS
+    scheduler_module._WINDOW_SECONDS = 1.0
+    try:
+        for mode in ("sync", "async"):
+            scheduler = RequestScheduler({"test": {"max_concurrency": 1, "tokens_per_minute": 2500}})
+            first = scheduler.acquire(scheduler.prepare("test", None, [1000], 500, priority=BATCH))
+            second = scheduler.prepare("test", None, [1000], 500, priority=BATCH)
+            if mode == "sync":
+                waiter = threading.Thread(target=scheduler.acquire, args=(second,), daemon=True)
+            else:
+                waiter = threading.Thread(target=asyncio.run, args=(scheduler.aacquire(second),), daemon=True)
+            waiter.start()
+            time.sleep(0.2)
+            scheduler.release(first)
+            waiter.join(timeout=5)
+            assert second.granted, f"{mode} waiter was never woken: {scheduler.stats()}"
+            scheduler.release(second)
+        print("Scheduler Wakeup Test Passed.")
+    finally:
+        scheduler_module._WINDOW_SECONDS = window
+
+class _FakeProvider:
+    # Answers every request with a fixed optimizer document
+    def __init__(self, final_prompt):
+        self.final_prompt = final_prompt
+        self.calls = 0
+
+    def _answer(self):
+        import json
+        self.calls += 1
+        return {"content": json.dumps({"elements": {"persona": "tester"}, "final_prompt": self.final_prompt})}
+
+    def generate(self, system_prompt, user_prompt, model, **kwargs):
+        return self._answer()
+
+    async def agenerate(self, system_prompt, user_prompt, model, **kwargs):
+        return self._answer()
+
+def test_cache_provider_identity():
+    # Two servers serving a model under the same name must not share cached answers,
+    # and a disk hit must not write to the cache file
+    import sqlite3
+    import tempfile
+    from src.cache import ResponseCache
+
+    print("\nTesting Cache Provider Identity...")
+    path = os.path.join(tempfile.mkdtemp(), "cache.db")
+    cache = ResponseCache(path)
+    optimizers = []
+    for name in ("a", "b"):
+        optimizer = PromptOptimizer("openai", lazy=True, base_url=f"http://{name}.local/v1")
+        optimizer.provider = _FakeProvider(f"from {name}")
+        optimizer.cache = cache
+        optimizers.append(optimizer)
+    a, b = optimizers
+    assert a.optimize_prompt("Same prompt", "local-model", use_similar=False)["final_prompt"] == "from a"
+    result = b.optimize_prompt("Same prompt", "local-model", use_similar=False)
+    assert result["final_prompt"] == "from b" and not result.get("cached"), result
+    assert a.optimize_prompt("Same prompt", "local-model", use_similar=False).get("cached")
+    cache.close()
+
+    accessed = sqlite3.connect(path).execute("SELECT accessed FROM responses ORDER BY key").fetchall()
+    reopened = ResponseCache(path)
+    a.cache = reopened
+    assert a.optimize_prompt("Same prompt", "local-model", use_similar=False).get("cached")
+    assert reopened.hits_disk == 1
+    reopened.close()
+    assert sqlite3.connect(path).execute("SELECT accessed FROM responses ORDER BY key").fetchall() == accessed
+    assert a.provider.calls == 1 and b.provider.calls == 1
+    print("Cache Provider Identity Test Passed.")
+
+def test_similarity_requires_same_tokens():
+    # Prompts a number or word apart score high on n-grams but must not share a result;
+    # formatting-only differences still do. Lookups only sync when told to or on the interval
+    import tempfile
+    from src.similarity import SimilarityIndex
+
+    print("\nTesting Similarity Matching...")
+    directory = tempfile.mkdtemp()
+    db = DatabaseManager(os.path.join(directory, "history.db"))
+    index = SimilarityIndex(db, path=os.path.join(directory, "index.npz"), sync_interval=3600)
+    try:
+        db.add_session("Summarize this article in 3 bullet points", {"persona": "editor"}, "Three bullets")
+        assert index.find_similar("Summarize this article in 5 bullet points") is None
+        match = index.find_similar("summarize this article in 3 bullet points!")
+        assert match is not None and match["final_prompt"] == "Three bullets", match
+
+        db.add_session("Write a poem about cats", {"persona": "poet"}, "Cat poem")
+        assert index.find_similar("Write a poem about cats.") is None, "synced without invalidate()"
+        index.invalidate()
+        assert index.find_similar("Write a poem about cats.")["final_prompt"] == "Cat poem"
+        print("Similarity Matching Test Passed.")
+    finally:
+        index.close()
+        db.close()
+
+def test_migrate_elements_json():
+    # A version-4 database still has the JSON column; migrating drops it, so every
+    # element must land in session_elements, whatever shape its JSON had
+    import json
+    import sqlite3
+    import tempfile
+    from src.database import PromptSession
+
+    print("\nTesting Elements Migration...")
+    blobs = [
+        {"persona": "tester", "context": "", "tone": None, "count": 3, "ratio": 2.5, "strict": True,
+         "format": {"type": "list", "items": [1, "two", None]}, "exemplars": ["a", {"b": False}],
+         "unicode": "caf\u00e9 \u2014 ok"},
+        {},
+        ["not", "an", "object"],
+        "a bare string",
+        None,
+        "{not json",
+    ]
+    path = os.path.join(tempfile.mkdtemp(), "v4.db")
+    conn = sqlite3.connect(path)
+    columns = [c.name for c in PromptSession.__table__.columns
+               if c.name not in ("id", "cached_tokens", "template_version")]
+    conn.execute("CREATE TABLE prompt_sessions (id INTEGER PRIMARY KEY, structured_elements_json TEXT, "
+                 + ", ".join(columns) + ")")
+    conn.execute("CREATE VIRTUAL TABLE prompt_sessions_fts USING fts5(raw_prompt, final_prompt, elements)")
+    conn.execute("""CREATE TRIGGER prompt_sessions_fts_insert AFTER INSERT ON prompt_sessions BEGIN
+        INSERT INTO prompt_sessions_fts(rowid, raw_prompt, final_prompt, elements)
+        VALUES (new.id, new.raw_prompt, new.final_prompt, CASE WHEN json_valid(new.structured_elements_json)
+            THEN (SELECT group_concat(value, ' ') FROM json_each(new.structured_elements_json)) END);
+    END""")
+    for i, blob in enumerate(blobs):
+        raw = blob if isinstance(blob, str) and i == len(blobs) - 1 else (None if blob is None else json.dumps(blob))
+        conn.execute("INSERT INTO prompt_sessions (id, timestamp, raw_prompt, final_prompt, structured_elements_json) "
+                     "VALUES (?, '2024-01-01 00:00:00', ?, 'final', ?)", (i + 1, f"prompt {i}", raw))
+    conn.execute("PRAGMA user_version = 4")
+    conn.commit()
+    conn.close()
+
+    db = DatabaseManager(path)
+    try:
+        columns = {row[1] for row in sqlite3.connect(path).execute("PRAGMA table_info(prompt_sessions)")}
+        assert "structured_elements_json" not in columns and "template_version" in columns
+        for i, blob in enumerate(blobs):
+            stored = db.get_session(i + 1).structured_elements
+            if isinstance(blob, dict):
+                assert list(stored) == list(blob), (blob, stored)
+                for key, value in blob.items():
+                    if isinstance(value, str):
+                        assert stored[key] == value, (key, stored[key])
+                    elif value is None:
+                        assert stored[key] == "", (key, stored[key])
+                    else:
+                        assert json.loads(stored[key]) == value, (key, stored[key])
+            elif blob is None:
+                assert stored == {}, stored
+            elif i == len(blobs) - 1:
+                assert stored == {"elements": blob}, stored
+            elif isinstance(blob, str):
+                assert stored == {"elements": blob}, stored
+            else:
+                assert list(stored) == ["elements"] and json.loads(stored["elements"]) == blob, stored
+        assert [row["id"] for row in db.search_sessions("tester")] == [1]
+        print("Elements Migration Test Passed.")
+    finally:
+        db.close()
+
+def test_stream_parser():
+    # Every document is fed whole, one character at a time and split at every
+    # position; all must give the same result and the same events
+    import json
+    from src.utils.stream_parser import StreamingJSONParser
+
+    print("\nTesting Streaming JSON Parser...")
+
+    def parse(chunks):
+        parser = StreamingJSONParser()
+        events = []
+        for chunk in chunks:
+            events.extend(parser.feed(chunk))
+        return parser.close(), events
+
+    def check(text, expected, expected_events=None):
+        splits = [[text], list(text)] + [[text[:i], text[i:]] for i in range(1, len(text))]
+        for chunks in splits:
+            result, events = parse(chunks)
+            assert result == expected, (chunks, result)
+            if expected_events is not None:
+                assert events == expected_events, (chunks, events)
+
+    document = {"elements": {"persona": "Editor", "constraints": "Say \"no\" \\ caf\u00e9\n"},
+                "final_prompt": "Be brief."}
+    body = json.dumps(document)
+    events = [(("elements", "persona"), "Editor"),
+              (("elements", "constraints"), document["elements"]["constraints"]),
+              (("elements",), document["elements"]),
+              (("final_prompt",), "Be brief.")]
+
+    # Markdown fences and trailing chatter
+    check("```json\n" + body + "\n```\nHope this helps!", document, events)
+    # Braces in the preamble are not the object
+    check("Sure {here} it is: {" + body[1:], document, events)
+    # The splits above cut through every escape (\", \\, \u00e9, \n); here non-ASCII text is unescaped
+    check(json.dumps(document, ensure_ascii=False), document, events)
+    # Raw newlines inside strings
+    check('{"final_prompt": "line one\nline two\ttabbed"}', {"final_prompt": "line one\nline two\ttabbed"})
+    # Nested values deeper than emit_depth are reported with their parent
+    check('{"elements": {"format": {"type": "list", "items": [1, 2.5, true, null]}}}',
+          {"elements": {"format": {"type": "list", "items": [1, 2.5, True, None]}}},
+          [(("elements", "format"), {"type": "list", "items": [1, 2.5, True, None]}),
+           (("elements",), {"format": {"type": "list", "items": [1, 2.5, True, None]}})])
+
+    # Truncated output: no result, but the fields completed before the cut were reported
+    truncated = body[:body.index("Be brief")]
+    for chunks in ([truncated], list(truncated)):
+        result, got = parse(chunks)
+        assert result is None, result
+        assert got == events[:3], got
+    # Nothing after the object is read, even another object
+    parser = StreamingJSONParser()
+    parser.feed('{"a": 1} {"b": 2}')
+    assert parser.close() == {"a": 1}
+    print("Streaming JSON Parser Test Passed.")
+
+def test_resilient_provider():
+    # Transient errors are retried, request errors are not, and repeated failures
+    # open the circuit until the reset timeout passes and the health check succeeds
+    import time
+    from src.backends.resilience import CircuitOpenError, ResilientProvider
+
+    print("\nTesting Resilient Provider...")
+
+    class Flaky:
+        def __init__(self):
+            self.errors = []
+            self.healthy = True
+            self.calls = 0
+
+        def generate(self, system_prompt, user_prompt, model, **kwargs):
+            self.calls += 1
+            if self.errors:
+                raise self.errors.pop(0)
+            return {"content": "ok"}
+
+        def check_health(self):
+            return self.healthy
+
+        def get_name(self):
+            return "flaky"
+
+    inner = Flaky()
+    provider = ResilientProvider(inner, max_retries=2, base_delay=0.001, failure_threshold=3, reset_timeout=0.2)
+    inner.errors = [ConnectionError("reset"), TimeoutError("slow")]
+    assert provider.generate("s", "u", "m")["content"] == "ok" and inner.calls == 3
+    assert provider.stats["retries"] == 2 and provider.breaker.state == "closed"
+
+    inner.calls = 0
+    inner.errors = [ValueError("unknown model")]
+    try:
+        provider.generate("s", "u", "m")
+        raise AssertionError("request error was swallowed")
+    except ValueError:
+        pass
+    assert inner.calls == 1, "request errors must not be retried"
+
+    inner.errors = [ConnectionError("down")] * 3
+    inner.healthy = False
+    try:
+        provider.generate("s", "u", "m")
+        raise AssertionError("exhausted retries must raise")
+    except ConnectionError:
+        pass
+    assert provider.breaker.state == "open"
+    for wait in (0, 0.25):
+        # Rejected while open, and still after the timeout while the health check fails
+        time.sleep(wait)
+        try:
+            provider.generate("s", "u", "m")
+            raise AssertionError("open circuit let a call through")
+        except CircuitOpenError:
+            pass
+    inner.healthy = True
+    time.sleep(0.25)
+    assert provider.generate("s", "u", "m")["content"] == "ok" and provider.breaker.state == "closed"
+    print("Resilient Provider Test Passed.")
+
+def test_provider_registry():
+    # The same config reuses one instance, even when requested concurrently; an
+    # instance evicted over budget is closed only once its running call ends
+    from concurrent.futures import ThreadPoolExecutor
+    from src.backends.registry import ProviderRegistry
+
+    print("\nTesting Provider Registry...")
+    registry = ProviderRegistry(memory_budget_bytes=1024 * 1024)
+    with ThreadPoolExecutor(8) as pool:
+        instances = list(pool.map(lambda _: registry.get("openai", base_url="http://a.local/v1"), range(8)))
+    first = instances[0]
+    assert all(instance is first for instance in instances)
+    assert registry.get("openai", base_url="http://a.local/v1") is first
+
+    first._track(1)
+    second = registry.get("openai", base_url="http://b.local/v1")
+    assert second is not first and not first.closed, "evicted while a call was running"
+    first._track(-1)
+    registry.get("openai", base_url="http://b.local/v1")
+    assert first.closed, "evicted instance was never closed"
+    assert registry.get("openai", base_url="http://a.local/v1") is not first
+    registry.close_all()
+    assert second.closed
+    print("Provider Registry Test Passed.")
+
+def test_micro_batch_dispatcher():
+    # Calls from many threads run side by side up to the slot count, raising the
+    # slot count starts queued calls, and closing cancels what is still queued
+    import asyncio
+    import time
+    from concurrent.futures import CancelledError, ThreadPoolExecutor
+    from src.backends.dispatcher import MicroBatchDispatcher
+    from src.utils.async_runner import shared_runner
+
+    print("\nTesting Micro-Batch Dispatcher...")
+    running = {"now": 0, "peak": 0}
+
+    async def send(n, delay=0.1):
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        await asyncio.sleep(delay)
+        running["now"] -= 1
+        return n * 2
+
+    def outcomes(futures):
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(timeout=5))
+            except CancelledError:
+                results.append("cancelled")
+        return results
+
+    loop = shared_runner().loop
+    dispatcher = MicroBatchDispatcher(send, slots=3)
+    with ThreadPoolExecutor(10) as pool:
+        assert list(pool.map(dispatcher.run, range(10))) == [n * 2 for n in range(10)]
+    assert running["peak"] == 3 and dispatcher.stats["largest_batch"] == 3, (running, dispatcher.stats)
+
+    running["peak"] = 0
+    futures = [dispatcher.submit(n, 0.3) for n in range(6)]
+    time.sleep(0.1)
+    loop.call_soon_threadsafe(dispatcher.set_slots, 6)
+    assert outcomes(futures) == [n * 2 for n in range(6)]
+    assert running["peak"] == 6, running
+
+    loop.call_soon_threadsafe(dispatcher.set_slots, 2)
+    futures = [dispatcher.submit(n, 0.3) for n in range(5)]
+    time.sleep(0.1)
+    shared_runner().finish(dispatcher.aclose())
+    assert outcomes(futures) == [0, 2, "cancelled", "cancelled", "cancelled"], outcomes(futures)
+    print("Micro-Batch Dispatcher Test Passed.")
+
+def test_chunked_optimization():
+    # A raw prompt over the context is split at boundaries, every chunk is analyzed,
+    # the elements are reduced to one set, and data chunks come back verbatim
+    import asyncio
+    import json
+    from src.chunking import MAP_SYSTEM_PROMPT, split_text
+    from src.scheduler import count_tokens
+
+    print("\nTesting Chunked Optimization...")
+    text = "\n\n".join(f"Paragraph {i}. " + "Some instructions here. " * 12 for i in range(6))
+    chunks = split_text(text, 100, count_tokens)
+    assert "".join(chunks) == text and len(chunks) > 1
+    assert all(count_tokens(chunk) <= 100 for chunk in chunks), [count_tokens(c) for c in chunks]
+    assert all(chunk.endswith("\n\n") for chunk in chunks[:-1]), "cut inside a paragraph"
+    blob = "x" * 2000
+    assert "".join(split_text(blob, 100, count_tokens)) == blob
+
+    data = "\n".join(f"row {i},{i * i}" for i in range(60))
+
+    class MapReduce:
+        def __init__(self):
+            self.map_calls = 0
+            self.reduce_calls = 0
+
+        async def agenerate(self, system_prompt, user_prompt, model, **kwargs):
+            if system_prompt == MAP_SYSTEM_PROMPT:
+                self.map_calls += 1
+                answer = {"elements": {"instruction": "part"}, "is_data": "row " in user_prompt}
+            else:
+                self.reduce_calls += 1
+                answer = {"elements": {"instruction": "merged"}, "final_prompt": "Tabulate: {{DATA}}"}
+            return {"content": json.dumps(answer)}
+
+    optimizer = PromptOptimizer("openai", lazy=True, base_url="http://chunks.local/v1")
+    optimizer.provider = provider = MapReduce()
+    result = asyncio.run(optimizer.aoptimize_prompt_chunked("Summarize the table.\n\n" + data, "m",
+                                                            chunk_tokens=120))
+    assert "error" not in result, result
+    assert result["chunked"]["chunks"] == provider.map_calls > 1, (result["chunked"], provider.map_calls)
+    assert result["chunked"]["data_chunks"] >= 1 and provider.reduce_calls >= 1
+    assert result["elements"] == {"instruction": "merged"}
+    assert all(f"row {i},{i * i}" in result["final_prompt"] for i in range(60)), result["final_prompt"]
+    print("Chunked Optimization Test Passed.")
+
+def test_session_metrics():
+    # Blocking and streamed calls to both local server APIs record latency and token
+    # usage, and the saved sessions show up in the per-backend statistics
+    import tempfile
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+    from stub_server import StubConfig, StubServer
+
+    print("\nTesting Session Metrics...")
+    db = DatabaseManager(os.path.join(tempfile.mkdtemp(), "metrics.db"))
+    try:
+        with StubServer(StubConfig(latency=0.01, tokens_per_second=0)) as server:
+            for provider_type, kwargs in (("openai", {"base_url": server.url + "/v1"}), ("ollama", {"host": server.url})):
+                optimizer = PromptOptimizer(provider_type, **kwargs)
+                for stream in (False, True):
+                    prompt = f"Write a haiku about {provider_type} (stream={stream})"
+                    if stream:
+                        events = list(optimizer.optimize_prompt_stream(prompt, "stub-model", use_cache=False,
+                                                                       use_similar=False))
+                        result = events[-1]["result"]
+                    else:
+                        result = optimizer.optimize_prompt(prompt, "stub-model", use_cache=False, use_similar=False)
+                    metrics = result["metrics"]
+                    assert metrics["provider"] == provider_type and metrics["latency_ms"] > 0, metrics
+                    assert metrics["prompt_tokens"] and metrics["completion_tokens"], (provider_type, stream, metrics)
+                    if stream:
+                        assert metrics["ttft_ms"] is not None, metrics
+                    db.add_session(prompt, result["elements"], result["final_prompt"], metrics=metrics)
+        stats = {entry["provider"]: entry for entry in db.backend_percentiles()}
+        for provider_type in ("openai", "ollama"):
+            entry = stats[provider_type]
+            assert entry["calls"] == 2 and entry["tokens_per_second"], entry
+        print("Session Metrics Test Passed.")
+    finally:
+        db.close()
+
+def test_bulk_writes():
+    # Concurrent bulk inserts from several connections get distinct ids, and every
+    # element row belongs to the session it was written with
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy import text
+
+    print("\nTesting Bulk Writes...")
+    path = os.path.join(tempfile.mkdtemp(), "bulk.db")
+    writers = [DatabaseManager(path) for _ in range(4)]
+    try:
+        with writers[0].engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+
+        def write(worker):
+            ids = []
+            for batch in range(10):
+                tags = [f"w{worker}b{batch}i{i}" for i in range(25)]
+                ids += zip(writers[worker % 4].add_sessions(
+                    [{"raw_prompt": tag, "structured_elements": {"persona": tag, "tone": "plain"},
+                      "final_prompt": tag} for tag in tags]
+                ), tags)
+            return ids
+
+        with ThreadPoolExecutor(8) as pool:
+            written = [pair for ids in pool.map(write, range(8)) for pair in ids]
+        assert len(written) == 8 * 10 * 25 and len({session_id for session_id, _ in written}) == len(written)
+        for session_id, tag in written[::37]:
+            session = writers[0].get_session(session_id)
+            assert session.raw_prompt == tag and session.structured_elements == {"persona": tag, "tone": "plain"}
+        assert [row["id"] for row in writers[0].search_sessions(written[-1][1])] == [written[-1][0]]
+        print("Bulk Writes Test Passed.")
+    finally:
+        for writer in writers:
+            writer.close()
+
+def test_search_sessions():
+    # Matches raw prompts, final prompts and element text with stemming and
+    # search-as-you-type prefixes; FTS syntax in the input is taken literally
+    import tempfile
+    from sqlalchemy import text
+
+    print("\nTesting History Search...")
+    db = DatabaseManager(os.path.join(tempfile.mkdtemp(), "search.db"))
+    try:
+        poem = db.add_session("Write a poem about the ocean", {"tone": "melancholic"}, "Compose verses")
+        code = db.add_session("Review my Python code", {"persona": "Senior C++ engineer"}, "Optimizing the loop")
+        assert [r["id"] for r in db.search_sessions("oceans")] == [poem.id]
+        assert [r["id"] for r in db.search_sessions("melanch")] == [poem.id]
+        assert [r["id"] for r in db.search_sessions("optimize loop")] == [code.id]
+        assert "[" in db.search_sessions("verses")[0]["snippet"]
+        for query in ('C++ "engineer', "NOT OR AND", "*", "(", ""):
+            db.search_sessions(query)
+        assert [r["id"] for r in db.search_sessions('C++ "engineer')] == [code.id]
+        with db.engine.begin() as conn:
+            conn.execute(text("DELETE FROM prompt_sessions WHERE id = :id"), {"id": poem.id})
+        assert db.search_sessions("ocean") == []
+        print("History Search Test Passed.")
+    finally:
+        db.close()
+
+def test_history_pages():
+    # Keyset pages cover every session exactly once, newest first, including
+    # sessions that share a timestamp across a page boundary
+    import tempfile
+    from datetime import datetime, timedelta
+
+    print("\nTesting History Pages...")
+    db = DatabaseManager(os.path.join(tempfile.mkdtemp(), "pages.db"))
+    try:
+        base = datetime(2024, 1, 1)
+        db.add_sessions([{"raw_prompt": f"prompt {i}", "structured_elements": {}, "final_prompt": "",
+                          "timestamp": base + timedelta(minutes=i // 7)} for i in range(230)])
+        rows, before = [], None
+        while True:
+            page = db.get_history_page(40, before)
+            rows += page
+            if len(page) < 40:
+                break
+            before = (page[-1]["timestamp"], page[-1]["id"])
+        keys = [(row["timestamp"], row["id"]) for row in rows]
+        assert len(rows) == 230 and len(set(keys)) == 230, len(rows)
+        assert keys == sorted(keys, reverse=True)
+        assert rows[0]["preview"] == "prompt 229"
+        print("History Pages Test Passed.")
+    finally:
+        db.close()
+
+def test_batch_optimizer():
+    # Records are parsed leniently, run concurrently up to the provider's limit, and
+    # the input is read only a little ahead of the results, so it can be a stream
+    import itertools
+    import json
+    import threading
+    import time
+    from src.batch import BatchOptimizer, read_prompts
+
+    print("\nTesting Batch Optimizer...")
+
+    class Counting(_FakeProvider):
+        max_concurrency = 3
+
+        def __init__(self):
+            super().__init__("batched")
+            self.lock = threading.Lock()
+            self.running = self.peak = 0
+
+        def generate(self, system_prompt, user_prompt, model, **kwargs):
+            with self.lock:
+                self.running += 1
+                self.peak = max(self.peak, self.running)
+            time.sleep(0.02)
+            with self.lock:
+                self.running -= 1
+            return super().generate(system_prompt, user_prompt, model)
+
+    lines = ['{"id": "a", "prompt": "first"}', "plain text prompt", "", '["not", "a", "record"]',
+             '{"id": "b", "note": "no prompt"}', '{"request_id": 7, "text": "third"}']
+    items = list(read_prompts(lines))
+    assert [item["id"] for item in items] == ["a", 2, 4, "b", 7]
+    assert [item.get("raw_prompt") for item in items] == ["first", "plain text prompt", None, None, "third"]
+
+    optimizer = PromptOptimizer("openai", lazy=True, base_url="http://batch.local/v1")
+    optimizer.provider = provider = Counting()
+    batch = BatchOptimizer(optimizer, "openai")
+    results = {result["id"]: result for result in batch.run(items, "m")}
+    assert set(results) == {"a", 2, 4, "b", 7}
+    assert "error" in results[4] and "error" in results["b"] and results[7]["final_prompt"] == "batched"
+
+    pulled = itertools.count()
+    endless = ({"id": next(pulled), "raw_prompt": f"prompt {i}"} for i in itertools.count())
+    first = list(itertools.islice(batch.run(endless, "m"), 12))
+    assert len(first) == 12 and next(pulled) <= 12 + 2 * batch.threads + 1
+    assert provider.peak == 3, provider.peak
+    print("Batch Optimizer Test Passed.")
+
+class _FakeRegistry:
+    # Hands out fake providers by base_url and records which ones were built
+    def __init__(self, providers):
+        self.providers = providers
+        self.built = []
+
+    def get(self, provider_type, **kwargs):
+        self.built.append(kwargs["base_url"])
+        return self.providers[kwargs["base_url"]]
+
+def test_hedged_optimization():
+    # A slow primary is hedged with the next backup after the delay and loses; a
+    # failed attempt is replaced at once, and backups never launched are never built
+    import asyncio
+    import time
+
+    print("\nTesting Hedged Optimization...")
+
+    class Slow(_FakeProvider):
+        cancelled = False
+
+        async def agenerate(self, system_prompt, user_prompt, model, **kwargs):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                self.cancelled = True
+                raise
+            return self._answer()
+
+    class Failing(_FakeProvider):
+        async def agenerate(self, system_prompt, user_prompt, model, **kwargs):
+            raise RuntimeError("backend down")
+
+    registry = _FakeRegistry({"http://fast/v1": _FakeProvider("fast"), "http://unused/v1": _FakeProvider("unused")})
+    optimizer = PromptOptimizer("openai", registry=registry, lazy=True, base_url="http://primary/v1")
+    optimizer.provider = slow = Slow("slow")
+    backups = [("openai", "backup-model", {"base_url": "http://fast/v1"}),
+               ("openai", "backup-model", {"base_url": "http://unused/v1"})]
+    result = optimizer.optimize_prompt_hedged("Hedge me", "m", backups, hedge_delay=0.05)
+    assert result["final_prompt"] == "fast", result
+    assert result["hedge"] == {"winner": "openai/backup-model", "attempts": 2}
+    assert registry.built == ["http://fast/v1"]
+    # The losing attempt is cancelled on the loop, possibly just after the result returned
+    deadline = time.perf_counter() + 1
+    while not slow.cancelled and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    assert slow.cancelled, "losing attempt kept running"
+
+    optimizer.provider = Failing("down")
+    start = time.perf_counter()
+    result = optimizer.optimize_prompt_hedged("Hedge me again", "m", backups[1:], hedge_delay=5)
+    assert result["final_prompt"] == "unused" and time.perf_counter() - start < 1, result
+
+    optimizer.provider = Failing("down")
+    result = optimizer.optimize_prompt_hedged("Nothing works", "m", [], hedge_delay=0.05)
+    assert "backend down" in result["error"]
+    print("Hedged Optimization Test Passed.")
+
+def test_fanout_optimization():
+    # Every target runs concurrently and gets its own result, in target order; a
+    # failing target only fails its own entry
+    import asyncio
+
+    print("\nTesting Fan-Out Optimization...")
+
+    class Delayed(_FakeProvider):
+        async def agenerate(self, system_prompt, user_prompt, model, **kwargs):
+            await asyncio.sleep(0.2)
+            return self._answer()
+
+    class Failing(_FakeProvider):
+        async def agenerate(self, system_prompt, user_prompt, model, **kwargs):
+            raise RuntimeError("backend down")
+
+    registry = _FakeRegistry({"http://a/v1": Delayed("from a"), "http://b/v1": Failing("never"),
+                              "http://c/v1": Delayed("from c")})
+    optimizer = PromptOptimizer("openai", registry=registry, lazy=True, base_url="http://a/v1")
+    targets = [("openai", "m1", {"base_url": "http://a/v1"}), ("openai", "m2", {"base_url": "http://b/v1"}),
+               ("openai", "m3", {"base_url": "http://c/v1"})]
+    seen = []
+    outcome = optimizer.optimize_prompt_fanout("Compare me", targets, on_result=lambda i, r: seen.append(i))
+    results = outcome["results"]
+    assert [r.get("final_prompt") for r in results] == ["from a", None, "from c"]
+    assert "backend down" in results[1]["error"]
+    assert [r["target"] for r in results] == [{"provider": "openai", "model": m} for m in ("m1", "m2", "m3")]
+    assert seen[0] == 1 and sorted(seen) == [0, 1, 2]
+    assert outcome["elapsed_ms"] < 380, outcome["elapsed_ms"]
+    print("Fan-Out Optimization Test Passed.")
+
+def test_optimize_prompt_stream():
+    # Fields are emitted as soon as they close, before the response has finished;
+    # a cached result replays its fields without tokens
+    import json
+    import os
+    import tempfile
+    from src.cache import ResponseCache
+
+    print("\nTesting Streamed Optimization...")
+
+    class Streaming(_FakeProvider):
+        def stream_generate(self, system_prompt, user_prompt, model, **kwargs):
+            text = self._answer()["content"]
+            for i in range(0, len(text), 7):
+                yield text[i:i + 7]
+
+    optimizer = PromptOptimizer("openai", lazy=True, base_url="http://stream.local/v1")
+    optimizer.provider = Streaming("streamed final")
+    optimizer.cache = ResponseCache(os.path.join(tempfile.mkdtemp(), "cache.db"))
+    events = list(optimizer.optimize_prompt_stream("Stream me", "m", use_similar=False))
+    kinds = [event["type"] for event in events]
+    tokens = [event["text"] for event in events if event["type"] == "token"]
+    assert json.loads("".join(tokens))["final_prompt"] == "streamed final"
+    assert kinds.index("element") < len(kinds) - 1 - kinds[::-1].index("token"), kinds
+    assert kinds[-2:] == ["final_prompt", "result"]
+    assert events[kinds.index("element")] == {"type": "element", "key": "persona", "value": "tester"}
+    assert kinds[-1] == "result" and events[-1]["result"]["final_prompt"] == "streamed final"
+
+    replay = list(optimizer.optimize_prompt_stream("Stream me", "m", use_similar=False))
+    assert [event["type"] for event in replay] == ["element", "final_prompt", "result"]
+    assert replay[-1]["result"].get("cached") and optimizer.provider.calls == 1
+    optimizer.cache.close()
+    print("Streamed Optimization Test Passed.")
+
+def test_lazy_imports():
+    # Importing the app's modules and creating a lazy optimizer loads no provider SDK;
+    # the SDK is imported when its backend is first created
+    import subprocess
+
+    print("\nTesting Lazy Imports...")
+    script = (
+        "import sys\n"
+        "sdks = ('openai', 'anthropic', 'groq', 'ollama', 'llama_cpp', 'google.generativeai', 'GPUtil', 'keyring')\n"
+        "from src.optimizer import PromptOptimizer\n"
+        "import src.batch, src.database\n"
+        "optimizer = PromptOptimizer('openai', lazy=True, base_url='http://lazy.local/v1')\n"
+        "print(','.join(m for m in sdks if m in sys.modules))\n"
+        "optimizer.provider\n"
+        "print(','.join(m for m in sdks if m in sys.modules))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.splitlines()
+    assert output == ["", "openai"], output
+    print("Lazy Imports Test Passed.")
+
+def test_hardware_sampler():
+    # The ring buffer keeps the newest samples in order once it wraps, windows are
+    # summarized by time, and a machine without a GPU is only probed once
+    import math
+    import time
+    from src.utils import hardware_monitor
+    from src.utils.hardware_monitor import HardwareSampler
+
+    print("\nTesting Hardware Sampler...")
+    probes = []
+    original = hardware_monitor._get_gpus
+    hardware_monitor._get_gpus = lambda: probes.append(1) or []
+    try:
+        sampler = HardwareSampler(interval=0.01, capacity=4)
+        assert sampler.latest() is None and len(sampler.snapshot()["time"]) == 0
+        taken = []
+        for _ in range(6):
+            taken.append(sampler.sample()["time"])
+            time.sleep(0.002)
+    finally:
+        hardware_monitor._get_gpus = original
+
+    data = sampler.snapshot()
+    assert list(data["time"]) == taken[-4:]
+    assert math.isnan(sampler.latest()["gpu_load"]) and len(probes) == 1
+    assert len(sampler.snapshot(since=taken[4])["time"]) == 2
+    window = sampler.summary(taken[3], taken[4])
+    assert window["samples"] == 2 and window["gpu_load_mean"] is None and window["cpu_peak"] is not None
+    assert len(sampler.sparkline("cpu")) == 4
+
+    sampler.start()
+    time.sleep(0.1)
+    sampler.stop()
+    assert sampler.latest()["time"] > taken[-1] and len(probes) == 1
+    print("Hardware Sampler Test Passed.")
+
+def test_resource_profiler():
+    # A profiled call reports the CPU time it burned with the backend settings, and
+    # no sampling thread outlives its request, even a cancelled one
+    import asyncio
+    import threading
+    import time
+    from src.utils.async_runner import shared_runner
+
+    print("\nTesting Resource Profiler...")
+
+    class Busy(_FakeProvider):
+        def generate(self, system_prompt, user_prompt, model, **kwargs):
+            end = time.process_time() + 0.2
+            while time.process_time() < end:
+                pass
+            return self._answer()
+
+        async def agenerate(self, system_prompt, user_prompt, model, **kwargs):
+            await asyncio.sleep(5)
+            return self._answer()
+
+    def profilers():
+        return [t for t in threading.enumerate() if t.name == "resource-profiler"]
+
+    optimizer = PromptOptimizer("llamacpp", lazy=True, model_path="/models/fake.gguf", n_ctx=2048, n_gpu_layers=0)
+    optimizer.provider = Busy("profiled")
+    optimizer.profile_resources = True
+    resources = optimizer.optimize_prompt("Profile me", "m", use_cache=False, use_similar=False)["resources"]
+    assert resources["cpu_time_ms"] >= 150 and resources["resource_samples"] > 0, resources
+    assert resources["n_ctx"] == 2048 and resources["n_gpu_layers"] == 0
+    assert not profilers()
+
+    future = shared_runner().submit(optimizer.aoptimize_prompt("Cancel me", "m", use_cache=False, use_similar=False))
+    deadline = time.perf_counter() + 2
+    while not profilers() and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    assert profilers(), "profiler never started"
+    future.cancel()
+    deadline = time.perf_counter() + 2
+    while profilers() and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    assert not profilers(), "profiler kept sampling after cancellation"
+    print("Resource Profiler Test Passed.")
+
+def test_prompt_templates():
+    # Registered template text can't change under the same version, every request
+    # shares the template's prefix, and cached prompt tokens are read from each usage shape
+    from src.templates import OPTIMIZE_TEMPLATE, PromptTemplate, TemplateRegistry, default_templates
+    from src.utils.metrics import extract_usage
+
+    print("\nTesting Prompt Templates...")
+    registry = TemplateRegistry()
+    first = registry.register(PromptTemplate("t", 1, "System.", "Lead-in:\n\n{input}"))
+    assert registry.register(PromptTemplate("t", 1, "System.", "Lead-in:\n\n{input}")) is first
+    try:
+        registry.register(PromptTemplate("t", 1, "Changed system.", "Lead-in:\n\n{input}"))
+        assert False, "changed text registered under an existing version"
+    except ValueError:
+        pass
+    registry.register(PromptTemplate("t", 2, "Changed system."))
+    assert registry.get("t").version == 2 and registry.get("t", 1) is first and registry.versions("t") == [1, 2]
+    try:
+        PromptTemplate("bad", 1, "System.", "{input} then more text")
+        assert False, "template with text after the input accepted"
+    except ValueError:
+        pass
+
+    assert default_templates.get("optimize") is OPTIMIZE_TEMPLATE
+    optimizer = PromptOptimizer("openai", lazy=True, base_url="http://templates.local/v1")
+    assert optimizer.system_prompt == OPTIMIZE_TEMPLATE.system_prompt
+    one, two = optimizer._build_user_prompt("First {request}"), optimizer._build_user_prompt("Second")
+    assert one.startswith(OPTIMIZE_TEMPLATE.lead_in) and two.startswith(OPTIMIZE_TEMPLATE.lead_in)
+    assert one.endswith("First {request}")
+
+    class Tokenizer:
+        calls = 0
+
+        def count_tokens(self, text):
+            Tokenizer.calls += 1
+            return 42
+
+    tokenizer = Tokenizer()
+    assert first.prefix_tokens(tokenizer) == 42 and first.prefix_tokens(tokenizer) == 42 and Tokenizer.calls == 1
+
+    assert extract_usage({"usage": {"prompt_tokens": 900, "completion_tokens": 10,
+                                    "prompt_tokens_details": {"cached_tokens": 768}}})["cached_tokens"] == 768
+    anthropic = extract_usage({"usage": {"input_tokens": 20, "output_tokens": 5,
+                                         "cache_read_input_tokens": 700, "cache_creation_input_tokens": 0}})
+    assert anthropic == {"prompt_tokens": 720, "completion_tokens": 5, "cached_tokens": 700}
+    assert extract_usage({"prompt_eval_count": 300, "eval_count": 12})["cached_tokens"] is None
+    print("Prompt Templates Test Passed.")
+
+def test_async_provider_contract():
+    # A provider that only implements the blocking calls still serves concurrent
+    # async requests side by side, off the event loop
+    import asyncio
+    import threading
+    import time
+    from src.backends.provider_interface import LLMProvider
+    from src.utils.async_runner import shared_runner
+
+    print("\nTesting Async Provider Contract...")
+
+    class Blocking(LLMProvider):
+        def generate(self, system_prompt, user_prompt, model, **kwargs):
+            time.sleep(0.2)
+            return {"content": user_prompt, "thread": threading.current_thread()}
+
+        def list_models(self):
+            time.sleep(0.2)
+            return ["only-model"]
+
+        def check_health(self):
+            return True
+
+        def get_name(self):
+            return "Blocking"
+
+    provider = Blocking()
+
+    async def run():
+        loop_thread = threading.current_thread()
+        start = time.perf_counter()
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while time.perf_counter() - start < 0.15:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        results = await asyncio.gather(*(provider.agenerate("s", f"u{i}", "m") for i in range(4)),
+                                       provider.alist_models(), tick())
+        return results, loop_thread, time.perf_counter() - start, ticks
+
+    results, loop_thread, elapsed, ticks = shared_runner().run(run())
+    assert [r["content"] for r in results[:4]] == ["u0", "u1", "u2", "u3"] and results[4] == ["only-model"]
+    assert all(r["thread"] is not loop_thread for r in results[:4])
+    assert elapsed < 0.5 and ticks >= 5, (elapsed, ticks)
+    print("Async Provider Contract Test Passed.")
+
 if __name__ == "__main__":
     test_core()
+    test_scheduler_rate_wakeup()
+    test_cache_provider_identity()
+    test_similarity_requires_same_tokens()
+    test_migrate_elements_json()
+    test_stream_parser()
+    test_resilient_provider()
+    test_provider_registry()
+    test_micro_batch_dispatcher()
+    test_chunked_optimization()
+    test_session_metrics()
+    test_bulk_writes()
+    test_search_sessions()
+    test_history_pages()
+    test_batch_optimizer()
+    test_hedged_optimization()
+    test_fanout_optimization()
+    test_optimize_prompt_stream()
+    test_lazy_imports()
+    test_hardware_sampler()
+    test_resource_profiler()
+    test_prompt_templates()
+    test_async_provider_contract()